@@ -0,0 +1,52 @@
+# latency of checkout (/api/insert_product_bill) at several sizes of the database
+# a checkout reads and updates records by primary key, so its latency should stay flat as sales grow,
+# each scale is generated into its own sqlite database and measured by routes.py in a separate process,
+# since the apps bind to their database when they are imported
+#
+# run from the repository root:
+# $ python benchmarks/checkout_scaling.py --scales tiny small medium --output checkout.json
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+
+from routes import SCALES
+
+# name of the checkout route in results of routes.py
+CHECKOUT_ROUTE = '/api/insert_product_bill'
+
+
+def measure(scale, repeat, seed):
+    """Return routes.py results of checkout on a new database of given scale"""
+    with tempfile.TemporaryDirectory() as directory:
+        output_path = os.path.join(directory, 'results.json')
+        subprocess.run([sys.executable, os.path.join(BENCHMARKS, 'routes.py'), '--scale', scale, '--seed', str(seed),
+                        '--repeat', str(repeat), '--apps', 'insertion_api', '--routes', CHECKOUT_ROUTE, '--output', output_path],
+                       check=True, stdout=subprocess.DEVNULL)
+        with open(output_path) as output:
+            return json.load(output)['routes'][CHECKOUT_ROUTE]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='measure checkout latency at several generated database sizes')
+    parser.add_argument('--scales', nargs='+', choices=SCALES, default=['tiny', 'small', 'medium'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=200, help='checkouts measured at each scale after the first (cold) one')
+    parser.add_argument('--output', help='json file to write results of each scale to')
+    args = parser.parse_args()
+
+    results = {}
+    print(f'{"scale":<8} {"p50 ms":>10} {"p95 ms":>10} {"p99 ms":>10} {"cold ms":>10} {"errors":>6}')
+    for scale in args.scales:
+        result = measure(scale, args.repeat, args.seed)
+        results[scale] = result
+        print(f'{scale:<8} {result["p50_ms"]:10.2f} {result["p95_ms"]:10.2f} {result["p99_ms"]:10.2f} {result["cold_ms"]:10.2f} {result["errors"]:6d}')
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
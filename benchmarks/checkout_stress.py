@@ -0,0 +1,160 @@
+# stress test of concurrent checkouts through /api/insert_product_bill
+# many threads start their checkout of the same product lot at the same time, each into its own bill, while the store has
+# less of it in stock than all of them want together, then the test checks that stock was never oversold:
+# final stock, number of product_bill records and monthly rollup totals must all match the checkouts that succeeded
+#
+# the test adds bills and sales to the database and sets the stock of one lot, so run it on a test database,
+# from the repository root, e.g. on mysql where row locks of the conditional stock update are what keeps stock consistent:
+# $ python benchmarks/checkout_stress.py --db-address mysql://root:@localhost:3306/RSM_TEST --threads 200 --stock 50
+import argparse
+import collections
+import datetime as dt
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+MERGED = os.path.join(ROOT, 'merged')
+
+
+def prepare(engine, schema, threads, stock):
+    """Set stock of a stocked lot and add one bill for each thread in its store, return values the checkouts use"""
+    from sqlalchemy import select, func, insert, update
+
+    bill = schema.table('bill')
+    store_product = schema.table('store_product')
+    product_lot = schema.table('product_lot')
+    product = schema.table('product')
+    with engine.begin() as conn:
+        (store_id, lot_id) = conn.execute(select([store_product.columns.store_id, store_product.columns.product_lot_id])
+                                          .order_by(store_product.columns.store_id, store_product.columns.product_lot_id)).first()
+        (category_id, manufacturer_id) = conn.execute(select([product.columns.category_id, product.columns.manufacturer_id])
+                                                      .select_from(product_lot.join(product, product.columns.product_id == product_lot.columns.product_id))
+                                                      .where(product_lot.columns.product_lot_id == lot_id)).first() or (None, None)
+        conn.execute(update(store_product)
+                     .where((store_product.columns.store_id == store_id) & (store_product.columns.product_lot_id == lot_id))
+                     .values(in_stock=stock))
+
+        # product_bill has one record for a lot in a bill, so every checkout gets its own bill
+        # ids are given since not every backend generates ids
+        first_bill_id = (conn.execute(select([func.max(bill.columns.bill_id)])).scalar() or 0) + 1
+        date = dt.date.today()
+        conn.execute(insert(bill), [{'bill_id': first_bill_id + i, 'date': date, 'store_id': store_id, 'customer_id': None}
+                                    for i in range(threads)])
+
+    return {'store_id': store_id, 'lot_id': lot_id, 'category_id': category_id, 'manufacturer_id': manufacturer_id,
+            'bill_ids': list(range(first_bill_id, first_bill_id + threads)), 'date': date}
+
+
+def rollup_quantities(engine, schema, values):
+    """Return total quantity of the month of the checkouts in each rollup of their store, category and manufacturer"""
+    from sqlalchemy import select
+
+    keys = {'sales_store_month': ('store_id', values['store_id']),
+            'sales_category_month': ('category_id', values['category_id']),
+            'sales_manufacturer_month': ('manufacturer_id', values['manufacturer_id'])}
+    quantities = {}
+    with engine.connect() as conn:
+        for (table_name, (key_column, key_value)) in keys.items():
+            if key_value is None:
+                continue
+            rollup = schema.table(table_name)
+            stmt = select([rollup.columns.total_quantity])\
+                   .where((rollup.columns[key_column] == key_value) &
+                          (rollup.columns.year == values['date'].year) &
+                          (rollup.columns.month == values['date'].month))
+            quantities[table_name] = conn.execute(stmt).scalar() or 0
+    return quantities
+
+
+def sold(engine, schema, values):
+    """Return stock left of the lot and number of product_bill records of the test bills"""
+    from sqlalchemy import select, func
+
+    store_product = schema.table('store_product')
+    product_bill = schema.table('product_bill')
+    with engine.connect() as conn:
+        in_stock = conn.execute(select([store_product.columns.in_stock])
+                                .where((store_product.columns.store_id == values['store_id']) &
+                                       (store_product.columns.product_lot_id == values['lot_id']))).scalar()
+        records = conn.execute(select([func.count()])
+                               .where(product_bill.columns.bill_id.in_(values['bill_ids']))).scalar()
+    return in_stock, records
+
+
+def run_checkouts(app, values, quantity):
+    """Post one checkout of the lot into each bill from its own thread, all started together, return count of each response message"""
+    barrier = threading.Barrier(len(values['bill_ids']))
+    messages = collections.Counter()
+    lock = threading.Lock()
+
+    def checkout(bill_id):
+        client = app.test_client()
+        barrier.wait()
+        body = client.post('/api/insert_product_bill', json={'bill_id': bill_id, 'product_lot_id': values['lot_id'], 'quantity': quantity}).get_json()
+        with lock:
+            messages[body['message']] += 1
+
+    threads = [threading.Thread(target=checkout, args=(bill_id,)) for bill_id in values['bill_ids']]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return messages
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='check that concurrent checkouts never oversell stock')
+    parser.add_argument('--db-address', help='database to use instead of the one of dbaddress.py')
+    parser.add_argument('--threads', type=int, default=200, help='concurrent checkouts')
+    parser.add_argument('--stock', type=int, default=50, help='stock of the lot before the checkouts')
+    parser.add_argument('--quantity', type=int, default=1, help='quantity of each checkout')
+    args = parser.parse_args()
+
+    # the apps read the database address when they are imported, and dbaddress.py relative to merged folder
+    if args.db_address:
+        os.environ['RSM_DB_ADDRESS'] = args.db_address
+    sys.path[:0] = [ROOT, MERGED]
+    os.chdir(MERGED)
+
+    import insertion_api
+    from database import engine
+    from schema import schema
+
+    schema.reflect()
+    values = prepare(engine, schema, args.threads, args.stock)
+    rollups_before = rollup_quantities(engine, schema, values)
+
+    start = time.perf_counter()
+    messages = run_checkouts(insertion_api.app, values, args.quantity)
+    elapsed = time.perf_counter() - start
+
+    in_stock, records = sold(engine, schema, values)
+    rollups_after = rollup_quantities(engine, schema, values)
+    engine.dispose()
+
+    succeeded = messages['Successfully inserted into product_bill table']
+    print(f'{args.threads} checkouts of {args.quantity} from stock {args.stock} in {elapsed:.2f} s on {engine.dialect.name}')
+    for (message, count) in messages.most_common():
+        print(f'  {count:5d}  {message}')
+    print(f'stock left {in_stock}, product_bill records {records}')
+
+    # every unit taken from stock is in exactly one product_bill record and in the rollups, and no more was sold than in stock
+    failures = []
+    if in_stock != args.stock - succeeded * args.quantity:
+        failures.append(f'stock left is {in_stock}, expected {args.stock - succeeded * args.quantity}')
+    if in_stock < 0:
+        failures.append('stock was oversold')
+    if records != succeeded:
+        failures.append(f'{records} product_bill records for {succeeded} successful checkouts')
+    if succeeded != min(args.threads, args.stock // args.quantity):
+        failures.append(f'{succeeded} checkouts succeeded, expected {min(args.threads, args.stock // args.quantity)}')
+    for (table_name, quantity) in rollups_after.items():
+        if quantity - rollups_before[table_name] != succeeded * args.quantity:
+            failures.append(f'{table_name} quantity grew by {quantity - rollups_before[table_name]}, expected {succeeded * args.quantity}')
+
+    for failure in failures:
+        print(f'FAILED: {failure}')
+    print('ok' if not failures else f'{len(failures)} checks failed')
+    sys.exit(1 if failures else 0)
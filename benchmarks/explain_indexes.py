@@ -0,0 +1,72 @@
+# check that the sales insight queries use the indexes created by database_creation.create_indexes
+# every query is explained on the database of dbaddress.py and the index used for each table is printed,
+# tables read without an index are reported as full scans
+#
+# run from the repository root:
+# $ python benchmarks/explain_indexes.py --year 2022
+import argparse
+import os
+import sys
+
+from sqlalchemy import create_engine, MetaData, text
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'merged'))
+from dbaddress import DB_ADDRESS
+import sales_queries
+
+
+def queries(metadata_obj, yr):
+    """Return insight queries to explain, by name"""
+    return {
+        'total_sales_by_store': sales_queries.total_sales_by_store_query(metadata_obj, yr),
+        'total_monthly_sales': sales_queries.total_monthly_sales_query(metadata_obj, yr),
+        'category_sales': sales_queries.category_sales_query(metadata_obj, yr),
+        'store_month_rollup': sales_queries.store_month_rollup_query(metadata_obj, yr),
+        'category_month_rollup': sales_queries.category_month_rollup_query(metadata_obj, yr)
+    }
+
+
+def explain(conn, stmt):
+    """Return list of (table, index) read by given statement, index is None for full table scans"""
+    sql = str(stmt.compile(conn, compile_kwargs={'literal_binds': True}))
+
+    if conn.dialect.name == 'sqlite':
+        # sqlite describes each step as e.g. 'SEARCH bill USING INDEX ix_bill_date (date>? AND date<?)'
+        steps = []
+        for row in conn.execute(text('EXPLAIN QUERY PLAN ' + sql)):
+            words = row[-1].split()
+            if words[0] not in ('SCAN', 'SEARCH'):
+                continue
+            index = None
+            if 'PRIMARY' in words:
+                index = 'PRIMARY'
+            elif 'INDEX' in words:
+                index = words[words.index('INDEX') + 1]
+            steps.append((words[1], index))
+        return steps
+
+    # mysql gives one row per table with the index used in key column
+    return [(row['table'], row['key']) for row in conn.execute(text('EXPLAIN ' + sql)).mappings()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='show indexes used by sales insight queries')
+    parser.add_argument('--year', type=int, default=2022)
+    args = parser.parse_args()
+
+    engine = create_engine(DB_ADDRESS)
+    metadata_obj = MetaData()
+    metadata_obj.reflect(engine)
+
+    full_scans = 0
+    with engine.connect() as conn:
+        for (name, stmt) in queries(metadata_obj, args.year).items():
+            print(name)
+            for (table, index) in explain(conn, stmt):
+                print(f'    {table:<24} {index or "full scan"}')
+                full_scans += index is None
+    engine.dispose()
+
+    print(f'{full_scans} full table scans')
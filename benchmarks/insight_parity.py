@@ -0,0 +1,102 @@
+# check that sales insights computed by duckdb are the same as the ones computed by pandas, and compare their latency
+# every insight route of pandas_api is called with INSIGHT_ENGINE set to 'pandas' and to 'duckdb',
+# with rollup tables and sql pushdown turned off so that both engines compute all insights from the cached tables
+# responses must be equal, apart from float rounding, and the median latency of warm calls is reported for each engine
+#
+# run from the repository root, on the database of dbaddress.py or the one given:
+# $ python benchmarks/insight_parity.py --db-address sqlite:///rsm.db
+import argparse
+import math
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+MERGED = os.path.join(ROOT, 'merged')
+
+ENGINES = ['pandas', 'duckdb']
+
+# relative difference allowed between floats, sums are added up in another order by duckdb
+FLOAT_TOLERANCE = 1e-9
+
+
+def insight_routes(years):
+    """Return urls of all insight routes computed by INSIGHT_ENGINE, routes with year are called for each of given years"""
+    routes = ['/api/popular_products', '/api/average_monthly_sales', '/api/avg_bill_sales', '/api/gender_category',
+              '/api/total_manufacturer_sales', '/api/total_category_sales']
+    for year in years:
+        routes += [f'/api/total_sales_store/{year}', f'/api/popular_products/{year}', f'/api/total_monthly_sales/{year}',
+                   f'/api/category_sales/{year}']
+    return routes
+
+
+def differences(expected, actual, path=''):
+    """Return paths at which actual json differs from expected json"""
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        if expected.keys() != actual.keys():
+            return [f'{path} keys {sorted(expected)} != {sorted(actual)}']
+        return [difference for key in expected for difference in differences(expected[key], actual[key], f'{path}.{key}')]
+    if isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            return [f'{path} length {len(expected)} != {len(actual)}']
+        return [difference for (i, (e, a)) in enumerate(zip(expected, actual)) for difference in differences(e, a, f'{path}[{i}]')]
+    if isinstance(expected, float) and isinstance(actual, (int, float)) and not isinstance(actual, bool):
+        return [] if math.isclose(expected, actual, rel_tol=FLOAT_TOLERANCE) else [f'{path} {expected!r} != {actual!r}']
+    return [] if expected == actual and type(expected) == type(actual) else [f'{path} {expected!r} != {actual!r}']
+
+
+def timed_calls(client, url, repeat):
+    """Return json of a route and median latency in ms of repeat calls after one cold call"""
+    body = client.get(url).get_json()
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        client.get(url).get_data()
+        latencies.append(time.perf_counter() - start)
+    return body, statistics.median(latencies) * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compare sales insights computed by pandas and by duckdb')
+    parser.add_argument('--db-address', help='database to use instead of the one of dbaddress.py')
+    parser.add_argument('--years', nargs='+', type=int, help='years of yearly insights, all years having bills when not given')
+    parser.add_argument('--repeat', type=int, default=5, help='warm calls of each route with each engine')
+    args = parser.parse_args()
+
+    # the apps read the database address when they are imported, and dbaddress.py relative to merged folder
+    if args.db_address:
+        os.environ['RSM_DB_ADDRESS'] = args.db_address
+    sys.path[:0] = [ROOT, MERGED]
+    os.chdir(MERGED)
+
+    import pandas_api
+    from database import engine
+    from schema import schema
+    from table_cache import table_cache
+
+    schema.reflect()
+    pandas_api.USE_ROLLUPS = False
+    pandas_api.SQL_PUSHDOWN = False
+    client = pandas_api.app.test_client()
+    years = args.years or sorted(int(year) for year in table_cache.get('bill', engine)['year'].unique())
+
+    mismatches = 0
+    print(f'{"route":<40} {"pandas ms":>10} {"duckdb ms":>10} {"speedup":>8}  result')
+    for url in insight_routes(years):
+        bodies = {}
+        latencies = {}
+        for engine_name in ENGINES:
+            pandas_api.INSIGHT_ENGINE = engine_name
+            (bodies[engine_name], latencies[engine_name]) = timed_calls(client, url, args.repeat)
+
+        found = differences(bodies['pandas'], bodies['duckdb'])
+        mismatches += bool(found)
+        speedup = latencies['pandas'] / latencies['duckdb'] if latencies['duckdb'] else float('nan')
+        print(f'{url:<40} {latencies["pandas"]:10.2f} {latencies["duckdb"]:10.2f} {speedup:8.2f}  {"same" if not found else "DIFFERENT"}')
+        for difference in found[:5]:
+            print(f'    {difference}')
+
+    engine.dispose()
+    print(f'{mismatches} routes differ')
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,117 @@
+# check that insights computed from cached tables see sales added to a bill after a later bill got its sales
+# stores check out at the same time, so bill A may be opened before bill B but get its product_bill records after B's,
+# the sales refresher then has to fetch records of A although B's were already fetched, this checks that total sales of
+# each store given by pandas and by duckdb from cached tables stay the same as the ones aggregated by the database
+#
+# the check adds bills and sales to the database, a new sqlite database is generated when no database is given,
+# run from the repository root:
+# $ python benchmarks/interleaved_bills.py
+import argparse
+import contextlib
+import datetime as dt
+import os
+import sys
+import tempfile
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(BENCHMARKS, '..'))
+MERGED = os.path.join(ROOT, 'merged')
+
+# insight engines whose responses are compared with the ones aggregated by the database
+ENGINES = ['pandas', 'duckdb']
+
+
+def stocked_lots(engine, schema):
+    """Return (store_id, product_lot_id) of a lot in stock in two different stores, with enough stock for the checks"""
+    from sqlalchemy import select, update
+
+    store_product = schema.table('store_product')
+    stmt = select([store_product.columns.store_id, store_product.columns.product_lot_id])\
+           .order_by(store_product.columns.store_id, store_product.columns.product_lot_id)
+    with engine.begin() as conn:
+        lots = {}
+        for (store_id, lot_id) in conn.execute(stmt):
+            lots.setdefault(store_id, lot_id)
+        (store_a, store_b) = list(lots)[:2]
+        for store_id in (store_a, store_b):
+            conn.execute(update(store_product)
+                         .where((store_product.columns.store_id == store_id) & (store_product.columns.product_lot_id == lots[store_id]))
+                         .values(in_stock=1000))
+    return (store_a, lots[store_a]), (store_b, lots[store_b])
+
+
+def open_bill(engine, schema, store_id):
+    """Insert a new bill of given store dated today and return its id, ids are given since not every backend generates them"""
+    from sqlalchemy import select, func, insert
+
+    bill = schema.table('bill')
+    with engine.begin() as conn:
+        bill_id = conn.execute(select([func.max(bill.columns.bill_id)])).scalar() + 1
+        conn.execute(insert(bill).values(bill_id=bill_id, date=dt.date.today(), store_id=store_id, customer_id=None))
+    return bill_id
+
+
+def checkout(client, bill_id, lot_id, quantity):
+    body = client.post('/api/insert_product_bill', json={'bill_id': bill_id, 'product_lot_id': lot_id, 'quantity': quantity}).get_json()
+    assert body['status'] == 200, body['message']
+
+
+def store_sales(pandas_api, client, engine_name):
+    """Return total sales of each store this year computed by given engine, or by the database for 'sql'"""
+    pandas_api.SQL_PUSHDOWN = engine_name == 'sql'
+    pandas_api.INSIGHT_ENGINE = engine_name if engine_name != 'sql' else 'pandas'
+    return client.get(f'/api/total_sales_store/{dt.date.today().year}').get_json()['data']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='check insights from cached tables see sales added to earlier open bills')
+    parser.add_argument('--db-address', help='database to use, a new sqlite database is created and filled when not given')
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    db_address = args.db_address or f'sqlite:///{os.path.join(directory.name, "interleaved.db")}'
+
+    # the apps read the database address when they are imported, and dbaddress.py relative to merged folder
+    os.environ['RSM_DB_ADDRESS'] = db_address
+    sys.path[:0] = [ROOT, MERGED, BENCHMARKS]
+    os.chdir(MERGED)
+
+    if args.db_address is None:
+        from routes import seed_database
+        # progress of the generator is left out
+        with contextlib.redirect_stdout(None):
+            seed_database(db_address, 'tiny', 0)
+
+    import insertion_api
+    import pandas_api
+    from database import engine
+    from schema import schema
+
+    schema.reflect()
+    # every request refreshes sales, instead of at most every few seconds
+    pandas_api.sales_refresher.interval = 0
+    insights = pandas_api.app.test_client()
+    insertions = insertion_api.app.test_client()
+    ((store_a, lot_a), (store_b, lot_b)) = stocked_lots(engine, schema)
+
+    # caches, sales fact and duckdb mirror are built before the bills are opened
+    for engine_name in ENGINES:
+        store_sales(pandas_api, insights, engine_name)
+
+    # bill A is opened first but gets its sale after bill B's sale was already fetched by the refresher
+    bill_a = open_bill(engine, schema, store_a)
+    bill_b = open_bill(engine, schema, store_b)
+    checkout(insertions, bill_b, lot_b, 3)
+    for engine_name in ENGINES:
+        store_sales(pandas_api, insights, engine_name)
+    checkout(insertions, bill_a, lot_a, 5)
+
+    expected = store_sales(pandas_api, insights, 'sql')
+    failures = [engine_name for engine_name in ENGINES if store_sales(pandas_api, insights, engine_name) != expected]
+    for engine_name in failures:
+        print(f'FAILED: total sales of stores by {engine_name} differ from the database after a sale was added to bill {bill_a}')
+    print('ok' if not failures else f'{len(failures)} checks failed')
+
+    engine.dispose()
+    directory.cleanup()
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,285 @@
+# check that serializers.nested_records gives the same responses as the row by row nesting loops it replaced
+# copies of the old loops of the six insight endpoints are kept here, and both are run on the frames those endpoints
+# nest, captured while calling them on a database with a store and a category without sales and a year without sales,
+# with rollups, sql pushdown, pandas and duckdb, and on small frames with ties and interleaved groups
+#
+# the check adds a store and a category to the database, a new sqlite database is generated when no database is given,
+# run from the repository root:
+# $ python benchmarks/nested_format.py
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(BENCHMARKS, '..'))
+MERGED = os.path.join(ROOT, 'merged')
+
+sys.path.insert(0, MERGED)
+from serializers import records, nested_records
+
+# settings of pandas_api the endpoints are called with: USE_ROLLUPS, SQL_PUSHDOWN, INSIGHT_ENGINE
+MODES = {
+    'rollups': (True, True, 'pandas'),
+    'sql': (False, True, 'pandas'),
+    'pandas': (False, False, 'pandas'),
+    'duckdb': (False, False, 'duckdb')
+}
+
+
+# nesting loops of the endpoints before nested_records, rows are converted by records like they were
+
+def old_average_monthly_sales(df):
+    response_list = []
+    for v in records(df):
+        store_dict = dict()
+        year_dict = dict()
+        store_dict['store_id'] = v['store_id']
+        store_dict['branch_name'] = v['branch_name']
+        year_dict['year'] = v['year']
+        year_dict['avg_monthly_sales'] = v['avg_monthly_sales']
+        if year_dict['year'] == '' and v['avg_monthly_sales'] == '':
+            year_dict['year'] = 'No record available'
+            year_dict['avg_monthly_sales'] = 'No record available'
+        store_record_found = False
+        for record in response_list:
+            if record['store'] == store_dict:
+                record['year_list'].append(year_dict)
+                store_record_found = True
+                break
+        if not store_record_found:
+            response_list.append({'store': store_dict, 'year_list': [year_dict]})
+    return response_list
+
+
+def old_total_monthly_sales(df):
+    response_list = []
+    for v in records(df):
+        store_dict = dict()
+        month_dict = dict()
+        store_dict['store_id'] = v['store_id']
+        store_dict['branch_name'] = v['branch_name']
+        month_dict['month'] = v['month']
+        month_dict['total_sales'] = v['total_sales']
+        if month_dict['month'] == '' and month_dict['total_sales'] == '':
+            month_dict['month'] = 'No record available'
+            month_dict['total_sales'] = 'No record available'
+        store_record_found = False
+        for record in response_list:
+            if record['store'] == store_dict:
+                record['month_list'].append(month_dict)
+                store_record_found = True
+                break
+        if not store_record_found:
+            response_list.append({'store': store_dict, 'month_list': [month_dict]})
+    return response_list
+
+
+def old_category_sales(df):
+    response_list = []
+    for v in records(df):
+        category_dict = dict()
+        month_dict = dict()
+        category_dict['category_id'] = v['category_id']
+        category_dict['category_name'] = v['category_name']
+        month_dict['month'] = v['month']
+        month_dict['total_sales'] = v['total_sales']
+        if month_dict['month'] == '' and month_dict['total_sales'] == '':
+            month_dict['month'] = 'No record available'
+            month_dict['total_sales'] = 'No record available'
+        category_record_found = False
+        for record in response_list:
+            if record['category'] == category_dict:
+                record['month_list'].append(month_dict)
+                category_record_found = True
+                break
+        if not category_record_found:
+            response_list.append({'category': category_dict, 'month_list': [month_dict]})
+    return response_list
+
+
+def old_gender_category(df):
+    response_list = []
+    for v in records(df):
+        category_dict = dict()
+        gender_dict = dict()
+        category_dict['category_id'] = v['category_id']
+        category_dict['category_name'] = v['category_name']
+        gender_dict['gender'] = v['gender']
+        gender_dict['num_customers'] = v['num_customers']
+        gender_dict['gender_pct'] = v['gender_pct']
+        gender_dict['total_sales'] = v['total_sales']
+        if gender_dict['gender'] == '' and gender_dict['num_customers'] == '' and gender_dict['gender_pct'] == '' and gender_dict['total_sales'] == '':
+            gender_dict['gender'] = 'No record available'
+            gender_dict['num_customers'] = 'No record available'
+            gender_dict['gender_pct'] = 'No record available'
+            gender_dict['total_sales'] = 'No record available'
+        category_found = False
+        for record in response_list:
+            if record['category'] == category_dict:
+                record['gender_list'].append(gender_dict)
+                category_found = True
+                break
+        if not category_found:
+            response_list.append({'category': category_dict, 'gender_list': [gender_dict]})
+    return response_list
+
+
+def old_manufacturer_sales(df):
+    response_list = []
+    for v in records(df):
+        manufacturer_dict = dict()
+        manufacturer_dict['manufacturer_id'] = v['manufacturer_id']
+        manufacturer_dict['manufacturer_name'] = v['manufacturer_name']
+        manufacturer_dict['total_sales'] = v['total_sales']
+        if manufacturer_dict['total_sales'] == '':
+            manufacturer_dict['total_sales'] = 'No record available'
+        if not any(record['manufacturer'] == manufacturer_dict for record in response_list):
+            response_list.append({'manufacturer': manufacturer_dict})
+    return response_list
+
+
+def old_total_category_sales(df):
+    response_list = []
+    for v in records(df):
+        category_dict = dict()
+        category_dict['category_id'] = v['category_id']
+        category_dict['category_name'] = v['category_name']
+        category_dict['total_sales'] = v['total_sales']
+        if not any(record['category'] == category_dict for record in response_list):
+            response_list.append({'category': category_dict})
+    return response_list
+
+
+# old nesting of each nested_records call, by name of the outer record and of the list
+OLD_BUILDERS = {
+    ('store', 'year_list'): old_average_monthly_sales,
+    ('store', 'month_list'): old_total_monthly_sales,
+    ('category', 'month_list'): old_category_sales,
+    ('category', 'gender_list'): old_gender_category,
+    ('manufacturer', None): old_manufacturer_sales,
+    ('category', None): old_total_category_sales
+}
+
+
+def fixture_frames():
+    """Return (frame, outer_name, outer_columns, list_name, list_columns) of small frames with ties, interleaved groups
+    and groups without rows"""
+    store_years = pd.DataFrame({
+        # two stores of the same branch name, rows of store 1 interleaved with others, equal sales and a store without sales
+        'store_id': [1, 2, 1, 3, 4],
+        'branch_name': ['Kathmandu', 'Kathmandu', 'Kathmandu', 'Pokhara', 'Lalitpur'],
+        'year': [2021, 2021, 2022, 2022, np.nan],
+        'avg_monthly_sales': [500.0, 500.0, 500.0, 0.0, np.nan]
+    }).fillna('')
+    category_months = pd.DataFrame({
+        'category_id': [10, 10, 11, 12],
+        'category_name': ['Dairy', 'Dairy', 'Dairy', 'Snacks'],
+        'month': ['April', 'April', 'May', np.nan],
+        'total_sales': [120.5, 120.5, 99.25, np.nan]
+    }).fillna('')
+    manufacturers = pd.DataFrame({
+        'manufacturer_id': [20, 21, 22],
+        'manufacturer_name': ['Dabur', 'Dabur', 'Asian Paints'],
+        'total_sales': [1520.75, 1520.75, 0.0]
+    })
+    return [(store_years, 'store', ['store_id', 'branch_name'], 'year_list', ['year', 'avg_monthly_sales']),
+            (category_months, 'category', ['category_id', 'category_name'], 'month_list', ['month', 'total_sales']),
+            (manufacturers, 'manufacturer', ['manufacturer_id', 'manufacturer_name', 'total_sales'], None, None)]
+
+
+def add_groups_without_sales(engine, schema):
+    """Insert a store and a category without any sales, ids are given since not every backend generates them"""
+    from sqlalchemy import select, func, insert
+
+    store = schema.table('store')
+    category = schema.table('category')
+    with engine.begin() as conn:
+        store_id = conn.execute(select([func.max(store.columns.store_id)])).scalar() + 1
+        category_id = conn.execute(select([func.max(category.columns.category_id)])).scalar() + 1
+        conn.execute(insert(store).values(store_id=store_id, branch_name=f'Nested {store_id}', address='Nested', phone_no='0'))
+        conn.execute(insert(category).values(category_id=category_id, category_name=f'Nested {category_id}'))
+
+
+def same_json(response, expected, sort_keys=False):
+    """Check response gives the same json as expected, so that e.g. 2021.0 and 2021 are told apart
+
+    sort_keys is set for responses read back from the app, whose json provider sorts keys
+    """
+    return json.dumps(response, sort_keys=sort_keys) == json.dumps(expected, sort_keys=sort_keys)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='check nested insight responses against the nesting loops they replaced')
+    parser.add_argument('--db-address', help='database to use, a new sqlite database is created and filled when not given')
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    db_address = args.db_address or f'sqlite:///{os.path.join(directory.name, "nested.db")}'
+
+    # the apps read the database address when they are imported, and dbaddress.py relative to merged folder
+    os.environ['RSM_DB_ADDRESS'] = db_address
+    sys.path[:0] = [ROOT, BENCHMARKS]
+    os.chdir(MERGED)
+
+    if args.db_address is None:
+        from routes import seed_database
+        # progress of the generator is left out
+        with contextlib.redirect_stdout(None):
+            seed_database(db_address, 'tiny', 0)
+
+    import pandas_api
+    from database import engine
+    from schema import schema
+
+    failures = []
+    for (df, outer_name, outer_columns, list_name, list_columns) in fixture_frames():
+        new = nested_records(df, outer_name, outer_columns, list_name, list_columns)
+        if not same_json(new, OLD_BUILDERS[(outer_name, list_name)](df)):
+            failures.append(f'fixture of {outer_name} records')
+
+    schema.reflect()
+    add_groups_without_sales(engine, schema)
+    # years with sales and the next one without any
+    year = pd.read_sql_query('SELECT MAX(date) AS date FROM bill', engine, parse_dates=['date'])['date'].iloc[0].year
+    urls = ['/api/average_monthly_sales', '/api/gender_category', '/api/total_manufacturer_sales', '/api/total_category_sales',
+            *[f'/api/total_monthly_sales/{yr}' for yr in (year, year + 1)], *[f'/api/category_sales/{yr}' for yr in (year, year + 1)]]
+
+    # frames nested by the endpoints are captured as they are passed to nested_records
+    captured = []
+
+    def capture(df, outer_name, outer_columns, list_name=None, list_columns=None):
+        response_list = nested_records(df, outer_name, outer_columns, list_name, list_columns)
+        captured.append((df.copy(), outer_name, list_name, response_list))
+        return response_list
+
+    pandas_api.nested_records = capture
+    client = pandas_api.app.test_client()
+    checked = 0
+    for (mode, (use_rollups, sql_pushdown, insight_engine)) in MODES.items():
+        pandas_api.USE_ROLLUPS = use_rollups
+        pandas_api.SQL_PUSHDOWN = sql_pushdown
+        pandas_api.INSIGHT_ENGINE = insight_engine
+        for url in urls:
+            captured.clear()
+            with contextlib.redirect_stdout(None):
+                body = client.get(url).get_json()
+            for (df, outer_name, list_name, response_list) in captured:
+                old = OLD_BUILDERS[(outer_name, list_name)](df)
+                if not same_json(response_list, old) or not same_json(body['data']['records'], old, sort_keys=True):
+                    failures.append(f'{url} with {mode}')
+                checked += 1
+
+    for failure in failures:
+        print(f'FAILED: nested records differ from the old nesting for {failure}')
+    print(f'{checked} endpoint responses and {len(fixture_frames())} fixtures checked, ' +
+          ('ok' if not failures else f'{len(failures)} checks failed'))
+
+    engine.dispose()
+    directory.cleanup()
+    sys.exit(1 if failures else 0)
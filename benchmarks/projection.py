@@ -0,0 +1,108 @@
+# benchmark of loading dimension tables with only the columns used by the sales fact instead of SELECT *
+# tables are generated in a sqlite database with the same columns as the retail store management schema
+#
+# run from the repository root:
+# $ python benchmarks/projection.py --products 200000
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'merged'))
+from sales_fact import SOURCE_COLUMNS
+
+
+def text_values(rng, prefix, rows, length):
+    """Return rows strings of about given length, like addresses or descriptions"""
+    filler = 'x' * max(length - len(prefix) - 8, 0)
+    return [f'{prefix}{i:08d}{filler}' for i in rng.permutation(rows)]
+
+
+def create_tables(engine, products):
+    """Create synthetic dimension tables sized relative to given number of products"""
+    rng = np.random.default_rng(0)
+    manufacturers = max(products // 100, 1)
+    customers = products
+
+    pd.DataFrame({
+        'store_id': np.arange(1, 21),
+        'branch_name': [f'branch {i}' for i in range(20)],
+        'address': text_values(rng, 'address ', 20, 100),
+        'phone_no': ['9800000000'] * 20
+    }).to_sql('store', engine, index=False)
+    pd.DataFrame({
+        'category_id': np.arange(1, 51),
+        'category_name': [f'category {i}' for i in range(50)]
+    }).to_sql('category', engine, index=False)
+    pd.DataFrame({
+        'manufacturer_id': np.arange(1, manufacturers + 1),
+        'manufacturer_name': text_values(rng, 'manufacturer ', manufacturers, 30),
+        'address': text_values(rng, 'address ', manufacturers, 100),
+        'email': text_values(rng, 'email ', manufacturers, 40),
+        'phone_no': ['9800000000'] * manufacturers,
+        'country': ['Nepal'] * manufacturers
+    }).to_sql('manufacturer', engine, index=False)
+    pd.DataFrame({
+        'product_id': np.arange(1, products + 1),
+        'product_name': text_values(rng, 'product ', products, 30),
+        'weight_gm': rng.random(products) * 1000,
+        'points_offered': rng.random(products),
+        'description': text_values(rng, 'description ', products, 500),
+        'category_id': rng.integers(1, 51, products),
+        'manufacturer_id': rng.integers(1, manufacturers + 1, products)
+    }).to_sql('product', engine, index=False)
+    pd.DataFrame({
+        'product_lot_id': np.arange(1, products + 1),
+        'manufacture_date': ['2022-01-01'] * products,
+        'expiry_date': ['2023-01-01'] * products,
+        'price': rng.random(products) * 1000,
+        'discount': rng.random(products) * 10,
+        'product_id': np.arange(1, products + 1)
+    }).to_sql('product_lot', engine, index=False)
+    pd.DataFrame({
+        'customer_id': np.arange(1, customers + 1),
+        'customer_name': text_values(rng, 'customer ', customers, 30),
+        'gender': rng.choice(['M', 'F'], customers),
+        'address': text_values(rng, 'address ', customers, 100),
+        'email': text_values(rng, 'email ', customers, 40),
+        'phone_no': ['9800000000'] * customers,
+        'points_collected': rng.random(customers) * 100
+    }).to_sql('customer', engine, index=False)
+
+
+def load(engine, columns):
+    """Load all dimension tables and return their total dataframe memory, time taken and peak python memory"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = 0
+    for (table_name, table_columns) in SOURCE_COLUMNS.items():
+        select_list = '*' if columns == 'all' else ', '.join(table_columns)
+        df = pd.read_sql_query(f'SELECT {select_list} FROM {table_name}', engine)
+        size += int(df.memory_usage(index=True, deep=True).sum())
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size, elapsed, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compare loading all columns with loading only used columns')
+    parser.add_argument('--products', type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f'sqlite:///{os.path.join(directory, "projection.db")}')
+        create_tables(engine, args.products)
+
+        print(f'{args.products} products and customers')
+        print(f'{"columns":<12} {"dataframes":>12} {"peak":>12} {"time":>8}')
+        for columns in ['all', 'used']:
+            size, elapsed, peak = load(engine, columns)
+            print(f'{columns:<12} {size / 2 ** 20:8.1f} MiB {peak / 2 ** 20:8.1f} MiB {elapsed:6.2f} s')
+        engine.dispose()
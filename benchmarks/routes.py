@@ -0,0 +1,330 @@
+# end to end benchmark of every route of the three merged flask apps
+# a local sqlite database is created and filled by data_generator at the given scale, or an existing database is used with --db-address,
+# then every route is called through the flask test client and its latency percentiles, rows per second and peak rss are reported
+# results are written as json, so that runs on different commits can be compared with --compare
+#
+# run from the repository root:
+# $ python benchmarks/routes.py --scale small --output before.json
+# $ python benchmarks/routes.py --scale small --output after.json --compare before.json
+import argparse
+import datetime as dt
+import importlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+MERGED = os.path.join(ROOT, 'merged')
+
+# data_generator arguments of each scale, sales are generated for two years ending with the last one
+SCALES = {
+    'tiny': ['--stores', '3', '--products', '100', '--lots', '300', '--customers', '500', '--bills-per-day', '20'],
+    'small': ['--stores', '10', '--products', '1000', '--lots', '3000', '--customers', '10000', '--bills-per-day', '200'],
+    'medium': ['--stores', '20', '--products', '5000', '--lots', '15000', '--customers', '50000', '--bills-per-day', '2000'],
+    'large': ['--stores', '50', '--products', '20000', '--lots', '60000', '--customers', '500000', '--bills-per-day', '20000']
+}
+
+# apps in the order their routes are run, insertions come last since they change the data read by the others
+APPS = ['retrieval_api', 'pandas_api', 'insertion_api']
+
+# records in one request of bulk insertion routes
+BULK_RECORDS = 100
+
+
+class RssSampler:
+    """Samples resident set size of this process in a background thread and keeps the largest value"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def current():
+        """Return current resident set size in bytes, or peak of the process so far where /proc is not available"""
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except OSError:
+            # ru_maxrss is in kilobytes on linux and in bytes on macos
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == 'darwin' else peak * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def seed_database(db_address, scale, seed):
+    """Create the schema in given database and fill it with generated records"""
+    from sqlalchemy import create_engine
+    import database_creation
+    import data_generator
+
+    engine = create_engine(db_address)
+    database_creation.create_schema(engine)
+    this_year = dt.date.today().year
+    args = data_generator.parse_args(SCALES[scale] + ['--years', '2', '--start-year', str(this_year - 2), '--seed', str(seed)])
+    data_generator.generate(engine, args)
+    engine.dispose()
+
+
+def sample_values(engine, schema):
+    """Return ids, names and year found in the database which routes with parameters are called with"""
+    from sqlalchemy import select, func, insert
+
+    bill = schema.table('bill')
+    store = schema.table('store')
+    store_product = schema.table('store_product')
+    # names of inserted records hold a tag of the run, so that runs on the same database don't insert duplicates
+    values = {'tag': f'{int(time.time()) % 1000000:06d}'}
+    with engine.connect() as conn:
+        values['year'] = conn.execute(select([func.max(bill.columns.date)])).scalar().year
+        # store having most lots in stock, for checkouts
+        stock_counts = select([store_product.columns.store_id, func.count().label('lots')])\
+                       .group_by(store_product.columns.store_id)\
+                       .order_by(func.count().desc())
+        values['store_id'] = conn.execute(stock_counts).first()['store_id']
+        values['branch_name'] = conn.execute(select([store.columns.branch_name]).where(store.columns.store_id == values['store_id'])).scalar()
+        values['lot_ids'] = conn.execute(select([store_product.columns.product_lot_id])
+                                         .where(store_product.columns.store_id == values['store_id'])
+                                         .order_by(store_product.columns.product_lot_id)).scalars().all()
+        for table_name in ['product', 'manufacturer', 'category', 'customer']:
+            id_column = list(schema.table(table_name).primary_key.columns)[0]
+            values[f'{table_name}_id'] = conn.execute(select([func.min(id_column)])).scalar()
+
+        # a store without stock for store_product insertions and a bill of the stocked store for product_bill insertions
+        # their ids are given since not every backend generates ids
+        values['empty_store_id'] = conn.execute(select([func.max(store.columns.store_id)])).scalar() + 1
+        values['bill_id'] = conn.execute(select([func.max(bill.columns.bill_id)])).scalar() + 1
+        with conn.begin():
+            conn.execute(insert(store).values(store_id=values['empty_store_id'], branch_name=f'Benchmark {values["tag"]}',
+                                              address='Benchmark', phone_no='0'))
+            conn.execute(insert(bill).values(bill_id=values['bill_id'], date=dt.date(values['year'], 1, 1), store_id=values['store_id'],
+                                             customer_id=values['customer_id']))
+    return values
+
+
+def route_cases(values):
+    """Return (app, name, method, url, body of i-th call, rows of a request or None to count them in response) of every route"""
+    year = values['year']
+    tag = values['tag']
+    lot_ids = values['lot_ids']
+    date = f'{year}-01-01'
+
+    cases = [
+        # retrieval, whole tables, one page and streamed
+        *[('retrieval_api', f'/api/{table_name}', 'GET', f'/api/{table_name}', None, None)
+          for table_name in ['store', 'product', 'product_lot', 'store_product', 'category', 'customer', 'manufacturer', 'bill', 'product_bill']],
+        ('retrieval_api', '/api/product_bill?limit', 'GET', '/api/product_bill?limit=1000', None, None),
+        ('retrieval_api', '/api/product_bill?stream', 'GET', '/api/product_bill?stream=ndjson', None, None),
+
+        # insights
+        ('pandas_api', '/api/total_sales_store/<yr>', 'GET', f'/api/total_sales_store/{year}', None, None),
+        ('pandas_api', '/api/popular_products', 'GET', '/api/popular_products', None, None),
+        ('pandas_api', '/api/popular_products/<yr>', 'GET', f'/api/popular_products/{year}', None, None),
+        ('pandas_api', '/api/average_monthly_sales', 'GET', '/api/average_monthly_sales', None, None),
+        ('pandas_api', '/api/total_monthly_sales/<yr>', 'GET', f'/api/total_monthly_sales/{year}', None, None),
+        ('pandas_api', '/api/avg_bill_sales', 'GET', '/api/avg_bill_sales', None, None),
+        ('pandas_api', '/api/manufacturer_products', 'GET', '/api/manufacturer_products', None, None),
+        ('pandas_api', '/api/category_sales/<yr>', 'GET', f'/api/category_sales/{year}', None, None),
+        ('pandas_api', '/api/gender_category', 'GET', '/api/gender_category', None, None),
+        ('pandas_api', '/api/store_product_detail', 'GET', '/api/store_product_detail', None, None),
+        ('pandas_api', '/api/min_stock', 'GET', '/api/min_stock', None, None),
+        ('pandas_api', '/api/max_stock', 'GET', '/api/max_stock', None, None),
+        ('pandas_api', '/api/branch/<branch>', 'GET', f'/api/branch/{values["branch_name"]}', None, None),
+        ('pandas_api', '/api/product/<id>', 'GET', f'/api/product/{values["product_id"]}', None, None),
+        ('pandas_api', '/api/manufacturer/<id>', 'GET', f'/api/manufacturer/{values["manufacturer_id"]}', None, None),
+        ('pandas_api', '/api/total_manufacturer_sales', 'GET', '/api/total_manufacturer_sales', None, None),
+        ('pandas_api', '/api/total_category_sales', 'GET', '/api/total_category_sales', None, None),
+        # dropping the caches is run last so that it doesn't slow down the other insights
+        ('pandas_api', '/api/cache/invalidate', 'POST', '/api/cache/invalidate', lambda i: {}, 1),
+
+        # insertions, every call inserts a new record
+        ('insertion_api', '/api/insert_customer', 'POST', '/api/insert_customer',
+         lambda i: {'customer_name': f'B{tag} {i}', 'gender': 'F', 'address': 'Benchmark', 'email': f'benchmark{tag}-{i}@example.com',
+                    'phone_no': '9800000000', 'points_collected': 0}, 1),
+        ('insertion_api', '/api/insert_store', 'POST', '/api/insert_store',
+         lambda i: {'branch_name': f'B{tag} {i}', 'address': 'Benchmark', 'phone_no': '01-000000'}, 1),
+        ('insertion_api', '/api/insert_manufacturer', 'POST', '/api/insert_manufacturer',
+         lambda i: {'manufacturer_name': f'B{tag} {i}', 'address': 'Benchmark', 'email': 'benchmark@example.com',
+                    'phone_no': '0', 'country': 'Nepal'}, 1),
+        ('insertion_api', '/api/insert_category', 'POST', '/api/insert_category', lambda i: {'category_name': f'B{tag} {i}'}, 1),
+        ('insertion_api', '/api/insert_product', 'POST', '/api/insert_product',
+         lambda i: {'product_name': f'B{tag} {i}', 'weight_gm': 100, 'points_offered': 1, 'description': None,
+                    'category_id': values['category_id'], 'manufacturer_id': values['manufacturer_id']}, 1),
+        ('insertion_api', '/api/insert_product_lot', 'POST', '/api/insert_product_lot',
+         lambda i: {'manufacture_date': date, 'expiry_date': date, 'price': 100 + i, 'discount': 0, 'product_id': values['product_id']}, 1),
+        ('insertion_api', '/api/insert_store_product', 'POST', '/api/insert_store_product',
+         lambda i: {'store_id': values['empty_store_id'], 'product_lot_id': lot_ids[i % len(lot_ids)], 'in_stock': 100}, 1),
+        ('insertion_api', '/api/insert_bill', 'POST', '/api/insert_bill',
+         lambda i: {'date': date, 'store_id': values['store_id'], 'customer_id': values['customer_id']}, 1),
+        ('insertion_api', '/api/insert_product_bill', 'POST', '/api/insert_product_bill',
+         lambda i: {'bill_id': values['bill_id'], 'product_lot_id': lot_ids[i % len(lot_ids)], 'quantity': 1}, 1),
+        ('insertion_api', '/api/bulk/customer', 'POST', '/api/bulk/customer',
+         lambda i: [{'customer_name': f'B{tag} {i}-{j}', 'gender': 'M', 'address': 'Benchmark', 'email': f'benchmark{tag}-{i}-{j}@example.com',
+                     'phone_no': '9800000000', 'points_collected': 0} for j in range(BULK_RECORDS)], BULK_RECORDS)
+    ]
+    return cases
+
+
+def count_rows(response):
+    """Return number of records in a response, the length of the largest list in its json"""
+    data = response.get_data(as_text=True)
+    if response.mimetype == 'application/x-ndjson':
+        return data.count('\n')
+
+    largest = 0
+    pending = [json.loads(data)]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, list):
+            largest = max(largest, len(value))
+            pending.extend(value[:1])
+        elif isinstance(value, dict):
+            pending.extend(value.values())
+    return largest
+
+
+def is_error(response):
+    """Return whether the response reports an error, routes report errors in status of their json"""
+    if response.status_code >= 400:
+        return True
+    if response.mimetype != 'application/json':
+        return False
+    body = response.get_json(silent=True)
+    return isinstance(body, dict) and body.get('status', 200) not in (200, 'Success')
+
+
+def run_case(client, method, url, body, rows, repeat):
+    """Call a route repeat times after one cold call and return its measurements"""
+    latencies = []
+    errors = 0
+    total_rows = 0
+    with RssSampler() as sampler:
+        for i in range(repeat + 1):
+            start = time.perf_counter()
+            response = client.open(url, method=method, json=body(i) if body is not None else None)
+            # streamed responses are produced while they are read
+            response.get_data()
+            latencies.append(time.perf_counter() - start)
+
+            if i == 0:
+                continue
+            errors += is_error(response)
+            total_rows += rows if rows is not None else count_rows(response)
+
+    warm = np.array(latencies[1:]) * 1000
+    return {
+        'calls': repeat,
+        'errors': errors,
+        'cold_ms': latencies[0] * 1000,
+        'p50_ms': float(np.percentile(warm, 50)),
+        'p95_ms': float(np.percentile(warm, 95)),
+        'p99_ms': float(np.percentile(warm, 99)),
+        'rows': total_rows // repeat,
+        'rows_per_s': total_rows / (warm.sum() / 1000),
+        'peak_rss_mib': sampler.peak / 2 ** 20
+    }
+
+
+def git_commit():
+    """Return the commit the benchmark runs on, if the repository is a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Print p50 and p95 latency of each route next to the one of baseline results"""
+    print(f'\ncompared with {baseline.get("commit")} ({baseline.get("scale")})')
+    print(f'{"route":<40} {"p50 ms":>10} {"before":>10} {"ratio":>7} {"p95 ms":>10} {"before":>10}')
+    for (name, result) in results['routes'].items():
+        before = baseline['routes'].get(name)
+        if before is None:
+            continue
+        ratio = result['p50_ms'] / before['p50_ms'] if before['p50_ms'] else float('nan')
+        print(f'{name:<40} {result["p50_ms"]:10.2f} {before["p50_ms"]:10.2f} {ratio:7.2f} {result["p95_ms"]:10.2f} {before["p95_ms"]:10.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='measure latency, throughput and memory of every api route')
+    parser.add_argument('--db-address', help='existing database to use, a new sqlite database is created and filled when not given')
+    parser.add_argument('--scale', choices=SCALES, default='small', help='size of the generated database')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=20, help='calls of each route after its first (cold) call')
+    parser.add_argument('--apps', nargs='+', choices=APPS, default=APPS)
+    parser.add_argument('--routes', nargs='+', help='run only routes whose name contains one of these')
+    parser.add_argument('--output', help='json file to write results to')
+    parser.add_argument('--compare', help='json results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    # output paths are relative to the directory the benchmark is run from
+    output_path = os.path.abspath(args.output) if args.output else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    directory = tempfile.TemporaryDirectory()
+    db_address = args.db_address or f'sqlite:///{os.path.join(directory.name, "benchmark.db")}'
+
+    # the apps read the database address when they are imported, and dbaddress.py relative to merged folder
+    os.environ['RSM_DB_ADDRESS'] = db_address
+    sys.path[:0] = [ROOT, MERGED]
+    os.chdir(MERGED)
+
+    if args.db_address is None:
+        start = time.perf_counter()
+        seed_database(db_address, args.scale, args.seed)
+        print(f'generated {args.scale} database in {time.perf_counter() - start:.0f} s')
+
+    from database import engine
+    from schema import schema
+    schema.reflect()
+    values = sample_values(engine, schema)
+    apps = {app_name: importlib.import_module(app_name).app for app_name in args.apps}
+
+    results = {
+        'commit': git_commit(),
+        'scale': args.scale if args.db_address is None else None,
+        'database': engine.dialect.name,
+        'repeat': args.repeat,
+        'time': dt.datetime.now().isoformat(timespec='seconds'),
+        'routes': {}
+    }
+    print(f'{"route":<40} {"p50 ms":>10} {"p95 ms":>10} {"p99 ms":>10} {"cold ms":>10} {"rows":>8} {"rows/s":>12} {"rss MiB":>8} {"errors":>6}')
+    for (app_name, name, method, url, body, rows) in route_cases(values):
+        if app_name not in apps or (args.routes and not any(part in name for part in args.routes)):
+            continue
+        result = run_case(apps[app_name].test_client(), method, url, body, rows, args.repeat)
+        results['routes'][name] = result
+        print(f'{name:<40} {result["p50_ms"]:10.2f} {result["p95_ms"]:10.2f} {result["p99_ms"]:10.2f} {result["cold_ms"]:10.2f} '
+              f'{result["rows"]:8d} {result["rows_per_s"]:12.0f} {result["peak_rss_mib"]:8.1f} {result["errors"]:6d}')
+
+    if output_path:
+        with open(output_path, 'w') as output:
+            json.dump(results, output, indent=2)
+    if compare_path:
+        with open(compare_path) as baseline:
+            compare(results, json.load(baseline))
+
+    engine.dispose()
+    directory.cleanup()
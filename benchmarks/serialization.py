@@ -0,0 +1,81 @@
+# benchmark of converting a dataframe into json response records
+# compares the old to_json -> json.loads round trip with serializers.records, and json with orjson for dumping
+#
+# run from the repository root:
+# $ python benchmarks/serialization.py --rows 1000000
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'merged'))
+import serializers
+
+
+def sales_frame(rows):
+    """Return dataframe shaped like product_bill records joined with product and store details"""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'bill_id': np.arange(70000001, 70000001 + rows),
+        'product_lot_id': rng.integers(50000001, 50001001, rows),
+        'quantity': rng.integers(1, 20, rows),
+        'payable_price': rng.random(rows) * 1000,
+        'branch_name': rng.choice(['Kathmandu', 'Lalitpur', 'Bhaktapur', 'Pokhara'], rows),
+        'date': pd.Timestamp('2022-01-01') + pd.to_timedelta(rng.integers(0, 365, rows), unit='D')
+    })
+
+
+def old_records(df):
+    parsed = json.loads(df.to_json(orient='index'))
+    return [v for k, v in parsed.items()]
+
+
+def same_records(old, new):
+    """Check records are equal, floats only up to the last of 10 decimal places which to_json may round differently"""
+    for (old_record, new_record) in zip(old, new):
+        for (key, old_value) in old_record.items():
+            new_value = new_record[key]
+            if isinstance(old_value, float) and isinstance(new_value, float):
+                if abs(old_value - new_value) > 1e-9:
+                    return False
+            elif old_value != new_value:
+                return False
+    return len(old) == len(new)
+
+
+def measure(name, function, *args):
+    """Print time of one run of function and peak memory allocated by python in another run, tracing memory slows it down"""
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(f'{name:<40} {elapsed:8.2f} s {peak / 2 ** 20:10.1f} MiB')
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compare conversion of dataframes into json response records and json dumping')
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    df = sales_frame(args.rows)
+    print(f'{args.rows} rows')
+
+    old = measure('to_json + json.loads', old_records, df)
+    new = measure('serializers.records', serializers.records, df)
+    assert same_records(old, new), 'records differ from json round trip'
+    del old
+
+    measure('json.dumps', json.dumps, new)
+    if serializers.orjson is not None:
+        measure('orjson.dumps', serializers.orjson.dumps, new)
@@ -0,0 +1,287 @@
+# generator of synthetic retail store data at large scale, for performance work on the apis
+# dimension tables are generated first, then bills day by day with skewed popularity of stores, customers and product lots,
+# sales are generated and loaded a chunk of days at a time so that memory used doesn't grow with the number of bills
+#
+# records are added after the records already in the database, e.g. after the ones of insert_initial_records:
+# $ python database_creation.py
+# $ python data_generator.py --stores 50 --products 20000 --lots 60000 --customers 500000 --bills-per-day 30000 --years 3 --items-per-bill 5
+#
+# --method load-data writes csv files and loads them with LOAD DATA LOCAL INFILE, which is the fastest way for MySQL
+# and needs local_infile enabled on the server, --method insert uses multi row inserts and works with every database
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, MetaData, insert, select, func, text
+
+from database_creation import fill_rollup_tables
+from dbaddress import DB_ADDRESS
+
+
+# first id of each table, same numbering as insert_initial_records
+FIRST_IDS = {
+    'store': 10000001,
+    'category': 20000001,
+    'manufacturer': 30000001,
+    'product': 40000001,
+    'product_lot': 50000001,
+    'customer': 60000001,
+    'bill': 70000001
+}
+
+# records given to one executemany by the insert method
+INSERT_CHUNK_SIZE = 10000
+
+# share of bills without a customer
+ANONYMOUS_SHARE = 0.3
+
+
+def zipf_weights(rng, n, exponent):
+    """Return probabilities of n items where the k-th most popular has weight 1 / k ** exponent, in random order"""
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return rng.permutation(weights / weights.sum())
+
+
+def next_ids(conn, metadata_obj):
+    """Return first id to use for each table with generated ids, after the largest id already in the database"""
+    ids = {}
+    for (table_name, first_id) in FIRST_IDS.items():
+        # id column is named after its table, primary keys are not reflected by every backend
+        id_column = metadata_obj.tables[table_name].columns[f'{table_name}_id']
+        largest_id = conn.execute(select([func.max(id_column)])).scalar()
+        ids[table_name] = first_id if largest_id is None else max(first_id, largest_id + 1)
+    return ids
+
+
+def generate_dimensions(rng, ids, args):
+    """Return dataframes of generated store, category, manufacturer, product, product_lot, store_product and customer records"""
+    store_ids = ids['store'] + np.arange(args.stores)
+    category_ids = ids['category'] + np.arange(args.categories)
+    manufacturer_ids = ids['manufacturer'] + np.arange(args.manufacturers)
+    product_ids = ids['product'] + np.arange(args.products)
+    product_lot_ids = ids['product_lot'] + np.arange(args.lots)
+    customer_ids = ids['customer'] + np.arange(args.customers)
+
+    # names hold the id so that they are unique, as unique constraints of the tables need
+    store_df = pd.DataFrame({
+        'store_id': store_ids,
+        'branch_name': [f'Branch {i}' for i in store_ids],
+        'address': [f'Ward {i % 32 + 1}, Kathmandu' for i in store_ids],
+        'phone_no': [f'01-{i % 1000000:06d}' for i in store_ids]
+    })
+    category_df = pd.DataFrame({
+        'category_id': category_ids,
+        'category_name': [f'Category {i}' for i in category_ids]
+    })
+    manufacturer_df = pd.DataFrame({
+        'manufacturer_id': manufacturer_ids,
+        'manufacturer_name': [f'Manufacturer {i}' for i in manufacturer_ids],
+        'address': [f'Industrial Area {i % 50 + 1}' for i in manufacturer_ids],
+        'email': [f'info@manufacturer{i}.com' for i in manufacturer_ids],
+        'phone_no': [f'+977 {i % 1000000000:09d}' for i in manufacturer_ids],
+        'country': rng.choice(['Nepal', 'India', 'China', 'USA'], args.manufacturers, p=[0.5, 0.35, 0.1, 0.05])
+    })
+
+    # a few categories and manufacturers have most of the products
+    product_df = pd.DataFrame({
+        'product_id': product_ids,
+        'product_name': [f'Product {i}' for i in product_ids],
+        'weight_gm': rng.choice([50, 100, 250, 500, 1000, 2000], args.products).astype(float),
+        'points_offered': rng.choice([0, 0.5, 1, 1.5, 2.5, 5], args.products).astype(float),
+        'description': None,
+        'category_id': rng.choice(category_ids, args.products, p=zipf_weights(rng, args.categories, 0.8)),
+        'manufacturer_id': rng.choice(manufacturer_ids, args.products, p=zipf_weights(rng, args.manufacturers, 1.0))
+    })
+
+    # every product has at least one lot, lots of a product are manufactured on different days so that they are unique
+    lot_product_ids = np.concatenate([product_ids, rng.choice(product_ids, args.lots - args.products)])
+    lot_numbers = pd.Series(lot_product_ids).groupby(lot_product_ids).cumcount().to_numpy()
+    manufacture_dates = pd.Timestamp(f'{args.start_year - 1}-01-01') + pd.to_timedelta(lot_numbers * 30 + rng.integers(0, 30, args.lots), unit='D')
+    prices = np.round(rng.lognormal(5, 1, args.lots), 2)
+    product_lot_df = pd.DataFrame({
+        'product_lot_id': product_lot_ids,
+        'manufacture_date': manufacture_dates.date,
+        'expiry_date': (manufacture_dates + pd.to_timedelta(rng.choice([90, 180, 365, 730], args.lots), unit='D')).date,
+        'price': prices,
+        # most lots have no discount, others have 5 to 20 percent
+        'discount': np.where(rng.random(args.lots) < 0.7, 0, np.round(prices * rng.uniform(0.05, 0.2, args.lots), 2)),
+        'product_id': lot_product_ids
+    })
+
+    # every store has every lot, with stock large enough for the generated sales and later checkouts
+    store_product_df = pd.DataFrame({
+        'store_id': np.repeat(store_ids, args.lots),
+        'product_lot_id': np.tile(product_lot_ids, args.stores),
+        'in_stock': rng.integers(100, 10000, args.stores * args.lots)
+    })
+
+    customer_df = pd.DataFrame({
+        'customer_id': customer_ids,
+        'customer_name': [f'Customer {i}' for i in customer_ids],
+        'gender': rng.choice(['M', 'F'], args.customers),
+        'address': [f'Ward {i % 32 + 1}, Kathmandu' for i in customer_ids],
+        'email': [f'customer{i}@example.com' for i in customer_ids],
+        'phone_no': [f'98{i % 100000000:08d}' for i in customer_ids],
+        'points_collected': 0.0
+    })
+
+    return {
+        'store': store_df,
+        'category': category_df,
+        'manufacturer': manufacturer_df,
+        'product': product_df,
+        'product_lot': product_lot_df,
+        'store_product': store_product_df,
+        'customer': customer_df
+    }
+
+
+def generate_sales(rng, dimensions, first_bill_id, days, args, with_bill_date=False):
+    """Yield dataframes of bill and product_bill records of given days, a chunk of days at a time"""
+    store_ids = dimensions['store']['store_id'].to_numpy()
+    customer_ids = dimensions['customer']['customer_id'].to_numpy()
+    product_lot_ids = dimensions['product_lot']['product_lot_id'].to_numpy()
+
+    # big stores, regular customers and best selling lots get most of the sales
+    store_weights = zipf_weights(rng, len(store_ids), 0.8)
+    customer_weights = zipf_weights(rng, len(customer_ids), 0.7)
+    lot_weights = zipf_weights(rng, len(product_lot_ids), 1.1)
+
+    # more bills on saturdays and around dashain and tihar in october and november
+    weekday_factor = np.where(days.dayofweek == 5, 1.4, 1.0)
+    season_factor = 1 + 0.3 * np.exp(-((days.dayofyear - 300) / 30) ** 2)
+    bill_counts = rng.poisson(args.bills_per_day * weekday_factor * season_factor)
+
+    next_bill_id = first_bill_id
+    for start in range(0, len(days), args.chunk_days):
+        chunk_days = days[start:start + args.chunk_days]
+        counts = bill_counts[start:start + args.chunk_days]
+        n = int(counts.sum())
+        if n == 0:
+            continue
+
+        bill_ids = next_bill_id + np.arange(n)
+        next_bill_id += n
+        bill_dates = np.repeat(chunk_days.date, counts)
+        customers = rng.choice(customer_ids, n, p=customer_weights).astype(object)
+        customers[rng.random(n) < ANONYMOUS_SHARE] = None
+        bill_df = pd.DataFrame({
+            'bill_id': bill_ids,
+            'date': bill_dates,
+            'customer_id': customers,
+            'store_id': rng.choice(store_ids, n, p=store_weights)
+        })
+
+        # a lot drawn twice for the same bill is one line item, as product_bill has one record per bill and lot
+        # partitioned product_bill also holds the date of its bill
+        items = 1 + rng.poisson(args.items_per_bill - 1, n)
+        product_bill_df = pd.DataFrame({
+            'product_lot_id': rng.choice(product_lot_ids, int(items.sum()), p=lot_weights),
+            'bill_id': np.repeat(bill_ids, items),
+            'quantity': rng.geometric(0.5, int(items.sum())),
+            'bill_date': np.repeat(bill_dates, items)
+        }).drop_duplicates(['bill_id', 'product_lot_id'])
+        if not with_bill_date:
+            product_bill_df = product_bill_df.drop(columns='bill_date')
+
+        yield bill_df, product_bill_df
+
+
+def insert_frame(conn, table, df):
+    """Insert records of dataframe into table with multi row inserts"""
+    # object columns give python values to the driver, with None for missing values
+    values = df.astype(object).where(df.notna(), None)
+    for start in range(0, len(values), INSERT_CHUNK_SIZE):
+        conn.execute(insert(table), values.iloc[start:start + INSERT_CHUNK_SIZE].to_dict('records'))
+
+
+def load_data_frame(conn, table, df, directory):
+    """Load records of dataframe into table through a csv file and LOAD DATA LOCAL INFILE"""
+    path = os.path.join(directory, f'{table.name}.csv')
+    df.to_csv(path, index=False, header=False, na_rep='\\N', date_format='%Y-%m-%d', lineterminator='\n')
+    conn.execute(text(f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE {table.name} "
+                      f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '\\n' "
+                      f"({', '.join(df.columns)})"))
+    os.remove(path)
+
+
+def load_frame(conn, table, df, method, directory):
+    """Load records of dataframe into table with given method"""
+    if method == 'load-data':
+        load_data_frame(conn, table, df, directory)
+    else:
+        insert_frame(conn, table, df)
+
+
+def generate(engine, args):
+    """Generate all records into the database of engine and fill the rollup tables again"""
+    rng = np.random.default_rng(args.seed)
+    metadata_obj = MetaData(bind=engine)
+    MetaData.reflect(metadata_obj)
+    days = pd.date_range(f'{args.start_year}-01-01', f'{args.start_year + args.years - 1}-12-31')
+
+    with engine.connect() as conn, tempfile.TemporaryDirectory() as directory:
+        ids = next_ids(conn, metadata_obj)
+        dimensions = generate_dimensions(rng, ids, args)
+
+        start = time.perf_counter()
+        with conn.begin():
+            for (table_name, df) in dimensions.items():
+                load_frame(conn, metadata_obj.tables[table_name], df, args.method, directory)
+                print(f'{table_name}: {len(df)} records')
+
+        # each chunk is its own transaction so that a long run keeps what it has loaded
+        bills = product_bills = 0
+        with_bill_date = 'bill_date' in metadata_obj.tables['product_bill'].columns
+        for (bill_df, product_bill_df) in generate_sales(rng, dimensions, ids['bill'], days, args, with_bill_date):
+            with conn.begin():
+                load_frame(conn, metadata_obj.tables['bill'], bill_df, args.method, directory)
+                load_frame(conn, metadata_obj.tables['product_bill'], product_bill_df, args.method, directory)
+            bills += len(bill_df)
+            product_bills += len(product_bill_df)
+            elapsed = time.perf_counter() - start
+            print(f'{bill_df["date"].iloc[-1]}: {bills} bills, {product_bills} product_bill records, '
+                  f'{elapsed:.0f} s, {product_bills / elapsed:.0f} records/s')
+
+    if not args.skip_rollups:
+        fill_rollup_tables(engine)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='generate synthetic retail store records at large scale')
+    parser.add_argument('--db-address', default=DB_ADDRESS)
+    parser.add_argument('--stores', type=int, default=20)
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--manufacturers', type=int, default=200)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--lots', type=int, default=15000)
+    parser.add_argument('--customers', type=int, default=50000)
+    parser.add_argument('--bills-per-day', type=float, default=1000)
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--start-year', type=int, default=2021)
+    parser.add_argument('--items-per-bill', type=float, default=4, help='average number of line items of a bill')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-days', type=int, default=7, help='days of sales generated and loaded at a time')
+    parser.add_argument('--method', choices=['insert', 'load-data'], default='insert')
+    parser.add_argument('--skip-rollups', action='store_true', help='do not fill the rollup tables again after loading')
+    args = parser.parse_args(argv)
+
+    if args.lots < args.products:
+        parser.error('--lots must be at least --products, every product has a lot')
+    if args.items_per_bill < 1:
+        parser.error('--items-per-bill must be at least 1')
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    # LOAD DATA LOCAL INFILE has to be allowed by the client too
+    connect_args = {'local_infile': 1} if args.method == 'load-data' else {}
+    engine = create_engine(args.db_address, connect_args=connect_args)
+    if args.method == 'load-data' and engine.dialect.name != 'mysql':
+        raise SystemExit('--method load-data needs a MySQL database')
+    generate(engine, args)
+    engine.dispose()
@@ -1,11 +1,123 @@
+import datetime as dt
+
 from sqlalchemy import create_engine, inspect, MetaData
-from sqlalchemy import Column, Integer, Float, String, ForeignKey, Table, Date, UniqueConstraint, Boolean
-from sqlalchemy import insert
-from dbaddress import DB_ADDRESS
-import MySQLdb
+from sqlalchemy import Column, Integer, Float, String, ForeignKey, Table, Date, UniqueConstraint, Boolean, Index
+from sqlalchemy import insert, select, delete, func, extract, text
+from dbaddress import DB_ADDRESS, PARTITION_YEARS
+
+
+# secondary indexes on join and filter columns of the insight queries, name: (table, columns)
+# mysql creates an index for every foreign key which has none, these indexes start with the foreign key so they take its place
+INDEXES = {
+    # bills of a store in a date range, and year filters of all sales queries
+    'ix_bill_store_id_date': ('bill', ['store_id', 'date']),
+    'ix_bill_date': ('bill', ['date']),
+    'ix_bill_customer_id': ('bill', ['customer_id']),
+    # sales of a bill, covering so that sales are aggregated without reading product_bill rows
+    'ix_product_bill_bill_id': ('product_bill', ['bill_id', 'product_lot_id', 'quantity']),
+    # lots of a product with their prices, covering for category and manufacturer sales
+    'ix_product_lot_product_id': ('product_lot', ['product_id', 'price', 'discount']),
+    'ix_product_category_id': ('product', ['category_id']),
+    'ix_product_manufacturer_id': ('product', ['manufacturer_id']),
+    # rollup rows of a year, covering for the yearly rollup queries
+    'ix_sales_store_month_year': ('sales_store_month', ['year', 'store_id', 'month', 'total_sales']),
+    'ix_sales_category_month_year': ('sales_category_month', ['year', 'category_id', 'month', 'total_sales'])
+}
+
+
+def create_indexes(engine):
+    """Create indexes of INDEXES which are missing in the database, used to migrate databases created before them"""
+    metadata_obj = MetaData(bind=engine)
+    MetaData.reflect(metadata_obj)
+    inspector = inspect(engine)
+
+    created = []
+    for (index_name, (table_name, column_names)) in INDEXES.items():
+        # indexes of rollup tables are skipped on a database without them, create_rollup_tables migrates it first
+        if table_name not in metadata_obj.tables:
+            continue
+        existing = [index['name'] for index in inspector.get_indexes(table_name)]
+        if index_name in existing:
+            continue
+        table = metadata_obj.tables[table_name]
+        Index(index_name, *[table.columns[column_name] for column_name in column_names]).create(bind=engine)
+        created.append(index_name)
+    return created
+
+
+def foreign_key(column, enabled=True, cascades=True, **kwargs):
+    """Return foreign key constraint of a column as a list, empty if not enabled
+
+    onupdate/ondelete actions in kwargs are left out if cascades is False
+    """
+    if not enabled:
+        return []
+    if not cascades:
+        kwargs = {key: value for (key, value) in kwargs.items() if key not in ('onupdate', 'ondelete')}
+    return [ForeignKey(column, **kwargs)]
+
+
+def year_partitions(years):
+    """Return mysql range partition definitions with one partition for each of given years"""
+    partitions = [f'PARTITION p{year} VALUES LESS THAN ({year + 1})' for year in sorted(years)]
+    # sales after the last year go to pmax until add_year_partition splits it
+    partitions.append('PARTITION pmax VALUES LESS THAN MAXVALUE')
+    return ', '.join(partitions)
+
+
+def partition_sales_tables(engine, years):
+    """Partition bill by year of date and product_bill by year of bill_date, with one partition for each of given years"""
+    with engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE bill PARTITION BY RANGE (YEAR(date)) ({year_partitions(years)})'))
+        conn.execute(text(f'ALTER TABLE product_bill PARTITION BY RANGE (YEAR(bill_date)) ({year_partitions(years)})'))
+
+
+def add_year_partition(engine, year):
+    """Split partition of given year out of the last partition of bill and product_bill, done before sales of that year start"""
+    with engine.begin() as conn:
+        for table_name in ['bill', 'product_bill']:
+            conn.execute(text(f'ALTER TABLE {table_name} REORGANIZE PARTITION pmax INTO ({year_partitions([year])})'))
+
+
+def rollup_tables(metadata_obj, cascades=True):
+    """Define sales rollup tables in metadata_obj, which already holds store, category and manufacturer tables"""
+    # rollup tables hold total sales of each store, category and manufacturer in each month
+    # they are filled by fill_rollup_tables and kept current by insert_product_bill api
+    # totals are double precision, mysql FLOAT is single precision and would round totals above a few lakhs
+    tables = []
+    for (table_name, key_column, key_table) in [('sales_store_month', 'store_id', 'store'),
+                                                ('sales_category_month', 'category_id', 'category'),
+                                                ('sales_manufacturer_month', 'manufacturer_id', 'manufacturer')]:
+        tables.append(Table(table_name, metadata_obj,
+                            Column(key_column, Integer, *foreign_key(f'{key_table}.{key_column}', cascades=cascades, onupdate='CASCADE', ondelete='CASCADE'), primary_key=True),
+                            Column('year', Integer, primary_key=True, autoincrement=False),
+                            Column('month', Integer, primary_key=True, autoincrement=False),
+                            Column('total_sales', Float(precision=53), default=0, nullable=False),
+                            Column('total_quantity', Integer, default=0, nullable=False)
+                            ))
+    return tables
+
+
+def create_rollup_tables(engine):
+    """Create sales rollup tables which are missing in the database and fill them, used to migrate databases created before them
+
+    returns names of the created tables
+    """
+    metadata_obj = MetaData(bind=engine)
+    MetaData.reflect(metadata_obj)
+    missing = [table for table in rollup_tables(MetaData(), cascades=engine.dialect.name != 'duckdb')
+               if table.name not in metadata_obj.tables]
+    if not missing:
+        return []
+
+    # rollup tables are defined along with reflected tables, which their foreign keys refer to
+    tables = [table.to_metadata(metadata_obj) for table in missing]
+    metadata_obj.create_all(engine, tables=tables, checkfirst=True)
+    fill_rollup_tables(engine)
+    return [table.name for table in tables]
 
 
-def create_schema(engine):
+def create_schema(engine, partition_years=None):
     # creating tables in database
     """
     Tables list:
@@ -59,6 +171,7 @@ def create_schema(engine):
     8. product_bill:
         bill_id (int, FK, PK)
         product_lot_id (int, FK, PK)
+        bill_date (date, PK) # only when partitioned, date of the bill
     
     9. customer:
         customer_id (int, PK)
@@ -67,15 +180,46 @@ def create_schema(engine):
         email (varchar(100))
         phone_no (varchar(15)) # somebody might add +977
         points_collected (int)
+
+    Sales rollup tables (pre-aggregated sales used by insight APIs):
+    10. sales_store_month:
+        store_id (int, FK, PK)
+        year (int, PK)
+        month (int, PK)
+        total_sales (double)
+        total_quantity (int)
+
+    11. sales_category_month:
+        category_id (int, FK, PK)
+        year (int, PK)
+        month (int, PK)
+        total_sales (double)
+        total_quantity (int)
+
+    12. sales_manufacturer_month:
+        manufacturer_id (int, FK, PK)
+        year (int, PK)
+        month (int, PK)
+        total_sales (double)
+        total_quantity (int)
     """
 
     # create metadata object and bind it to engine
     metadata_obj = MetaData(bind=engine)
     MetaData.reflect(metadata_obj)
 
+    # when partition_years are given, bill and product_bill are partitioned by year so that yearly reports read one partition
+    # mysql needs the partitioning column in every unique key and doesn't allow foreign keys in partitioned tables,
+    # so bill has primary key (bill_id, date), product_bill has date of its bill in its primary key and both have no foreign keys
+    # partitioning is a mysql feature, other databases always get the unpartitioned tables
+    partitioned = partition_years is not None and engine.dialect.name == 'mysql'
+
+    # duckdb has no auto increment ids and no on update/delete actions of foreign keys,
+    # ids are given with the records there and referenced rows are not updated or deleted by the apis
+    generated_ids = cascades = engine.dialect.name != 'duckdb'
 
     store = Table('store', metadata_obj,
-                  Column('store_id', Integer, primary_key=True, autoincrement=True),
+                  Column('store_id', Integer, primary_key=True, autoincrement=generated_ids),
                   Column('branch_name', String(20), nullable=False),
                   Column('address', String(255), nullable=False),
                   Column('phone_no', String(15), nullable=False),
@@ -83,13 +227,13 @@ def create_schema(engine):
                   )
 
     category = Table('category', metadata_obj,
-                     Column('category_id', Integer, primary_key=True),
+                     Column('category_id', Integer, primary_key=True, autoincrement=generated_ids),
                      Column('category_name', String(50), nullable=False),
                      UniqueConstraint('category_name', name='unique_key_category')
                      )
 
     manufacturer = Table('manufacturer', metadata_obj,
-                         Column('manufacturer_id', Integer, primary_key=True),
+                         Column('manufacturer_id', Integer, primary_key=True, autoincrement=generated_ids),
                          Column('manufacturer_name', String(255), nullable=False),
                          Column('address', String(255), nullable=False),
                          Column('email', String(100), nullable=False),
@@ -99,34 +243,34 @@ def create_schema(engine):
                          )
 
     product = Table('product', metadata_obj,
-                    Column('product_id', Integer, primary_key=True, autoincrement=True),
+                    Column('product_id', Integer, primary_key=True, autoincrement=generated_ids),
                     Column('product_name', String(100), nullable=False),
                     Column('weight_gm', Float, nullable=False),
                     Column('points_offered', Float, default=0, nullable=False),
                     Column('description', String(1000), nullable=True, default=None),
-                    Column('category_id', Integer, ForeignKey('category.category_id', onupdate='CASCADE'), nullable=True),
-                    Column('manufacturer_id', Integer, ForeignKey('manufacturer.manufacturer_id', onupdate='CASCADE'), nullable=True),
+                    Column('category_id', Integer, *foreign_key('category.category_id', cascades=cascades, onupdate='CASCADE'), nullable=True),
+                    Column('manufacturer_id', Integer, *foreign_key('manufacturer.manufacturer_id', cascades=cascades, onupdate='CASCADE'), nullable=True),
                     UniqueConstraint('product_name', 'weight_gm', 'points_offered', 'description', 'category_id', 'manufacturer_id', name='unique_key_product')
                     )
 
     product_lot = Table('product_lot', metadata_obj,
-                        Column('product_lot_id', Integer, primary_key=True, autoincrement=True),
+                        Column('product_lot_id', Integer, primary_key=True, autoincrement=generated_ids),
                         Column('manufacture_date', Date, nullable=False),
                         Column('expiry_date', Date, nullable=False),
                         Column('price', Float, nullable=False),
                         Column('discount', Float, default=0, nullable=False),
-                        Column('product_id', Integer, ForeignKey('product.product_id', onupdate='CASCADE', ondelete='CASCADE'), nullable=False),
+                        Column('product_id', Integer, *foreign_key('product.product_id', cascades=cascades, onupdate='CASCADE', ondelete='CASCADE'), nullable=False),
                         UniqueConstraint('manufacture_date', 'expiry_date', 'price', 'discount', 'product_id', name='unique_key_product_lot')
                         )
 
     store_product = Table('store_product', metadata_obj,
-                          Column('store_id', Integer, ForeignKey('store.store_id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True),
-                          Column('product_lot_id', Integer, ForeignKey('product_lot.product_lot_id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True),
+                          Column('store_id', Integer, *foreign_key('store.store_id', cascades=cascades, onupdate='CASCADE', ondelete='CASCADE'), primary_key=True),
+                          Column('product_lot_id', Integer, *foreign_key('product_lot.product_lot_id', cascades=cascades, onupdate='CASCADE', ondelete='CASCADE'), primary_key=True),
                           Column('in_stock', Integer, default=0, nullable=False)
                           )
 
     customer = Table('customer', metadata_obj,
-                     Column('customer_id', Integer, primary_key=True, autoincrement=True),
+                     Column('customer_id', Integer, primary_key=True, autoincrement=generated_ids),
                      Column('customer_name', String(100), nullable=False),
                      Column('gender', String(1), nullable=False),
                      Column('address', String(255), nullable=False),
@@ -137,10 +281,10 @@ def create_schema(engine):
                      )
 
     bill = Table('bill', metadata_obj,
-                 Column('bill_id', Integer, primary_key=True, autoincrement=True),
-                 Column('date', Date, nullable=False),
-                 Column('customer_id', ForeignKey('customer.customer_id', onupdate='CASCADE'), nullable=True),
-                 Column('store_id', ForeignKey('store.store_id', onupdate='CASCADE'), nullable=True)
+                 Column('bill_id', Integer, primary_key=True, autoincrement=generated_ids),
+                 Column('date', Date, primary_key=partitioned, nullable=False),
+                 Column('customer_id', Integer, *foreign_key('customer.customer_id', enabled=not partitioned, cascades=cascades, onupdate='CASCADE'), nullable=True),
+                 Column('store_id', Integer, *foreign_key('store.store_id', enabled=not partitioned, cascades=cascades, onupdate='CASCADE'), nullable=True)
                  )
 
     # since product_bill has foreign key attribute bill_id, so bill must be created first
@@ -149,14 +293,25 @@ def create_schema(engine):
     # when customer pays money, transaction_completed becomes True
     # when all products are added to products_bill table, we make transaction_completed= True
 
-    product_bill = Table('product_bill', metadata_obj,
-                         Column('product_lot_id', ForeignKey('product_lot.product_lot_id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True),
-                         Column('bill_id', ForeignKey('bill.bill_id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True),
-                         Column('quantity', Integer, nullable=False)
-                         )
-    
+    product_bill_columns = [
+        Column('product_lot_id', Integer, *foreign_key('product_lot.product_lot_id', enabled=not partitioned, cascades=cascades, onupdate='CASCADE', ondelete='CASCADE'), primary_key=True),
+        Column('bill_id', Integer, *foreign_key('bill.bill_id', enabled=not partitioned, cascades=cascades, onupdate='CASCADE', ondelete='CASCADE'), primary_key=True),
+        Column('quantity', Integer, nullable=False)
+    ]
+    if partitioned:
+        # date of the bill is copied into its product_bill records so that they are partitioned the same way
+        product_bill_columns.append(Column('bill_date', Date, primary_key=True))
+    product_bill = Table('product_bill', metadata_obj, *product_bill_columns)
+
+    rollup_tables(metadata_obj, cascades)
+
     metadata_obj.create_all(engine)
 
+    if partitioned:
+        partition_sales_tables(engine, partition_years)
+
+    # secondary indexes are created by the same function that adds them to existing databases
+    create_indexes(engine)
 
 
 def insert_initial_records(engine):
@@ -272,6 +427,11 @@ def insert_initial_records(engine):
         {'bill_id': 70000004, 'product_lot_id': 50000005, 'quantity': 22}
     ]
 
+    # partitioned product_bill also holds the date of its bill
+    if 'bill_date' in product_bill.columns:
+        bill_dates = {bill_record['bill_id']: bill_record['date'] for bill_record in bill_list}
+        product_bill_list = [dict(record, bill_date=bill_dates[record['bill_id']]) for record in product_bill_list]
+
     table_dict = {
         store: store_list,
         category: category_list,
@@ -286,16 +446,63 @@ def insert_initial_records(engine):
 
 
     # execute all insertion operations in a loop
+    # dates are written above as iso strings and given to the database as dates, not every driver accepts strings for them
     for (table, table_list) in table_dict.items():
+        date_columns = [column.name for column in table.columns if isinstance(column.type, Date)]
+        table_list = [dict(record, **{name: dt.date.fromisoformat(record[name]) for name in date_columns if name in record})
+                      for record in table_list]
         conn.execute(insert(table), table_list)
 
 
+def fill_rollup_tables(engine):
+    """Recompute all sales rollup tables from bill and product_bill records"""
+    # create connection to the engine
+    conn = engine.connect()
+
+    # create MetaData object for storing database metadata
+    metadata_obj = MetaData(bind=engine)
+    MetaData.reflect(metadata_obj)
+
+    bill = metadata_obj.tables['bill']
+    product_bill = metadata_obj.tables['product_bill']
+    product_lot = metadata_obj.tables['product_lot']
+    product = metadata_obj.tables['product']
+
+    year = extract('year', bill.columns.date)
+    month = extract('month', bill.columns.date)
+    payable_price = (product_lot.columns.price - product_lot.columns.discount) * product_bill.columns.quantity
+    sales_joined = bill\
+                   .join(product_bill, product_bill.columns.bill_id == bill.columns.bill_id)\
+                   .join(product_lot, product_lot.columns.product_lot_id == product_bill.columns.product_lot_id)\
+                   .join(product, product.columns.product_id == product_lot.columns.product_id)
+
+    # each rollup table and the column of sales that it is grouped by
+    rollup_dict = {
+        metadata_obj.tables['sales_store_month']: bill.columns.store_id,
+        metadata_obj.tables['sales_category_month']: product.columns.category_id,
+        metadata_obj.tables['sales_manufacturer_month']: product.columns.manufacturer_id
+    }
+
+    with conn.begin():
+        for (rollup, key_column) in rollup_dict.items():
+            stmt = select([key_column, year, month, func.sum(payable_price), func.sum(product_bill.columns.quantity)])\
+                   .select_from(sales_joined)\
+                   .where(key_column.isnot(None))\
+                   .group_by(key_column, year, month)
+
+            conn.execute(delete(rollup))
+            conn.execute(insert(rollup).from_select([key_column.name, 'year', 'month', 'total_sales', 'total_quantity'], stmt))
+
+
 if __name__ == '__main__':
     # engine for connection to database
     engine = create_engine(DB_ADDRESS) # RSM = Retole Store Management
 
     # create database schema
-    create_schema(engine)
+    create_schema(engine, PARTITION_YEARS)
 
     # insert initial records into the database
     insert_initial_records(engine)
+
+    # aggregate initial sales records into rollup tables
+    fill_rollup_tables(engine)
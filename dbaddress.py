@@ -1,3 +1,5 @@
+import os
+
 driver = "mysql"
 user = "root"
 password = ""
@@ -5,4 +7,14 @@ host = "localhost"
 port = "3306"
 dbname = "RSM"
 
-DB_ADDRESS = f"{driver}://{user}:{password}@{host}:{port}/{dbname}"
+# RSM_DB_ADDRESS environment variable overrides the address, e.g. to run the apis or benchmarks on another database
+DB_ADDRESS = os.environ.get('RSM_DB_ADDRESS', f"{driver}://{user}:{password}@{host}:{port}/{dbname}")
+
+# connection pool settings used by the apis
+POOL_SIZE = 5 # connections kept open in the pool
+MAX_OVERFLOW = 10 # extra connections opened when all pooled connections are in use
+POOL_RECYCLE = 3600 # seconds after which a connection is replaced, MySQL closes idle connections after wait_timeout
+POOL_PRE_PING = True # check that a connection is alive before handing it out
+
+# years for which bill and product_bill get their own partition, e.g. range(2015, 2031), None keeps them unpartitioned (MySQL only)
+PARTITION_YEARS = None
@@ -0,0 +1,92 @@
+# database backends the apis can run on
+# the apis are written for mysql, the same apps also run on sqlite (for tests and benchmarks)
+# and duckdb (for analytical insight queries on a columnar engine) without a mysql server
+# everything that differs between them is kept here: engine options, reflection, date handling and integrity errors
+import datetime as dt
+import re
+
+from sqlalchemy import event, text, Date, PrimaryKeyConstraint
+from sqlalchemy.types import TypeDecorator
+
+
+# kinds of integrity errors reported by the apis
+DUPLICATE = 'duplicate'
+FOREIGN_KEY = 'foreign_key'
+
+# mysql gives the kind of integrity error as error code in integrityerror.orig.args[0]
+MYSQL_ERROR_CODES = {1062: DUPLICATE, 1452: FOREIGN_KEY}
+
+# sqlite and duckdb only give the kind in the error message
+ERROR_PATTERNS = [
+    (re.compile(r'UNIQUE constraint|duplicate key|primary key constraint', re.IGNORECASE), DUPLICATE),
+    (re.compile(r'foreign key', re.IGNORECASE), FOREIGN_KEY)
+]
+
+# backends whose driver doesn't accept iso date strings for date columns
+STRING_DATE_BACKENDS = ['sqlite']
+
+
+def integrity_error_kind(error):
+    """Return DUPLICATE or FOREIGN_KEY for given IntegrityError, None for other integrity errors"""
+    args = getattr(error.orig, 'args', ())
+    if args and args[0] in MYSQL_ERROR_CODES:
+        return MYSQL_ERROR_CODES[args[0]]
+
+    message = str(error.orig)
+    for (pattern, kind) in ERROR_PATTERNS:
+        if pattern.search(message):
+            return kind
+    return None
+
+
+def engine_options(db_address):
+    """Return create_engine keyword arguments needed by the backend of given database address"""
+    if db_address.startswith('sqlite'):
+        # pooled connections are used by flask request threads other than the one which opened them
+        return {'connect_args': {'check_same_thread': False}}
+    return {}
+
+
+def configure_engine(engine):
+    """Set up connections of given engine to behave like mysql where the apis depend on it"""
+    if engine.dialect.name == 'sqlite':
+        # sqlite checks foreign keys only when asked to, the apis report invalid foreign keys as bad requests
+        @event.listens_for(engine, 'connect')
+        def enable_foreign_keys(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA foreign_keys=ON')
+            cursor.close()
+    return engine
+
+
+class IsoDate(TypeDecorator):
+    """Date column which also accepts iso date strings, as mysql does for dates given in input json"""
+
+    impl = Date
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            return dt.date.fromisoformat(value)
+        return value
+
+
+def reflect(metadata_obj, engine):
+    """Reflect all tables of the database of given engine into metadata_obj, the same way on every backend"""
+    if engine.dialect.name in STRING_DATE_BACKENDS:
+        @event.listens_for(metadata_obj, 'column_reflect')
+        def iso_dates(inspector, table, column_info):
+            if isinstance(column_info['type'], Date):
+                column_info['type'] = IsoDate()
+
+    metadata_obj.reflect(engine)
+
+    if engine.dialect.name == 'duckdb':
+        # duckdb_engine reflects primary keys without their columns, they are read from duckdb catalog instead
+        with engine.connect() as conn:
+            rows = conn.execute(text("SELECT table_name, constraint_column_names FROM duckdb_constraints() "
+                                     "WHERE constraint_type = 'PRIMARY KEY'"))
+            for (table_name, column_names) in rows:
+                table = metadata_obj.tables.get(table_name)
+                if table is not None and len(table.primary_key.columns) == 0:
+                    table.append_constraint(PrimaryKeyConstraint(*[table.columns[name] for name in column_names]))
@@ -0,0 +1,122 @@
+# bulk insertion of many records of one table in a single request
+# valid records are inserted in chunks with executemany inside one transaction
+# and a chunk that fails is inserted again record by record, so that only the failing records are left out
+import json
+from itertools import groupby
+
+from sqlalchemy import insert
+from sqlalchemy.exc import StatementError, IntegrityError
+
+from backend import integrity_error_kind, DUPLICATE, FOREIGN_KEY
+from exceptions import InvalidInput
+
+
+# default number of records inserted with one executemany
+DEFAULT_CHUNK_SIZE = 500
+
+# mimetypes of request bodies having one json record per line
+NDJSON_MIMETYPES = ['application/x-ndjson', 'application/jsonlines', 'application/jsonl']
+
+# ids of these tables are given by the database, same as in single record insertion routes
+GENERATED_IDS = {'bill': 'bill_id', 'product_lot': 'product_lot_id'}
+
+
+def parse_records(request):
+    """Return records given in request body either as json array or as ndjson, lines which are not valid json are returned as None"""
+    if request.mimetype in NDJSON_MIMETYPES:
+        records = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append(None)
+        return records
+
+    records = request.get_json()
+    if not isinstance(records, list):
+        raise InvalidInput('input json must be an array of records')
+    return records
+
+
+def validate_record(table, record):
+    """Raise InvalidInput if record cannot be inserted into given table"""
+    if not isinstance(record, dict):
+        raise InvalidInput('record must be a json object')
+    if record == {}:
+        raise InvalidInput('empty input json')
+
+    id_column = GENERATED_IDS.get(table.name)
+    if id_column is not None and record.get(id_column) is not None:
+        raise InvalidInput(f'{id_column} cannot be specified in input json')
+
+    unknown_columns = [column for column in record if column not in table.columns]
+    if unknown_columns:
+        raise InvalidInput(f'unknown columns {", ".join(unknown_columns)}')
+
+
+def error_message(error):
+    """Return message reported for a record which couldn't be inserted"""
+    if isinstance(error, InvalidInput):
+        return f'Bad request: {error.get_message()}'
+
+    # backend.integrity_error_kind gives us the type of error
+    if isinstance(error, IntegrityError) and integrity_error_kind(error) == DUPLICATE:
+        return 'Bad request: record exists in database'
+    if isinstance(error, IntegrityError) and integrity_error_kind(error) == FOREIGN_KEY:
+        return 'Bad request: invalid foreign keys in input'
+    return 'Bad request: invalid input'
+
+
+def insert_chunk(conn, table, records):
+    """Insert records with one executemany for each run of records having same columns"""
+    stmt = insert(table)
+    for (_, group) in groupby(records, key=lambda record: tuple(record)):
+        conn.execute(stmt, list(group))
+
+
+def insert_records(conn, table, records, chunk_size=DEFAULT_CHUNK_SIZE, insert_record=None):
+    """Insert records into table in one transaction and return number of inserted records and failures of the others
+
+    insert_record(conn, record) is used to insert records one by one instead of executemany,
+    for tables whose records need more than a plain insert
+    """
+    failed = []
+    valid_records = []
+    for (index, record) in enumerate(records):
+        try:
+            validate_record(table, record)
+            valid_records.append((index, record))
+        except InvalidInput as ii:
+            failed.append({'index': index, 'message': error_message(ii)})
+
+    inserted = 0
+    with conn.begin():
+        for start in range(0, len(valid_records), chunk_size):
+            chunk = valid_records[start:start + chunk_size]
+
+            if insert_record is None:
+                try:
+                    with conn.begin_nested():
+                        insert_chunk(conn, table, [record for (_, record) in chunk])
+                    inserted += len(chunk)
+                    continue
+                except StatementError:
+                    # some record of the chunk failed, so the chunk is inserted record by record below
+                    pass
+
+            for (index, record) in chunk:
+                try:
+                    # each record has its own savepoint so that a failing record only undoes itself
+                    with conn.begin_nested():
+                        if insert_record is None:
+                            conn.execute(insert(table), record)
+                        else:
+                            insert_record(conn, record)
+                    inserted += 1
+                except Exception as e:
+                    failed.append({'index': index, 'message': error_message(e)})
+
+    failed.sort(key=lambda failure: failure['index'])
+    return inserted, failed
@@ -0,0 +1,43 @@
+# database engine with connection pool shared by all apis
+# each flask request checks out its own connection from the pool and returns it when the request ends
+from flask import g
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+import backend
+# for importing dbaddress
+from importlib.machinery import SourceFileLoader
+dbaddress = SourceFileLoader('dbaddress', '../dbaddress.py').load_module()
+
+
+def create_pooled_engine(db_address=dbaddress.DB_ADDRESS, pool_size=dbaddress.POOL_SIZE, max_overflow=dbaddress.MAX_OVERFLOW,
+                         pool_recycle=dbaddress.POOL_RECYCLE, pool_pre_ping=dbaddress.POOL_PRE_PING):
+    """Create engine whose connections are kept in a QueuePool"""
+    engine = create_engine(db_address,
+                           poolclass=QueuePool,
+                           pool_size=pool_size,
+                           max_overflow=max_overflow,
+                           pool_recycle=pool_recycle,
+                           pool_pre_ping=pool_pre_ping,
+                           **backend.engine_options(db_address))
+    return backend.configure_engine(engine)
+
+
+# engine shared by the process, no connection is opened until it is first used
+engine = create_pooled_engine()
+
+
+def get_conn():
+    """Return the connection of current request, checking one out from the pool on first use"""
+    if 'conn' not in g:
+        g.conn = engine.connect()
+    return g.conn
+
+
+def init_app(app):
+    """Return connection of each request to the pool when the request ends"""
+
+    @app.teardown_appcontext
+    def close_conn(exception):
+        conn = g.pop('conn', None)
+        if conn is not None:
+            conn.close()
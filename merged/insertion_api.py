@@ -1,18 +1,27 @@
 # we retrieve data from our Retail Store Management database, and try to get meaningful insights into the data
 from venv import create
 from flask import Flask, jsonify, request
-from sqlalchemy import create_engine, MetaData, insert, Table, select, update
+from sqlalchemy import select, update
 from exceptions import InvalidInput
+import rollups
+import bulk
+import serializers
+from database import get_conn, init_app
+from schema import schema
 from sqlalchemy.exc import IntegrityError
+from backend import integrity_error_kind, DUPLICATE, FOREIGN_KEY
 # for importing dbaddress
 from importlib.machinery import SourceFileLoader
 dbaddress = SourceFileLoader('dbaddress', '../dbaddress.py').load_module()
 
-import MySQLdb
 import json
 import datetime as dt
 
 app = Flask(__name__)
+# each request uses its own pooled connection
+init_app(app)
+# responses are serialized with orjson when it is installed
+serializers.init_app(app)
 
 
 ###########################################
@@ -23,9 +32,9 @@ app = Flask(__name__)
 @app.route('/api/insert_customer',methods = ['POST'])
 def insert_customer():
     body = request.get_json()
+    conn = get_conn()
     print(body)
-    customer = Table('customer', metadata_obj, autoload=True, autoload_with=engine)
-    stmt = insert(customer)
+    stmt = schema.insert('customer')
     try:
         conn.execute(stmt, body)
         return jsonify({
@@ -37,7 +46,7 @@ def insert_customer():
     except IntegrityError as ie:
         return jsonify({
             'status': 400,
-            'message': "Duplicate Input: This input is already inserted" if ie.orig.args[0] == 1062\
+            'message': "Duplicate Input: This input is already inserted" if integrity_error_kind(ie) == DUPLICATE\
                         else "Invalid input",
             'data': {}
         })
@@ -51,8 +60,8 @@ def insert_customer():
 @app.route('/api/insert_store',methods = ['POST'])
 def insert_store():
     body = request.get_json()
-    store = Table('store', metadata_obj, autoload=True, autoload_with=engine)
-    stmt = insert(store)
+    conn = get_conn()
+    stmt = schema.insert('store')
     try:
         conn.execute(stmt, body)
         return jsonify({
@@ -64,7 +73,7 @@ def insert_store():
     except IntegrityError as ie:
         return jsonify({
             'status': 400,
-            'message': "Duplicate Input: This input is already inserted" if ie.orig.args[0] == 1062\
+            'message': "Duplicate Input: This input is already inserted" if integrity_error_kind(ie) == DUPLICATE\
                         else "Invalid input",
             'data': {}
         })
@@ -79,8 +88,8 @@ def insert_store():
 @app.route('/api/insert_manufacturer',methods = ['POST'])
 def insert_manufacturer():
     body = request.get_json()
-    manufacturer = Table('manufacturer', metadata_obj, autoload=True, autoload_with=engine)
-    stmt = insert(manufacturer)
+    conn = get_conn()
+    stmt = schema.insert('manufacturer')
     try:
         conn.execute(stmt, body)
         return jsonify({
@@ -92,7 +101,7 @@ def insert_manufacturer():
     except IntegrityError as ie:
         return jsonify({
             'status': 400,
-            'message': "Duplicate Input: This input is already inserted" if ie.orig.args[0] == 1062\
+            'message': "Duplicate Input: This input is already inserted" if integrity_error_kind(ie) == DUPLICATE\
                         else "Invalid input",
             'data': {}
         })
@@ -106,8 +115,8 @@ def insert_manufacturer():
 @app.route('/api/insert_product',methods = ['POST'])
 def insert_product():
     body = request.get_json()
-    product = Table('product', metadata_obj, autoload=True, autoload_with=engine)
-    stmt = insert(product)
+    conn = get_conn()
+    stmt = schema.insert('product')
     try:
         conn.execute(stmt, body)
         return jsonify({
@@ -119,7 +128,7 @@ def insert_product():
     except IntegrityError as ie:
         return jsonify({
             'status': 400,
-            'message': "Duplicate Input: This input is already inserted" if ie.orig.args[0] == 1062\
+            'message': "Duplicate Input: This input is already inserted" if integrity_error_kind(ie) == DUPLICATE\
                         else "Invalid input",
             'data': {}
         })
@@ -135,8 +144,8 @@ def insert_product():
 @app.route('/api/insert_category',methods = ['POST'])
 def insert_category():
     body = request.get_json()
-    category = Table('category', metadata_obj, autoload=True, autoload_with=engine)
-    stmt = insert(category)
+    conn = get_conn()
+    stmt = schema.insert('category')
     try:
         conn.execute(stmt, body)
         return jsonify({
@@ -148,7 +157,7 @@ def insert_category():
     except IntegrityError as ie:
         return jsonify({
             'status': 400,
-            'message': "Duplicate Input: This input is already inserted" if ie.orig.args[0] == 1062\
+            'message': "Duplicate Input: This input is already inserted" if integrity_error_kind(ie) == DUPLICATE\
                         else "Invalid input",
             'data': {}
         })
@@ -171,8 +180,8 @@ def insert_bill():
 
     # get the body of request 
     body = request.get_json()
-    bill = Table('bill', metadata_obj, autoload=True, autoload_with=engine)
-    stmt = insert(bill)
+    conn = get_conn()
+    stmt = schema.insert('bill')
     try:
         if body == {}:
             raise InvalidInput('empty input json')
@@ -198,17 +207,17 @@ def insert_bill():
             'data': {}
         })
     
-    # integrityerror.orig.args[0] gives us the type of error
-    # if it is 1062, it is unique constraint error
-    # if it is 1452, it is unique constraint error
+    # backend.integrity_error_kind gives us the type of error
+    # if it is DUPLICATE, it is unique constraint error
+    # if it is FOREIGN_KEY, it is foreign key constraint error
     except IntegrityError as ie:
-        if ie.orig.args[0] == 1062:
+        if integrity_error_kind(ie) == DUPLICATE:
             return jsonify({
                 'status': 400,
                 'message': 'Bad request: record exists in database',
                 'data': {}                      
             })
-        elif ie.orig.args[0] == 1452:
+        elif integrity_error_kind(ie) == FOREIGN_KEY:
             return jsonify({
                 'status': 400,
                 'message': 'Bad request: invalid foreign keys in input',
@@ -231,8 +240,8 @@ def insert_store_product():
 
     # get the body of request
     body = request.get_json()
-    store_product = Table('store_product', metadata_obj, autoload=True, autoload_with=engine)
-    stmt = insert(store_product)
+    conn = get_conn()
+    stmt = schema.insert('store_product')
 
     try:
         if body == {}:
@@ -254,13 +263,13 @@ def insert_store_product():
         })
 
     except IntegrityError as ie:
-        if ie.orig.args[0] == 1062:
+        if integrity_error_kind(ie) == DUPLICATE:
             return jsonify({
                 'status': 400,
                 'message': 'Bad request: record exists in database',
                 'data': {}                      
             })
-        elif ie.orig.args[0] == 1452:
+        elif integrity_error_kind(ie) == FOREIGN_KEY:
             return jsonify({
                 'status': 400,
                 'message': 'Bad request: invalid foreign keys in input',
@@ -281,8 +290,8 @@ def insert_product_lot():
 
     # get the body of request
     body = request.get_json()
-    product_lot = Table('product_lot', metadata_obj, autoload=True, autoload_with=engine)
-    stmt = insert(product_lot)
+    conn = get_conn()
+    stmt = schema.insert('product_lot')
 
     try:
         if body == {}:
@@ -307,13 +316,13 @@ def insert_product_lot():
         })
     
     except IntegrityError as ie:
-        if ie.orig.args[0] == 1062:
+        if integrity_error_kind(ie) == DUPLICATE:
             return jsonify({
                 'status': 400,
                 'message': 'Bad request: record exists in database',
                 'data': {}                      
             })
-        elif ie.orig.args[0] == 1452:
+        elif integrity_error_kind(ie) == FOREIGN_KEY:
             return jsonify({
                 'status': 400,
                 'message': 'Bad request: invalid foreign keys in input',
@@ -327,70 +336,77 @@ def insert_product_lot():
             })
 
 
+def checkout(conn, body):
+    """Insert product_bill record, taking its quantity from stock of the bill's store, must be called inside a transaction"""
+
+    # when we add a product of certain quantity into the product_bill table, we need to check whether the store from which the quantity is being taken has sufficient product in stock
+    # i.e. we need to check the store_product table
+    # further we also need to add the number of points collected to customer record because the customer has bought the product
+
+    # tables that we will use
+    customer = schema.table('customer')
+    bill = schema.table('bill')
+    product_lot = schema.table('product_lot')
+    store_product = schema.table('store_product')
+    product = schema.table('product')
+
+    # bill and the stock of given product lot in the store of the bill, both found by their primary keys
+    # so that the cost of the lookup doesn't grow with the number of bills or store products
+    stock_stmt = select([bill.columns.date, bill.columns.store_id, bill.columns.customer_id])\
+                 .select_from(bill.join(store_product, store_product.columns.store_id == bill.columns.store_id))\
+                 .where((bill.columns.bill_id == body['bill_id']) & (store_product.columns.product_lot_id == body['product_lot_id']))
+
+    # price of given product lot and its product details used for rollups and customer points
+    sale_stmt = select([product_lot.columns.price, product_lot.columns.discount, product.columns.category_id,
+                        product.columns.manufacturer_id, product.columns.points_offered])\
+                .select_from(product_lot.outerjoin(product, product.columns.product_id == product_lot.columns.product_id))\
+                .where(product_lot.columns.product_lot_id == body['product_lot_id'])
+
+    record = conn.execute(stock_stmt).fetchone()
+    if record is None:
+        raise InvalidInput('bill_id and product_lot_id not found')
+
+    # subtract the quantity from store_product table only if that much is in stock
+    # the database checks the condition while holding the row lock, so concurrent checkouts cannot oversell
+    stock_update_stmt = update(store_product)\
+                        .where((store_product.columns.store_id == record['store_id']) &
+                               (store_product.columns.product_lot_id == body['product_lot_id']) &
+                               (store_product.columns.in_stock >= body['quantity']))\
+                        .values(in_stock=store_product.columns.in_stock - body['quantity'])
+    if conn.execute(stock_update_stmt).rowcount == 0:
+        raise InvalidInput('given quantity is more than what is in stock')
+
+    # insert into product bill, partitioned product_bill also holds the date of the bill
+    if 'bill_date' in schema.table('product_bill').columns:
+        body = dict(body, bill_date=record['date'])
+    conn.execute(schema.insert('product_bill'), body)
+
+    # add this sale to the monthly sales rollup tables used by insight apis
+    sale_record = conn.execute(sale_stmt).fetchone()
+    rollups.record_sale(conn, schema.metadata_obj, record['date'], record['store_id'], sale_record['category_id'], sale_record['manufacturer_id'],
+                        (sale_record['price'] - sale_record['discount']) * body['quantity'], body['quantity'])
+
+    # now we have to change the points_collected for customer of the bill in customer_table
+    # points are added by the database so that concurrent checkouts of same customer don't overwrite each other
+    if record['customer_id'] is not None and sale_record['points_offered'] is not None:
+        points_update_stmt = update(customer)\
+                             .where(customer.columns.customer_id == record['customer_id'])\
+                             .values(points_collected=customer.columns.points_collected + sale_record['points_offered'] * body['quantity'])
+        conn.execute(points_update_stmt)
+
+
 # insert product_bill record into the database
 @app.route('/api/insert_product_bill', methods=['POST'])
 def insert_product_bill():
     """Insert product_bill record into the table"""
-    
-    # when we add a product of certain quantity into the product_bill table, we need to check whether the store from which the quantity is being taken has sufficient product in stock
-    # i.e. we need to check the store_product table
-    # further we also need to add the number of points collected to customer record because the customer has bought the product
     body = request.get_json()
+    conn = get_conn()
 
-    # tables that we will use
-    store = Table('store', metadata_obj, autoload=True, autoload_with=engine)
-    customer = Table('customer', metadata_obj, autoload=True, autoload_with=engine)
-    bill = Table('bill', metadata_obj, autoload=True, autoload_with=engine)
-    product_bill = Table('product_bill', metadata_obj, autoload=True, autoload_with=engine)
-    product_lot = Table('product_lot', metadata_obj, autoload=True, autoload_with=engine)
-    store_product = Table('store_product', metadata_obj, autoload=True, autoload_with=engine)
-    product = Table('product', metadata_obj, autoload=True, autoload_with=engine)
-
-
-    # check that the quantity doesn't exceed what is in stock
-    # we need store_product, store, bill tables
-    quantity_joined = (store_product\
-                    .join(store, store_product.columns.store_id == store.columns.store_id))\
-                    .join(bill, store.columns.store_id == bill.columns.store_id)
-
-    customer_joined = (((product\
-                       .join(product_lot, product_lot.columns.product_id == product.columns.product_id))\
-                       .join(product_bill, product_bill.columns.product_lot_id == product_lot.columns.product_lot_id))\
-                       .join(bill, bill.columns.bill_id == product_bill.columns.bill_id))\
-                       .join(customer, customer.columns.customer_id == bill.columns.customer_id)
-    
     try:
-        bill_product_record_found = False
-        for record in conn.execute(select([quantity_joined])).fetchall(): # check each record for the combination of bill_id and product_lot_id
-            print(record['bill_id'], record['product_lot_id'])
-            if record['bill_id'] == body['bill_id'] and record['product_lot_id'] == body['product_lot_id']:
-                bill_product_record_found = True
-                if record['in_stock'] < body['quantity']:
-                    raise InvalidInput('given quantity is more than what is in stock')
-
-                # insert into product bill
-                stmt = insert(product_bill)
-                conn.execute(stmt, body)
-
-                # another task is to subtract the quantity of products from store_product table i.e. update operation
-                stmt2 = update(store_product)
-                stmt2 = stmt2.where((store_product.columns.store_id == record['store_id']) & (store_product.columns.product_lot_id == record['product_lot_id']))
-                stmt2 = stmt2.values(in_stock=record['in_stock'] - body['quantity'])
-                conn.execute(stmt2)
-
-                # now we have to change the points_collected for customer in customer_table
-                for cust_joined_record in conn.execute(select([customer_joined])).fetchall():
-                    if cust_joined_record['product_lot_id'] == body['product_lot_id'] and cust_joined_record['bill_id'] == body['bill_id']:
-                        stmt3 = update(customer)
-                        stmt3 = stmt3.where(customer.columns.customer_id == cust_joined_record['customer_id'])
-                        stmt3 = stmt3.values(points_collected = cust_joined_record['points_collected'] + cust_joined_record['points_offered'] * cust_joined_record['quantity'])
-                        conn.execute(stmt3)
-                        break
-                break
-
-        if not bill_product_record_found:
-            raise InvalidInput('bill_id and product_lot_id not found')
-        
+        # all writes of the checkout happen in one transaction, so either all of them or none are done
+        with conn.begin():
+            checkout(conn, body)
+
         return jsonify({
             'status': 200,
             'message': 'Successfully inserted into product_bill table',
@@ -405,13 +421,13 @@ def insert_product_bill():
         })
 
     except IntegrityError as ie:
-        if ie.orig.args[0] == 1062:
+        if integrity_error_kind(ie) == DUPLICATE:
             return jsonify({
                 'status': 400,
                 'message': 'Bad request: record exists in database',
                 'data': {}                      
             })
-        elif ie.orig.args[0] == 1452:
+        elif integrity_error_kind(ie) == FOREIGN_KEY:
             return jsonify({
                 'status': 400,
                 'message': 'Bad request: invalid foreign keys in input',
@@ -432,15 +448,58 @@ def insert_product_bill():
             })
 
 
+#############
+# BULK
+#############
+
+
+# tables into which records can be inserted in bulk
+BULK_TABLES = ['customer', 'store', 'manufacturer', 'product', 'category', 'bill', 'store_product', 'product_lot', 'product_bill']
+
+# number of records inserted together, can be changed for a request with chunk_size query parameter
+BULK_CHUNK_SIZE = bulk.DEFAULT_CHUNK_SIZE
+
+
+# insert many records into a table at once
+@app.route('/api/bulk/<string:table_name>', methods=['POST'])
+def bulk_insert(table_name):
+    """Insert records given as json array or ndjson into given table, reporting records which couldn't be inserted"""
+    conn = get_conn()
+
+    try:
+        if table_name not in BULK_TABLES:
+            raise InvalidInput(f'{table_name} is not a table')
+
+        chunk_size = request.args.get('chunk_size', BULK_CHUNK_SIZE, type=int)
+        if chunk_size < 1:
+            raise InvalidInput('chunk_size must be positive')
+
+        records = bulk.parse_records(request)
+
+        # product_bill records go through checkout one by one, because each of them also updates stock, rollups and customer points
+        insert_record = checkout if table_name == 'product_bill' else None
+        inserted, failed = bulk.insert_records(conn, schema.table(table_name), records, chunk_size, insert_record)
+
+        return jsonify({
+            'status': 200,
+            'message': f'Successfully inserted {inserted} of {len(records)} records into {table_name} table',
+            'data': {
+                'inserted': inserted,
+                'failed': failed
+            }
+        })
+
+    except InvalidInput as ii:
+        return jsonify({
+            'status': 400,
+            'message': f'Bad request: {ii.get_message()}',
+            'data': {}
+        })
 
 
 if __name__ == '__main__':
-    # create engine to connect to database
-    engine = create_engine(dbaddress.DB_ADDRESS)
-    conn = engine.connect()
-    # create metadata object
-    metadata_obj = MetaData(bind=engine)
-    MetaData.reflect(metadata_obj)
+    # reflect tables once before serving requests
+    schema.reflect()
 
     # run app in debug mode
     app.run(debug=True)
@@ -0,0 +1,265 @@
+# in-process duckdb engine for sales insights
+# dimension tables of the cached snapshots are mirrored into an in-memory duckdb database, together with a sales table
+# joined there from the bill and product_bill snapshots, and each insight runs as one vectorized, multi-threaded sql query
+# instead of pandas groupbys on the sales fact
+# results are fetched as arrow tables and have the same columns, order and values as the pandas computations
+import threading
+
+import pandas as pd
+
+from sales_fact import SALES_TABLES, changed_bills_start, source_tables
+
+# duckdb is optional, it is only needed when insights are computed with it
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+# sales rows joined from registered bill and product_bill snapshots and the mirrored dimension tables,
+# same rows and columns as sales_fact.build_sales_rows
+# bill may not have store or customer and product may not have category or manufacturer, so those are left joins
+SALES_SELECT = '''
+SELECT product_bill.bill_id, product_bill.product_lot_id, product_bill.quantity,
+       bill.date, bill.year, CAST(bill.month_name AS VARCHAR) AS month,
+       CAST(bill.store_id AS INTEGER) AS store_id, CAST(bill.customer_id AS INTEGER) AS customer_id,
+       product_lot.product_id, product_lot.price, product_lot.discount,
+       product.product_name, CAST(product.category_id AS INTEGER) AS category_id,
+       CAST(product.manufacturer_id AS INTEGER) AS manufacturer_id,
+       store.branch_name, customer.gender, category.category_name, manufacturer.manufacturer_name,
+       (product_lot.price - product_lot.discount) * product_bill.quantity AS payable_price
+FROM product_bill_snapshot AS product_bill
+JOIN bill_snapshot AS bill ON bill.bill_id = product_bill.bill_id
+JOIN product_lot ON product_lot.product_lot_id = product_bill.product_lot_id
+LEFT JOIN product ON product.product_id = product_lot.product_id
+LEFT JOIN store ON store.store_id = bill.store_id
+LEFT JOIN customer ON customer.customer_id = bill.customer_id
+LEFT JOIN category ON category.category_id = product.category_id
+LEFT JOIN manufacturer ON manufacturer.manufacturer_id = product.manufacturer_id
+'''
+
+# insight queries on the sales table, pandas groupby leaves out rows with missing keys so they are filtered out here too
+# rows are ordered the way pandas orders groups, names and months compare as plain strings in both
+TOTAL_SALES_BY_STORE = '''
+SELECT store_id, branch_name, SUM(payable_price) AS total_sales
+FROM sales
+WHERE year = $yr AND store_id IS NOT NULL AND branch_name IS NOT NULL
+GROUP BY store_id, branch_name
+ORDER BY store_id, branch_name
+'''
+
+TOTAL_MONTHLY_SALES = '''
+SELECT store_id, branch_name, month, SUM(payable_price) AS total_sales
+FROM sales
+WHERE year = $yr AND store_id IS NOT NULL AND branch_name IS NOT NULL
+GROUP BY store_id, branch_name, month
+ORDER BY store_id, branch_name, month
+'''
+
+CATEGORY_SALES = '''
+SELECT category_id, category_name, month, SUM(payable_price) AS total_sales
+FROM sales
+WHERE year = $yr AND category_id IS NOT NULL AND category_name IS NOT NULL
+GROUP BY category_id, category_name, month
+ORDER BY category_id, category_name, month
+'''
+
+# product with most quantity sold in each store, ties go to the smallest product_id
+POPULAR_PRODUCTS = '''
+SELECT store_id, branch_name, product_id, product_name, total_quantity_sold, total_price_sold
+FROM (
+    SELECT store_id, branch_name, product_id, product_name,
+           CAST(SUM(quantity) AS BIGINT) AS total_quantity_sold, SUM(payable_price) AS total_price_sold,
+           ROW_NUMBER() OVER (PARTITION BY store_id, branch_name
+                              ORDER BY SUM(quantity) DESC, product_id, product_name) AS popularity
+    FROM sales
+    WHERE ($yr IS NULL OR year = $yr) AND store_id IS NOT NULL AND branch_name IS NOT NULL AND product_name IS NOT NULL
+    GROUP BY store_id, branch_name, product_id, product_name
+)
+WHERE popularity = 1
+ORDER BY store_id, branch_name
+'''
+
+AVERAGE_MONTHLY_SALES = '''
+SELECT store_id, branch_name, year, SUM(payable_price) / 12 AS avg_monthly_sales
+FROM sales
+WHERE store_id IS NOT NULL AND branch_name IS NOT NULL
+GROUP BY store_id, branch_name, year
+ORDER BY store_id, branch_name, year
+'''
+
+AVERAGE_BILL_SALES = '''
+SELECT store_id, branch_name, AVG(bill_total) AS average_bill_sales
+FROM (
+    SELECT store_id, branch_name, bill_id, SUM(payable_price) AS bill_total
+    FROM sales
+    WHERE store_id IS NOT NULL AND branch_name IS NOT NULL
+    GROUP BY store_id, branch_name, bill_id
+)
+GROUP BY store_id, branch_name
+ORDER BY store_id, branch_name
+'''
+
+# percentage of each gender is its count out of the count of all genders in that category
+GENDER_CATEGORY = '''
+SELECT category_id, category_name, gender, num_customers, total_sales,
+       num_customers / SUM(num_customers) OVER (PARTITION BY category_id, category_name) * 100 AS gender_pct
+FROM (
+    SELECT category_id, category_name, gender, COUNT(customer_id) AS num_customers, SUM(payable_price) AS total_sales
+    FROM sales
+    WHERE category_id IS NOT NULL AND category_name IS NOT NULL AND gender IS NOT NULL
+    GROUP BY category_id, category_name, gender
+)
+ORDER BY category_id, category_name, gender
+'''
+
+MANUFACTURER_SALES = '''
+SELECT manufacturer_id, manufacturer_name, SUM(payable_price) AS total_sales
+FROM sales
+WHERE manufacturer_id IS NOT NULL AND manufacturer_name IS NOT NULL
+GROUP BY manufacturer_id, manufacturer_name
+ORDER BY manufacturer_id, manufacturer_name
+'''
+
+TOTAL_CATEGORY_SALES = '''
+SELECT category_id, category_name, SUM(payable_price) AS total_sales
+FROM sales
+WHERE category_id IS NOT NULL AND category_name IS NOT NULL
+GROUP BY category_id, category_name
+ORDER BY category_id, category_name
+'''
+
+
+def mirror_select(df):
+    """Return select list copying all columns of a registered dataframe, categoricals are copied as plain strings"""
+    return ', '.join(f'CAST("{column}" AS VARCHAR) AS "{column}"' if isinstance(df[column].dtype, pd.CategoricalDtype) else f'"{column}"'
+                     for column in df.columns)
+
+
+class DuckDBInsights:
+    """Sales insights computed by duckdb on mirrors of cached table snapshots"""
+
+    def __init__(self, cache, threads=None):
+        self.cache = cache
+        # threads used by each query, all cores when not given
+        self.threads = threads
+        self._lock = threading.Lock()
+        self._conn = None
+        # table snapshots which the mirrored tables and the sales table were built from
+        self._sources = {}
+
+    def total_sales_by_store(self, engine, yr):
+        """Return total sales of each store in given year"""
+        return self.query(engine, TOTAL_SALES_BY_STORE, {'yr': yr})
+
+    def total_monthly_sales(self, engine, yr):
+        """Return total sales of each store in each month of given year"""
+        return self.query(engine, TOTAL_MONTHLY_SALES, {'yr': yr})
+
+    def category_sales(self, engine, yr):
+        """Return total sales of each category in each month of given year"""
+        return self.query(engine, CATEGORY_SALES, {'yr': yr})
+
+    def popular_products(self, engine, yr=None):
+        """Return most popular product of each store, of all time or only in given year"""
+        return self.query(engine, POPULAR_PRODUCTS, {'yr': yr})
+
+    def average_monthly_sales(self, engine):
+        """Return average monthly sales of each store in each year"""
+        return self.query(engine, AVERAGE_MONTHLY_SALES)
+
+    def average_bill_sales(self, engine):
+        """Return average sales in a bill of each store"""
+        return self.query(engine, AVERAGE_BILL_SALES)
+
+    def gender_category(self, engine):
+        """Return number of customers, sales and percentage of each gender in each category"""
+        return self.query(engine, GENDER_CATEGORY)
+
+    def manufacturer_sales(self, engine):
+        """Return total sales of each manufacturer"""
+        return self.query(engine, MANUFACTURER_SALES)
+
+    def total_category_sales(self, engine):
+        """Return total sales of each category"""
+        return self.query(engine, TOTAL_CATEGORY_SALES)
+
+    def query(self, engine, sql, parameters=None):
+        """Run sql on the sales and dimension tables brought up to date with the cache and return the result as a dataframe"""
+        conn = self._connection(engine)
+        try:
+            result = conn.execute(sql, parameters or {}).fetch_arrow_table()
+        finally:
+            conn.close()
+        return result.to_pandas()
+
+    def invalidate(self):
+        """Drop the duckdb tables so that they are built again on next use"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = None
+            self._sources = {}
+
+    def _connection(self, engine):
+        # every query gets its own cursor, so that queries of concurrent requests run in parallel
+        with self._lock:
+            if self._conn is None:
+                if duckdb is None:
+                    raise ImportError('duckdb is needed for computing insights with duckdb, install it with pip install duckdb')
+                self._conn = duckdb.connect(':memory:')
+                if self.threads is not None:
+                    self._conn.execute(f'SET threads = {int(self.threads)}')
+            self._sync(source_tables(self.cache, engine))
+            return self._conn.cursor()
+
+    def _sync(self, tables):
+        changed = [table_name for (table_name, df) in tables.items() if self._sources.get(table_name) is not df]
+        if not changed:
+            return
+
+        # all changes are made in one transaction, so that queries see either old or new tables
+        self._conn.execute('BEGIN TRANSACTION')
+        try:
+            dimensions_changed = False
+            for table_name in changed:
+                if table_name not in SALES_TABLES:
+                    self._copy(table_name, tables[table_name])
+                    dimensions_changed = True
+
+            # sales from the first changed bill onwards are rebuilt, same as in sales_fact
+            rebuild = dimensions_changed or not self._sources
+            tail_start = None if rebuild else changed_bills_start(self._sources, tables)
+            if rebuild:
+                self._build_sales(tables['bill'], tables['product_bill'])
+            elif tail_start is not None:
+                # only sales of bills from tail_start onwards are joined again, with just their bills
+                bill_df = tables['bill']
+                product_bill_df = tables['product_bill']
+                self._conn.execute('DELETE FROM sales WHERE bill_id >= $tail_start', {'tail_start': int(tail_start)})
+                self._build_sales(bill_df[bill_df['bill_id'] >= tail_start], product_bill_df[product_bill_df['bill_id'] >= tail_start],
+                                  'INSERT INTO sales')
+            self._conn.execute('COMMIT')
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            raise
+
+        self._sources = tables
+
+    def _copy(self, table_name, df):
+        self._conn.register('snapshot', df)
+        try:
+            self._conn.execute(f'CREATE OR REPLACE TABLE {table_name} AS SELECT {mirror_select(df)} FROM snapshot')
+        finally:
+            self._conn.unregister('snapshot')
+
+    def _build_sales(self, bill_df, product_bill_df, statement='CREATE OR REPLACE TABLE sales AS'):
+        # bill and product_bill snapshots are read by duckdb where they are, without copying them into the database first
+        self._conn.register('bill_snapshot', bill_df)
+        self._conn.register('product_bill_snapshot', product_bill_df)
+        try:
+            self._conn.execute(f'{statement} {SALES_SELECT}')
+        finally:
+            self._conn.unregister('bill_snapshot')
+            self._conn.unregister('product_bill_snapshot')
+
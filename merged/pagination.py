@@ -0,0 +1,100 @@
+# keyset pagination of table records ordered by primary key
+# a page starts right after the primary key of the last record of previous page, given as an opaque cursor token,
+# so the database seeks to it with the primary key index instead of counting skipped records as with OFFSET
+import base64
+import datetime as dt
+import json
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, and_, or_, Date, DateTime
+
+from exceptions import InvalidInput
+
+
+# number of records in a page when limit is not given
+DEFAULT_LIMIT = 1000
+
+# largest number of records in a page
+MAX_LIMIT = 10000
+
+
+def key_value(value):
+    """Return primary key value as a json value, dates as iso format strings"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, (dt.date, dt.datetime)):
+        return value.isoformat()
+    return value
+
+
+def column_value(column, value):
+    """Return primary key value of a cursor as value of given column, dates of partitioned tables are parsed back"""
+    if isinstance(column.type, DateTime):
+        return dt.datetime.fromisoformat(value)
+    if isinstance(column.type, Date):
+        return dt.date.fromisoformat(value[:10])
+    return value
+
+
+def encode_cursor(values):
+    """Return cursor token for given primary key values"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(token, columns):
+    """Return primary key values of given cursor token"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        raise InvalidInput('invalid cursor')
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise InvalidInput('invalid cursor')
+    try:
+        return [column_value(column, value) for (column, value) in zip(columns, values)]
+    except (TypeError, ValueError):
+        raise InvalidInput('invalid cursor')
+
+
+def after_key(columns, values):
+    """Return condition selecting records whose primary key comes after given values
+
+    for composite keys (a, b) this is a > x OR (a = x AND b > y), which databases can answer with a range scan of the primary key
+    """
+    conditions = []
+    for i in range(len(columns)):
+        equal = [columns[j] == values[j] for j in range(i)]
+        conditions.append(and_(*equal, columns[i] > values[i]))
+    return or_(*conditions)
+
+
+def parse_limit(value):
+    """Return limit given as query parameter, DEFAULT_LIMIT if it is not given"""
+    if value is None:
+        return DEFAULT_LIMIT
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidInput(f'limit must be an integer between 1 and {MAX_LIMIT}')
+
+
+def page_query(table, limit, after=None):
+    """Return query for at most limit records of table ordered by primary key, after the record of given cursor token"""
+    columns = list(table.primary_key.columns)
+    stmt = select([table]).order_by(*columns).limit(limit)
+    if after is not None:
+        stmt = stmt.where(after_key(columns, decode_cursor(after, columns)))
+    return stmt
+
+
+def read_page(engine, table, limit=DEFAULT_LIMIT, after=None):
+    """Read one page of table records and return them with the cursor token of next page, which is None on last page"""
+    if limit < 1 or limit > MAX_LIMIT:
+        raise InvalidInput(f'limit must be between 1 and {MAX_LIMIT}')
+
+    df = pd.read_sql_query(page_query(table, limit, after), engine)
+
+    next_cursor = None
+    if len(df) == limit:
+        next_cursor = encode_cursor([key_value(df[column.name].iloc[-1]) for column in table.primary_key.columns])
+    return df, next_cursor
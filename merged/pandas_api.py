@@ -1,19 +1,89 @@
 # we retrieve data from our Retail Store Management database, and try to get meaningful insights into the data
 from tokenize import group
 from flask import Flask, jsonify, request
-from sqlalchemy import create_engine, MetaData
 # for importing dbaddress
 from importlib.machinery import SourceFileLoader
 dbaddress = SourceFileLoader('dbaddress', '../dbaddress.py').load_module()
 
 
-import MySQLdb
 import json
+import os
+import threading
 import pandas as pd
 import numpy as np
+from database import engine
+from schema import schema
+from table_cache import table_cache
+import sales_queries
+from sales_fact import SalesFact, plain_dtypes
+from sales_refresher import SalesRefresher
+from insight_engine import DuckDBInsights
+import snapshots
+from shared_tables import SharedTables
+import serializers
+from serializers import records, nested_records
 
 
 app = Flask(__name__)
+# responses are serialized with orjson when it is installed
+serializers.init_app(app)
+
+# run joins, year filters and aggregations of sales insights inside the database
+# set to False to compute them in pandas instead, e.g. for checking that both give same results
+SQL_PUSHDOWN = True
+
+# read monthly sales insights from rollup tables which are kept current by insertion api
+# the rollup tables are filled for existing sales by database_creation.fill_rollup_tables
+USE_ROLLUPS = True
+
+# engine computing the sales insights which are not read from rollup tables or aggregated by the database
+# 'pandas' computes them on the sales fact dataframe, 'duckdb' runs them as sql queries on an in-process duckdb mirror
+# of the cached tables, which needs duckdb to be installed
+INSIGHT_ENGINE = 'pandas'
+
+# directory of a parquet snapshot written by snapshots.py, the table cache is filled from it before the first request
+# instead of reading all tables from the database, sales made after the export are then fetched by sales_refresher
+# None to load tables from the database on first use
+SNAPSHOT_DIR = os.environ.get('RSM_SNAPSHOT_DIR')
+
+# directory of table versions published by shared_tables.py, when the app runs in several worker processes
+# workers then use the published tables and sales fact in place instead of loading and refreshing their own copies
+SHARED_TABLES_DIR = os.environ.get('RSM_SHARED_TABLES_DIR')
+
+# joined sales records shared by sales insight endpoints, built from cached table snapshots
+sales_fact = SalesFact(table_cache)
+
+# duckdb mirror of cached tables, created on first use when INSIGHT_ENGINE is 'duckdb'
+duckdb_insights = DuckDBInsights(table_cache)
+
+# appends bills and product_bill records inserted since last request to cached snapshots and sales fact
+sales_refresher = SalesRefresher(table_cache, sales_fact)
+
+# tables published for all workers, attached when SHARED_TABLES_DIR is set
+shared_tables = SharedTables(table_cache, sales_fact)
+
+# snapshot is loaded once per process, also when the app is served by another server than app.run
+snapshot_lock = threading.Lock()
+snapshot_loaded = False
+
+def load_snapshot():
+    """Fill the table cache from SNAPSHOT_DIR if it is set and was not loaded yet"""
+    global snapshot_loaded
+    if snapshot_loaded or SNAPSHOT_DIR is None or SHARED_TABLES_DIR is not None:
+        return
+    with snapshot_lock:
+        if not snapshot_loaded:
+            snapshots.load_snapshot(table_cache, SNAPSHOT_DIR)
+            snapshot_loaded = True
+
+@app.before_request
+def refresh_sales():
+    load_snapshot()
+    if SHARED_TABLES_DIR is not None:
+        # new sales are fetched by the publisher, workers switch to its latest version
+        shared_tables.attach(SHARED_TABLES_DIR, engine)
+    else:
+        sales_refresher.refresh(engine)
 
 def jprint(obj):
     data = json.dumps(obj, indent=4)
@@ -29,26 +99,15 @@ def jprint(obj):
 def total_sales_by_store(yr):
     """Retrieve total sales in each store for given year"""
 
-    # fetch all table records into pandas data_frames
-    store_df = pd.read_sql_query('SELECT * FROM store', engine)
-    bill_df = pd.read_sql_query('SELECT * FROM bill', engine)
-    product_bill_df = pd.read_sql_query('SELECT * FROM product_bill', engine)
-    product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
-
-    # join all required tables
-    combined_df = store_df\
-                  .merge(bill_df, how='left', on='store_id')\
-                  .merge(product_bill_df, how='inner', on='bill_id')\
-                  .merge(product_lot_df, how='inner', on='product_lot_id')
-
-    combined_df['date'] = pd.to_datetime(combined_df['date']) # we need to perform date operations so convert to date
-    filtered_df = combined_df[combined_df['date'].dt.year == yr] # select only particular records
-    # payable price is calculated by subtracting discount from price
-    filtered_df['payable_price'] = (filtered_df['price'] - filtered_df['discount']) * filtered_df['quantity']
-
-    # now grouping by store_id and branch_name
-    grouped_df = filtered_df.groupby(['store_id', 'branch_name'])['payable_price'].sum().rename('total_sales')
-    grouped_df = grouped_df.reset_index()
+    store_df = table_cache.get('store', engine, ['store_id', 'branch_name'])
+
+    # total sales of each store, either aggregated by the database, by duckdb or in pandas
+    if SQL_PUSHDOWN:
+        grouped_df = pd.read_sql_query(sales_queries.total_sales_by_store_query(schema.metadata_obj, yr), engine)
+    elif INSIGHT_ENGINE == 'duckdb':
+        grouped_df = duckdb_insights.total_sales_by_store(engine, yr)
+    else:
+        grouped_df = pandas_total_sales_by_store(yr)
 
     # for including those years in which the branches have no purchase records
     # join grouped_df to store table (right join)
@@ -59,10 +118,10 @@ def total_sales_by_store(yr):
     # for some years there may not be any records for some branches, as a result, tehre is null in total_sales, which we will replace by 0
     grouped_df = grouped_df.fillna(0)
 
-    result = grouped_df.to_json(orient='index') # orient the records according to rows i.e. index
-    parsed = json.loads(result)
+    # convert rows of the dataframe to records
+    rows = records(grouped_df)
 
-    response_list = [v for k, v in parsed.items()] # value only because key is index i.e. 0, 1, 2 which we don't need
+    response_list = rows
 
     return jsonify({
         'status': 200,
@@ -74,6 +133,18 @@ def total_sales_by_store(yr):
         }
     })
 
+def pandas_total_sales_by_store(yr):
+    """Compute total sales of each store in given year in pandas"""
+
+    # sales fact already has store, bill, product_bill and product_lot joined with payable price and year computed
+    fact_df = sales_fact.get(engine)
+    filtered_df = fact_df[fact_df['year'] == yr] # select only particular records
+
+    # now grouping by store_id and branch_name, sales without store are left out by groupby
+    # observed=True leaves out unused categories of name columns and sort_index keeps groups in sorted order
+    grouped_df = filtered_df.groupby(['store_id', 'branch_name'], observed=True)['payable_price'].sum().sort_index().rename('total_sales')
+    return plain_dtypes(grouped_df.reset_index())
+
 
 # retrieve most popular product in each store of all time
 @app.route('/api/popular_products', methods=['GET'])
@@ -83,31 +154,13 @@ def store_popular_products():
     # most popular product in each store is the product that is bought most number of times
     # we need store, bill, product_bill, product_lot and product_tables
 
-    store_df = pd.read_sql_query('SELECT * FROM store', engine)
-    bill_df = pd.read_sql_query('SELECT * FROM bill', engine)
-    product_bill_df = pd.read_sql_query('SELECT * FROM product_bill', engine)
-    product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
-    product_df = pd.read_sql_query('SELECT * FROM product', engine)
-
-    # merge all the data_frames
-    combined_df = store_df\
-                  .merge(bill_df, on='store_id')\
-                  .merge(product_bill_df, on='bill_id')\
-                  .merge(product_lot_df, on='product_lot_id')\
-                  .merge(product_df, on='product_id')
-    combined_df['payable_price'] = (combined_df['price'] - combined_df['discount']) * combined_df['quantity']
-
-    grouped_df = combined_df.groupby(['store_id', 'branch_name', 'product_id', 'product_name']).agg({'quantity': np.sum, 'payable_price': np.sum})
-    grouped_df = grouped_df.rename(columns={'quantity': 'total_quantity_sold', 'payable_price': 'total_price_sold'})
-    grouped_df = grouped_df.sort_values(by='total_quantity_sold', ascending=False)
-
-    # reset indexes product_id and product_name
-    grouped_df = grouped_df.reset_index(level=['product_id', 'product_name'])
-
-    # group again by store_id and branch_name and select only the first record for each branch this time i.e.  the record with maximum quantity_sold
-    grouped_df = grouped_df.groupby(level=['store_id', 'branch_name']).first()
-    grouped_df = grouped_df.reset_index()
+    store_df = table_cache.get('store', engine, ['store_id', 'branch_name'])
 
+    # most popular product of each store, either computed by duckdb or in pandas
+    if INSIGHT_ENGINE == 'duckdb':
+        grouped_df = duckdb_insights.popular_products(engine)
+    else:
+        grouped_df = pandas_popular_products(sales_fact.get(engine))
 
     # what if a branch is newly added and there is not product sale yet
     # join grouped df to store table (right join)
@@ -115,13 +168,11 @@ def store_popular_products():
     grouped_df = grouped_df.loc[:, ['store_id', 'branch_name', 'product_id', 'product_name', 'total_quantity_sold', 'total_price_sold']]
 
     grouped_df = grouped_df.fillna('')
-    # change the dataframe to json
-    result = grouped_df.to_json(orient='index')
-    # load that json for further formatting
-    parsed = json.loads(result)
+    # convert rows of the dataframe to records
+    rows = records(grouped_df)
 
     response_list = []
-    for k, v in parsed.items():
+    for v in rows:
         outer_dict = dict()
         store_dict = dict()
         product_dict = dict()
@@ -164,36 +215,16 @@ def store_popular_products_by_year(yr):
     # most popular product in each store is the product that is bought most number of times in that year
     # we need store, bill, product_bill, product_lot and product_tables
 
-    store_df = pd.read_sql_query('SELECT * FROM store', engine)
-    bill_df = pd.read_sql_query('SELECT * FROM bill', engine)
-    product_bill_df = pd.read_sql_query('SELECT * FROM product_bill', engine)
-    product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
-    product_df = pd.read_sql_query('SELECT * FROM product', engine)
+    store_df = table_cache.get('store', engine, ['store_id', 'branch_name'])
 
-    # merge all the data_frames
-    combined_df = store_df\
-                  .merge(bill_df, on='store_id')\
-                  .merge(product_bill_df, on='bill_id')\
-                  .merge(product_lot_df, on='product_lot_id')\
-                  .merge(product_df, on='product_id')
-
-    combined_df['payable_price'] = (combined_df['price'] - combined_df['discount']) * combined_df['quantity']
-
-
-    # filter out the records for that year
-    combined_df['date'] = pd.to_datetime(combined_df['date'])
-    filtered_df = combined_df[combined_df['date'].dt.year == yr]
-
-    grouped_df = filtered_df.groupby(['store_id', 'branch_name', 'product_id', 'product_name']).agg({'quantity': np.sum, 'payable_price': np.sum})
-    grouped_df = grouped_df.rename(columns={'quantity': 'total_quantity_sold', 'payable_price': 'total_price_sold'})
-    grouped_df = grouped_df.sort_values(by='total_quantity_sold', ascending=False)
-
-    # reset indexes product_id and product_name
-    grouped_df = grouped_df.reset_index(level=['product_id', 'product_name'])
+    # most popular product of each store in that year, either computed by duckdb or in pandas
+    if INSIGHT_ENGINE == 'duckdb':
+        grouped_df = duckdb_insights.popular_products(engine, yr)
+    else:
+        combined_df = sales_fact.get(engine)
 
-    # group again by store_id and branch_name and select only the first record for each branch this time i.e.  the record with maximum quantity_sold
-    grouped_df = grouped_df.groupby(level=['store_id', 'branch_name']).first()
-    grouped_df = grouped_df.reset_index()
+        # filter out the records for that year
+        grouped_df = pandas_popular_products(combined_df[combined_df['year'] == yr])
 
     # what if a branch is newly added and there is not product sale yet
     # join grouped df to store table (right join)
@@ -202,14 +233,12 @@ def store_popular_products_by_year(yr):
 
     grouped_df = grouped_df.fillna('')
     print(grouped_df)
-    # change the dataframe to json
-    result = grouped_df.to_json(orient='index')
-    # load that json for further formatting
-    parsed = json.loads(result)
+    # convert rows of the dataframe to records
+    rows = records(grouped_df)
 
     response_list = []
 
-    for k, v in parsed.items():
+    for v in rows:
         outer_dict = dict()
         store_dict = dict()
         product_dict = dict()
@@ -245,32 +274,42 @@ def store_popular_products_by_year(yr):
     })
 
 
+def pandas_popular_products(combined_df):
+    """Compute the most popular product of each store from given sales in pandas"""
+
+    grouped_df = combined_df.groupby(['store_id', 'branch_name', 'product_id', 'product_name'], observed=True).agg({'quantity': np.sum, 'payable_price': np.sum}).sort_index()
+    grouped_df = grouped_df.rename(columns={'quantity': 'total_quantity_sold', 'payable_price': 'total_price_sold'})
+    # stable sort keeps products of same quantity in product order, so ties go to the smallest product_id
+    grouped_df = grouped_df.sort_values(by='total_quantity_sold', ascending=False, kind='stable')
+
+    # reset indexes product_id and product_name
+    grouped_df = grouped_df.reset_index(level=['product_id', 'product_name'])
+
+    # group again by store_id and branch_name and select only the first record for each branch this time i.e.  the record with maximum quantity_sold
+    grouped_df = grouped_df.groupby(level=['store_id', 'branch_name'], observed=True).first()
+    return plain_dtypes(grouped_df.reset_index())
+
+
 # average monthly sales for each store in each year
 @app.route('/api/average_monthly_sales', methods=['GET'])
 def average_monthly_sales_each_year():
     """Retrieve average monthly sales for all stores in each year"""
 
-    # we need store, bill, product_bill and product_lot tables
-    store_df = pd.read_sql_query('SELECT * FROM store', engine)
-    bill_df = pd.read_sql_query('SELECT * FROM bill', engine)
-    product_bill_df = pd.read_sql_query('SELECT * FROM product_bill', engine)
-    product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
-
-    # combined the data frames
-    combined_df = store_df\
-                  .merge(bill_df, on='store_id')\
-                  .merge(product_bill_df, on='bill_id')\
-                  .merge(product_lot_df, on='product_lot_id')
-    
-    # convert date to datetime object
-    combined_df['date'] = pd.to_datetime(combined_df['date'])
-    combined_df['payable_price'] = (combined_df['price'] - combined_df['discount']) * combined_df['quantity']
+    store_df = table_cache.get('store', engine, ['store_id', 'branch_name'])
 
     # calculate total yearly sales for each store in each year and divide by 12
-    grouped_df = combined_df.groupby(['store_id', 'branch_name', combined_df['date'].dt.year])['payable_price'].sum() / 12
+    if USE_ROLLUPS:
+        # yearly sales are the sum of monthly sales in store rollup table
+        rollup_df = pd.read_sql_query(sales_queries.store_month_rollup_query(schema.metadata_obj), engine)
+        grouped_df = rollup_df.groupby(['store_id', 'branch_name', 'year'])['total_sales'].sum() / 12
+        grouped_df = grouped_df.rename('avg_monthly_sales').reset_index()
+    elif INSIGHT_ENGINE == 'duckdb':
+        grouped_df = duckdb_insights.average_monthly_sales(engine)
+    else:
+        combined_df = sales_fact.get(engine)
+        grouped_df = combined_df.groupby(['store_id', 'branch_name', 'year'], observed=True)['payable_price'].sum().sort_index() / 12
+        grouped_df = plain_dtypes(grouped_df.rename('avg_monthly_sales').reset_index())
     # for each store for each year, is the result obtained
-    grouped_df = grouped_df.reset_index()
-    grouped_df = grouped_df.rename(columns={'date': 'year', 'payable_price': 'avg_monthly_sales'})
     
     # if some stores have no records at all, then
     grouped_df = grouped_df.merge(store_df, on='store_id', how='right', suffixes=['_left', ''])
@@ -278,45 +317,8 @@ def average_monthly_sales_each_year():
 
     grouped_df = grouped_df.fillna('')
     
-    # change the dataframe to json
-    result = grouped_df.to_json(orient='index')
-
-    # load that json for further formatting
-    parsed = json.loads(result)
-
-    response_list = []
-
-    for k, v in parsed.items():
-        store_dict = dict()
-        year_dict = dict()
-
-        store_dict['store_id'] = v['store_id']
-        store_dict['branch_name'] = v['branch_name']
-        
-        year_dict['year'] = v['year']
-        year_dict['avg_monthly_sales'] = v['avg_monthly_sales']
-
-        if year_dict['year'] == '' and v['avg_monthly_sales'] == '':
-            year_dict['year'] = 'No record available'
-            year_dict['avg_monthly_sales'] = 'No record available'
-        
-        store_record_found = False
-        for record in response_list:
-            if record['store'] == store_dict:
-                year_list = record['year_list']
-                year_list.append(year_dict)
-                record['year_list'] = year_list
-                store_record_found = True
-                break
-
-        if not store_record_found:
-            outer_dict = dict()
-            outer_dict['store'] = store_dict
-            outer_dict['year_list'] = []
-            outer_dict['year_list'].append(year_dict)
-            
-            response_list.append(outer_dict)
-
+    # nest records of each store under it
+    response_list = nested_records(grouped_df, 'store', ['store_id', 'branch_name'], 'year_list', ['year', 'avg_monthly_sales'])
 
     return jsonify({
         'status': 200,
@@ -333,29 +335,19 @@ def average_monthly_sales_each_year():
 def total_monthly_sales_by_year(yr):
     """Retrieve total monthly sales for a given year for each store"""
 
-    # we need store, bill, product_bill, product_lot tables
-    store_df = pd.read_sql_query('SELECT * FROM store', engine)
-    bill_df = pd.read_sql_query('SELECT * FROM bill', engine)
-    product_bill_df = pd.read_sql_query('SELECT * FROM product_bill', engine)
-    product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
-
-    # join the tables
-    combined_df = store_df\
-                  .merge(bill_df, on='store_id')\
-                  .merge(product_bill_df, on='bill_id')\
-                  .merge(product_lot_df, on='product_lot_id')
-    
-    # convert combined df datetime to datetime
-    combined_df['date'] = pd.to_datetime(combined_df['date'])
-    combined_df['payable_price'] = (combined_df['price'] - combined_df['discount']) * combined_df['quantity']
-
-    # filter for only given year
-    filtered_df = combined_df[combined_df['date'].dt.year == yr]
-
-    # group by month now
-    grouped_df = filtered_df.groupby(['store_id', 'branch_name', filtered_df['date'].dt.month_name()])['payable_price'].sum()
-    grouped_df = grouped_df.reset_index()
-    grouped_df = grouped_df.rename(columns={'payable_price': 'total_sales', 'date': 'month'})
+    store_df = table_cache.get('store', engine, ['store_id', 'branch_name'])
+
+    # total sales of each store in each month, either read from rollup table, aggregated by the database, by duckdb or in pandas
+    if USE_ROLLUPS:
+        grouped_df = pd.read_sql_query(sales_queries.store_month_rollup_query(schema.metadata_obj, yr), engine).drop(columns='year')
+        grouped_df = sales_queries.with_month_names(grouped_df, ['store_id', 'branch_name'])
+    elif SQL_PUSHDOWN:
+        grouped_df = pd.read_sql_query(sales_queries.total_monthly_sales_query(schema.metadata_obj, yr), engine)
+        grouped_df = sales_queries.with_month_names(grouped_df, ['store_id', 'branch_name'])
+    elif INSIGHT_ENGINE == 'duckdb':
+        grouped_df = duckdb_insights.total_monthly_sales(engine, yr)
+    else:
+        grouped_df = pandas_total_monthly_sales(yr)
 
     # suppose there are no records for some stores
     grouped_df = grouped_df.merge(store_df, on='store_id', how='right', suffixes=['_left', ''])
@@ -364,44 +356,9 @@ def total_monthly_sales_by_year(yr):
 
     print(grouped_df)
 
-    # change dataframe to json
-    result = grouped_df.to_json(orient='index')
-    # load that json for further formatting
-    parsed = json.loads(result)
-    response_list = []
-
-    for k, v in parsed.items():
-        store_dict = dict()
-        month_dict = dict()
-
-        store_dict['store_id'] = v['store_id']
-        store_dict['branch_name'] = v['branch_name']
+    # nest records of each store under it
+    response_list = nested_records(grouped_df, 'store', ['store_id', 'branch_name'], 'month_list', ['month', 'total_sales'])
 
-        month_dict['month'] = v['month']
-        month_dict['total_sales'] = v['total_sales']
-
-        if month_dict['month'] == '' and month_dict['total_sales'] == '':
-            month_dict['month'] = 'No record available'
-            month_dict['total_sales'] = 'No record available'
-
-
-        store_record_found = False
-        for record in response_list:
-            if record['store'] == store_dict:
-                month_list = record['month_list']
-                month_list.append(month_dict)
-                record['month_list'] = month_list
-                store_record_found = True
-                break
-        
-        if not store_record_found:
-            outer_dict = dict()
-            outer_dict['store'] = store_dict
-            outer_dict['month_list'] = []
-            outer_dict['month_list'].append(month_dict)
-
-            response_list.append(outer_dict)
-        
     return jsonify({
         'status': 200,
         'message': 'Successfully retrieved total monthly sales for all stores in a year',
@@ -413,46 +370,42 @@ def total_monthly_sales_by_year(yr):
     })
 
 
+def pandas_total_monthly_sales(yr):
+    """Compute total sales of each store in each month of given year in pandas"""
+
+    combined_df = sales_fact.get(engine)
+
+    # filter for only given year
+    filtered_df = combined_df[combined_df['year'] == yr]
+
+    # group by month now
+    grouped_df = filtered_df.groupby(['store_id', 'branch_name', 'month'], observed=True)['payable_price'].sum().sort_index()
+    grouped_df = plain_dtypes(grouped_df.reset_index())
+    return grouped_df.rename(columns={'payable_price': 'total_sales'})
+
+
 # average sales in each bill
 @app.route('/api/avg_bill_sales', methods=['GET'])
 def avg_bill_sales():
     """Retrieve average sales in each bill for each store"""
 
-    # we need store, bill, product_bill, product_lot tables
-    store_df = pd.read_sql_query('SELECT * FROM store', engine)
-    bill_df = pd.read_sql_query('SELECT * FROM bill', engine)
-    product_bill_df = pd.read_sql_query('SELECT * FROM product_bill', engine)
-    product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
+    store_df = table_cache.get('store', engine, ['store_id', 'branch_name'])
 
-    # join the tables
-    combined_df = store_df\
-                  .merge(bill_df, on='store_id')\
-                  .merge(product_bill_df, on='bill_id')\
-                  .merge(product_lot_df, on='product_lot_id')
-
-    combined_df['payable_price'] = (combined_df['price'] - combined_df['discount']) * combined_df['quantity']
-
-    # first find total of each bills
-    grouped_df = combined_df.groupby(['store_id', 'branch_name', 'bill_id'])['payable_price'].sum().rename('bill_total')
-    
-    grouped_df = grouped_df.reset_index(level='bill_id')
-
-    # now again group by store_id, branch_name and calculate average bill_total
-    grouped_df = grouped_df.groupby(level=['store_id', 'branch_name'])['bill_total'].mean().rename('average_bill_sales')
-    grouped_df = grouped_df.reset_index()
+    # average bill total of each store, either computed by duckdb or in pandas
+    if INSIGHT_ENGINE == 'duckdb':
+        grouped_df = duckdb_insights.average_bill_sales(engine)
+    else:
+        grouped_df = pandas_average_bill_sales()
 
     # for newly formed branches for which there is no record
     grouped_df = grouped_df.merge(store_df, on='store_id', how='right', suffixes=['_left', ''])
     grouped_df = grouped_df[['store_id', 'branch_name', 'average_bill_sales']]
     grouped_df = grouped_df.fillna(0)
     
-    # change the dataframe to json
-    result = grouped_df.to_json(orient='index')
+    # convert rows of the dataframe to records
+    rows = records(grouped_df)
 
-    # load that json for further formatting
-    parsed = json.loads(result)
-
-    response_list = [v for k, v in parsed.items()]
+    response_list = rows
 
 
     return jsonify({
@@ -466,22 +419,36 @@ def avg_bill_sales():
 
 
 
+def pandas_average_bill_sales():
+    """Compute average bill total of each store in pandas"""
+
+    combined_df = sales_fact.get(engine)
+
+    # first find total of each bills
+    grouped_df = combined_df.groupby(['store_id', 'branch_name', 'bill_id'], observed=True)['payable_price'].sum().sort_index().rename('bill_total')
+    
+    grouped_df = grouped_df.reset_index(level='bill_id')
+
+    # now again group by store_id, branch_name and calculate average bill_total
+    grouped_df = grouped_df.groupby(level=['store_id', 'branch_name'], observed=True)['bill_total'].mean().rename('average_bill_sales')
+    return plain_dtypes(grouped_df.reset_index())
+
+
 # different type of products supplied by each manufactuer
 @app.route('/api/manufacturer_products', methods=['GET'])
 def manufacturer_products():
     """Retrieve number of products made by each manufacturer"""
 
-    manufacturer_df = pd.read_sql_query('SELECT * FROM manufacturer', engine)
-    product_df = pd.read_sql_query('SELECT * FROM product', engine)
+    manufacturer_df = table_cache.get('manufacturer', engine, ['manufacturer_id', 'manufacturer_name'])
+    product_df = table_cache.get('product', engine, ['product_id', 'manufacturer_id'])
 
     joined_df = manufacturer_df.merge(product_df, on='manufacturer_id', how='left')
     grouped_df = joined_df.groupby(['manufacturer_id', 'manufacturer_name'])['product_id'].count().rename('num_of_products')
     grouped_df = grouped_df.reset_index()
 
-    # convert dataframe to json
-    result = grouped_df.to_json(orient='index')
-    parsed = json.loads(result)
-    response_list = [v for k, v in parsed.items()]
+    # convert rows of the dataframe to records
+    rows = records(grouped_df)
+    response_list = rows
 
     return jsonify({
         'status': 200,
@@ -498,69 +465,25 @@ def manufacturer_products():
 def category_sales(yr):
     """Retrieve total sales for each category in each month of a year"""
 
-    # we need category, product, product_lot, product_bill, bill tables
-    category_df = pd.read_sql_query('SELECT * FROM category', engine)
-    product_df = pd.read_sql_query('SELECT * FROM product', engine)
-    product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
-    product_bill_df = pd.read_sql_query('SELECT * FROM product_bill', engine)
-    bill_df = pd.read_sql_query('SELECT * FROM bill', engine)
-
-
-    # convert dataframe to json
-    joined_df = category_df\
-                .merge(product_df, on='category_id')\
-                .merge(product_lot_df, on='product_id')\
-                .merge(product_bill_df, on='product_lot_id')\
-                .merge(bill_df, on='bill_id')
-    joined_df['date'] = pd.to_datetime(joined_df['date'])
-
-    # filter the year
-    filtered_df = joined_df[joined_df['date'].dt.year == yr]
-    filtered_df['payable_price'] = (filtered_df['price'] - filtered_df['discount']) * filtered_df['quantity']
+    category_df = table_cache.get('category', engine, ['category_id', 'category_name'])
+
+    # total sales of each category in each month, either read from rollup table, aggregated by the database, by duckdb or in pandas
+    if USE_ROLLUPS:
+        grouped_df = pd.read_sql_query(sales_queries.category_month_rollup_query(schema.metadata_obj, yr), engine).drop(columns='year')
+        grouped_df = sales_queries.with_month_names(grouped_df, ['category_id', 'category_name'])
+    elif SQL_PUSHDOWN:
+        grouped_df = pd.read_sql_query(sales_queries.category_sales_query(schema.metadata_obj, yr), engine)
+        grouped_df = sales_queries.with_month_names(grouped_df, ['category_id', 'category_name'])
+    elif INSIGHT_ENGINE == 'duckdb':
+        grouped_df = duckdb_insights.category_sales(engine, yr)
+    else:
+        grouped_df = pandas_category_sales(yr)
 
-    grouped_df = filtered_df.groupby(['category_id', 'category_name', filtered_df['date'].dt.month_name()])['payable_price'].sum()
-    grouped_df = grouped_df.reset_index()
-    grouped_df = grouped_df.rename(columns={'date': 'month', 'payable_price': 'total_sales'})
     grouped_df = grouped_df.merge(category_df, on='category_id', how='right', suffixes=['_left', ''])
     grouped_df = grouped_df.fillna('')
 
-    # convert dataframe to json
-    result = grouped_df.to_json(orient='index')
-    parsed = json.loads(result)
-
-    response_list = []
-
-    for k, v in parsed.items():
-        category_dict = dict()
-        month_dict = dict()
-        
-        category_dict['category_id'] = v['category_id']
-        category_dict['category_name'] = v['category_name']
-
-        month_dict['month'] = v['month']
-        month_dict['total_sales'] = v['total_sales']
-
-        if month_dict['month'] == '' and month_dict['total_sales'] == '':
-            month_dict['month'] = 'No record available'
-            month_dict['total_sales'] = 'No record available'
-
-        
-        category_record_found = False
-        for record in response_list:
-            if record['category'] == category_dict:
-                month_list = record['month_list']
-                month_list.append(month_dict)
-                record['month_list'] = month_list
-                category_record_found = True
-                break
-
-        if not category_record_found:
-            outer_dict = dict()
-            outer_dict['category'] = category_dict
-            outer_dict['month_list'] = []
-            outer_dict['month_list'].append(month_dict)
-
-            response_list.append(outer_dict)
+    # nest records of each category under it
+    response_list = nested_records(grouped_df, 'category', ['category_id', 'category_name'], 'month_list', ['month', 'total_sales'])
 
     return jsonify({
         'status': 200,
@@ -573,82 +496,41 @@ def category_sales(yr):
     })
 
 
+def pandas_category_sales(yr):
+    """Compute total sales of each category in each month of given year in pandas"""
+
+    joined_df = sales_fact.get(engine)
+
+    # filter the year
+    filtered_df = joined_df[joined_df['year'] == yr]
+
+    # sales of products without category are left out by groupby
+    grouped_df = filtered_df.groupby(['category_id', 'category_name', 'month'], observed=True)['payable_price'].sum().sort_index()
+    grouped_df = plain_dtypes(grouped_df.reset_index())
+    return grouped_df.rename(columns={'payable_price': 'total_sales'})
+
+
 # Percentage of men and women doing shopping in each category and total shopping done by each gender
 @app.route('/api/gender_category', methods=['GET'])
 def gender_category_sales():
     """Retrieve the percentage of men and women doing sales in each category and total sales dones by each gender"""
     
-    # we need category, product, product_lot, product_bill, bill, customer tables
-    category_df = pd.read_sql_query('SELECT * FROM category', engine)
-    product_df = pd.read_sql_query('SELECT * FROM product', engine)
-    product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
-    product_bill_df = pd.read_sql_query('SELECT * FROM product_bill', engine)
-    bill_df = pd.read_sql_query('SELECT * FROM bill', engine)
-    customer_df = pd.read_sql_query('SELECT * FROM customer', engine)
-
-    # join all the tables
-    joined_df = customer_df\
-                .merge(bill_df, on='customer_id')\
-                .merge(product_bill_df, on='bill_id')\
-                .merge(product_lot_df, on='product_lot_id')\
-                .merge(product_df, on='product_id')\
-                .merge(category_df, on='category_id')
-
-    joined_df['payable_price'] = (joined_df['price'] - joined_df['discount']) * joined_df['quantity']
+    category_df = table_cache.get('category', engine, ['category_id', 'category_name'])
 
-    # find number of customers  of each gender and total shopping they did in one dataframe and percentage of each gender in another dataframe
-    grouped_df = joined_df.groupby(['category_id', 'category_name', 'gender']).agg({'customer_id': 'count', 'payable_price': np.sum})
-    pct_gender_df = (joined_df.groupby(['category_id', 'category_name'])['gender'].value_counts(normalize=True)*100).rename('gender_pct') # to calculate gender percent
-    concated_df = pd.concat([grouped_df, pct_gender_df], axis=1)
-
-    concated_df = concated_df.rename(columns={'customer_id': 'num_customers', 'payable_price': 'total_sales'})
-    concated_df = concated_df.reset_index()
+    # customers and sales of each gender in each category, either computed by duckdb or in pandas
+    if INSIGHT_ENGINE == 'duckdb':
+        concated_df = duckdb_insights.gender_category(engine)
+    else:
+        concated_df = pandas_gender_category()
 
     # some categories may have no sales records at all, for those, we join category table again
     concated_df = concated_df.merge(category_df, on='category_id', how='right', suffixes=['_left', ''])
     concated_df = concated_df[['category_id', 'category_name', 'gender', 'num_customers', 'gender_pct', 'total_sales']]
     concated_df = concated_df.fillna('')
 
-    # convert dataframe to json
-    result = concated_df.to_json(orient='index')
-    parsed = json.loads(result)
-
-    response_list = []
+    # nest records of each category under it
+    response_list = nested_records(concated_df, 'category', ['category_id', 'category_name'], 'gender_list', ['gender', 'num_customers', 'gender_pct', 'total_sales'])
 
-    for k, v in parsed.items():
-        category_dict = dict()
-        gender_dict = dict()
-
-        category_dict['category_id'] = v['category_id']
-        category_dict['category_name'] = v['category_name']
-
-        gender_dict['gender'] = v['gender']
-        gender_dict['num_customers'] = v['num_customers']
-        gender_dict['gender_pct'] = v['gender_pct']
-        gender_dict['total_sales'] = v['total_sales']
-
-        if gender_dict['gender'] == '' and gender_dict['num_customers'] == '' and gender_dict['gender_pct'] == '' and gender_dict['total_sales'] == '':
-            gender_dict['gender'] = 'No record available'
-            gender_dict['num_customers'] = 'No record available'
-            gender_dict['gender_pct'] = 'No record available'
-            gender_dict['total_sales'] = 'No record available'
-
-        category_found = False
-        for record in response_list:
-            if record['category'] == category_dict:
-                gender_list = record['gender_list']
-                gender_list.append(gender_dict)
-                record['gender_list'] = gender_list
-                category_found = True
-                break
-        if not category_found:
-            outer_dict = dict()
-            outer_dict['category'] = category_dict
-            outer_dict['gender_list'] = [gender_dict]
-
-            response_list.append(outer_dict)
-        
- 
     return jsonify({
         'status': 200,
         'message': 'Successfully retrieved gender sales record for each category',
@@ -658,21 +540,49 @@ def gender_category_sales():
         }
     })
 
+
+def pandas_gender_category():
+    """Compute number of customers, sales and percentage of each gender in each category in pandas"""
+
+    joined_df = sales_fact.get(engine)
+
+    # find number of customers  of each gender and total shopping they did in one dataframe and percentage of each gender in another dataframe
+    # sales without customer or category are left out by groupby
+    grouped_df = joined_df.groupby(['category_id', 'category_name', 'gender'], observed=True).agg({'customer_id': 'count', 'payable_price': np.sum}).sort_index()
+    # percentage of each gender is its count out of the count of all genders in that category
+    category_count = grouped_df.groupby(level=['category_id', 'category_name'], observed=True)['customer_id'].transform('sum')
+    pct_gender_df = (grouped_df['customer_id'] / category_count * 100).rename('gender_pct') # to calculate gender percent
+    concated_df = pd.concat([grouped_df, pct_gender_df], axis=1)
+
+    concated_df = concated_df.rename(columns={'customer_id': 'num_customers', 'payable_price': 'total_sales'})
+    return plain_dtypes(concated_df.reset_index())
+
 ###################
 # Baburam
 ##################
 
+# columns of each table used by the product detail endpoints below, only these are loaded
+# store_product_detail returns every column, so it loads whole tables
+PRODUCT_DETAIL_COLUMNS = {
+    'store': ['store_id', 'branch_name'],
+    'store_product': ['store_id', 'product_lot_id', 'in_stock'],
+    'product_lot': ['product_lot_id', 'product_id', 'price', 'discount', 'manufacture_date', 'expiry_date'],
+    'product': ['product_id', 'product_name', 'weight_gm', 'description', 'points_offered', 'category_id', 'manufacturer_id'],
+    'category': ['category_id', 'category_name'],
+    'manufacturer': ['manufacturer_id', 'manufacturer_name']
+}
+
 # product details  in store
 @app.route('/api/store_product_detail', methods=['GET'])
 def api_store_product_detail():
     if request.method=="GET":
         try:
-            store_df = pd.read_sql_query('SELECT * FROM store', engine)
-            store_product_df=pd.read_sql_query('SELECT * FROM store_product',engine)
-            product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
-            product_df = pd.read_sql_query('SELECT * FROM product', engine)
-            category_df = pd.read_sql_query('SELECT * FROM category', engine)
-            manufacturer_df = pd.read_sql_query('SELECT * FROM manufacturer', engine)
+            store_df = table_cache.get('store', engine)
+            store_product_df=table_cache.get('store_product', engine)
+            product_lot_df = table_cache.get('product_lot', engine)
+            product_df = table_cache.get('product', engine)
+            category_df = table_cache.get('category', engine)
+            manufacturer_df = table_cache.get('manufacturer', engine)
 
             # merge all the data_frames
             combined_store_product_df = store_df\
@@ -682,10 +592,8 @@ def api_store_product_detail():
                 .merge(category_df, on='category_id')\
                 .merge(manufacturer_df, on='manufacturer_id')
 
-            # index
-            combined_store_product_result = combined_store_product_df.to_json(orient='index') 
-            combined_store_product_parsed = json.loads(combined_store_product_result)
-            combined_store_product_response = [val for key, val in combined_store_product_parsed.items()] 
+            # each row as a record
+            combined_store_product_response = records(combined_store_product_df)
             return jsonify({
                 'status': 'Success',
                 'message': 'Successfully Product Details Retrieved ....',
@@ -707,12 +615,12 @@ def api_store_product_detail():
 def api_min_stock():
     if request.method=="GET":
         try:
-            store_df = pd.read_sql_query('SELECT * FROM store', engine)
-            store_product_df=pd.read_sql_query('SELECT * FROM store_product',engine)
-            product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
-            product_df = pd.read_sql_query('SELECT * FROM product', engine)
-            category_df = pd.read_sql_query('SELECT * FROM category', engine)
-            manufacturer_df = pd.read_sql_query('SELECT * FROM manufacturer', engine)
+            store_df = table_cache.get('store', engine, PRODUCT_DETAIL_COLUMNS['store'])
+            store_product_df=table_cache.get('store_product', engine, PRODUCT_DETAIL_COLUMNS['store_product'])
+            product_lot_df = table_cache.get('product_lot', engine, PRODUCT_DETAIL_COLUMNS['product_lot'])
+            product_df = table_cache.get('product', engine, PRODUCT_DETAIL_COLUMNS['product'])
+            category_df = table_cache.get('category', engine, PRODUCT_DETAIL_COLUMNS['category'])
+            manufacturer_df = table_cache.get('manufacturer', engine, PRODUCT_DETAIL_COLUMNS['manufacturer'])
 
             # merge all the data_frames
             combined_store_product_df = store_df\
@@ -727,9 +635,7 @@ def api_min_stock():
                 "manufacturer_name","manufacture_date","expiry_date","points_offered"]]
 
             combined_store_product_df=combined_store_product_df.sort_values(by=['in_stock']).head(3)
-            combined_store_product_result = combined_store_product_df.to_json(orient='index') 
-            combined_store_product_parsed = json.loads(combined_store_product_result)
-            combined_store_product_response = [val for key, val in combined_store_product_parsed.items()] 
+            combined_store_product_response = records(combined_store_product_df)
             return jsonify({
                 'status': 'Success',
                 'message': 'Successfully Product Details Retrieved ....',
@@ -752,12 +658,12 @@ def api_min_stock():
 def api_max_stock():
     if request.method=="GET":
         try:
-            store_df = pd.read_sql_query('SELECT * FROM store', engine)
-            store_product_df=pd.read_sql_query('SELECT * FROM store_product',engine)
-            product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
-            product_df = pd.read_sql_query('SELECT * FROM product', engine)
-            category_df = pd.read_sql_query('SELECT * FROM category', engine)
-            manufacturer_df = pd.read_sql_query('SELECT * FROM manufacturer', engine)
+            store_df = table_cache.get('store', engine, PRODUCT_DETAIL_COLUMNS['store'])
+            store_product_df=table_cache.get('store_product', engine, PRODUCT_DETAIL_COLUMNS['store_product'])
+            product_lot_df = table_cache.get('product_lot', engine, PRODUCT_DETAIL_COLUMNS['product_lot'])
+            product_df = table_cache.get('product', engine, PRODUCT_DETAIL_COLUMNS['product'])
+            category_df = table_cache.get('category', engine, PRODUCT_DETAIL_COLUMNS['category'])
+            manufacturer_df = table_cache.get('manufacturer', engine, PRODUCT_DETAIL_COLUMNS['manufacturer'])
 
             # merge all the data_frames
             combined_store_product_df = store_df\
@@ -772,9 +678,7 @@ def api_max_stock():
                 "manufacturer_name","manufacture_date","expiry_date","points_offered"]]
 
             combined_store_product_df=combined_store_product_df.sort_values(by=['in_stock'],ascending=False).head(3)
-            combined_store_product_result = combined_store_product_df.to_json(orient='index') 
-            combined_store_product_parsed = json.loads(combined_store_product_result)
-            combined_store_product_response = [val for key, val in combined_store_product_parsed.items()] 
+            combined_store_product_response = records(combined_store_product_df)
             return jsonify({
                 'status': 'Success',
                 'message': 'Successfully Product Details Retrieved ....',
@@ -796,12 +700,12 @@ def api_max_stock():
 def api_branch(branch):
     if request.method=="GET":
         try:
-            store_df = pd.read_sql_query('SELECT * FROM store', engine)
-            store_product_df=pd.read_sql_query('SELECT * FROM store_product',engine)
-            product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
-            product_df = pd.read_sql_query('SELECT * FROM product', engine)
-            category_df = pd.read_sql_query('SELECT * FROM category', engine)
-            manufacturer_df = pd.read_sql_query('SELECT * FROM manufacturer', engine)
+            store_df = table_cache.get('store', engine, PRODUCT_DETAIL_COLUMNS['store'])
+            store_product_df=table_cache.get('store_product', engine, PRODUCT_DETAIL_COLUMNS['store_product'])
+            product_lot_df = table_cache.get('product_lot', engine, PRODUCT_DETAIL_COLUMNS['product_lot'])
+            product_df = table_cache.get('product', engine, PRODUCT_DETAIL_COLUMNS['product'])
+            category_df = table_cache.get('category', engine, PRODUCT_DETAIL_COLUMNS['category'])
+            manufacturer_df = table_cache.get('manufacturer', engine, PRODUCT_DETAIL_COLUMNS['manufacturer'])
 
             # merge all the data_frames
             combined_store_product_df = store_df\
@@ -816,10 +720,7 @@ def api_branch(branch):
                 "manufacturer_name","manufacture_date","expiry_date","points_offered"]]
             
             combined_store_product_df = combined_store_product_df[combined_store_product_df["branch_name"].str.lower()== branch.lower()]
-            combined_store_product_result = combined_store_product_df.to_json(orient='index') 
-            combined_store_product_parsed = json.loads(combined_store_product_result)
-            
-            combined_store_product_response = [val for key, val in combined_store_product_parsed.items()] 
+            combined_store_product_response = records(combined_store_product_df)
             return jsonify({
                 'status': 'Success',
                 'message': 'Successfully Product Details Retrieved ....',
@@ -841,12 +742,12 @@ def api_branch(branch):
 def api_product(id):
     if request.method=="GET":
         try:
-            store_df = pd.read_sql_query('SELECT * FROM store', engine)
-            store_product_df=pd.read_sql_query('SELECT * FROM store_product',engine)
-            product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
-            product_df = pd.read_sql_query('SELECT * FROM product', engine)
-            category_df = pd.read_sql_query('SELECT * FROM category', engine)
-            manufacturer_df = pd.read_sql_query('SELECT * FROM manufacturer', engine)
+            store_df = table_cache.get('store', engine, PRODUCT_DETAIL_COLUMNS['store'])
+            store_product_df=table_cache.get('store_product', engine, PRODUCT_DETAIL_COLUMNS['store_product'])
+            product_lot_df = table_cache.get('product_lot', engine, PRODUCT_DETAIL_COLUMNS['product_lot'])
+            product_df = table_cache.get('product', engine, PRODUCT_DETAIL_COLUMNS['product'])
+            category_df = table_cache.get('category', engine, PRODUCT_DETAIL_COLUMNS['category'])
+            manufacturer_df = table_cache.get('manufacturer', engine, PRODUCT_DETAIL_COLUMNS['manufacturer'])
 
             # merge all the data_frames
             combined_store_product_df = store_df\
@@ -861,10 +762,7 @@ def api_product(id):
                 "manufacturer_name","manufacture_date","expiry_date","points_offered"]]
             
             combined_store_product_df = combined_store_product_df[id== combined_store_product_df["product_id"]]
-            combined_store_product_result = combined_store_product_df.to_json(orient='index') 
-            combined_store_product_parsed = json.loads(combined_store_product_result)
-            
-            combined_store_product_response = [val for key, val in combined_store_product_parsed.items()] 
+            combined_store_product_response = records(combined_store_product_df)
             return jsonify({
                 'status': 'Success',
                 'message': 'Successfully Product Details Retrieved ....',
@@ -887,12 +785,12 @@ def api_product(id):
 def api_manufacturer(id):
     if request.method=="GET":
         try:
-            store_df = pd.read_sql_query('SELECT * FROM store', engine)
-            store_product_df=pd.read_sql_query('SELECT * FROM store_product',engine)
-            product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
-            product_df = pd.read_sql_query('SELECT * FROM product', engine)
-            category_df = pd.read_sql_query('SELECT * FROM category', engine)
-            manufacturer_df = pd.read_sql_query('SELECT * FROM manufacturer', engine)
+            store_df = table_cache.get('store', engine, PRODUCT_DETAIL_COLUMNS['store'])
+            store_product_df=table_cache.get('store_product', engine, PRODUCT_DETAIL_COLUMNS['store_product'])
+            product_lot_df = table_cache.get('product_lot', engine, PRODUCT_DETAIL_COLUMNS['product_lot'])
+            product_df = table_cache.get('product', engine, PRODUCT_DETAIL_COLUMNS['product'])
+            category_df = table_cache.get('category', engine, PRODUCT_DETAIL_COLUMNS['category'])
+            manufacturer_df = table_cache.get('manufacturer', engine, PRODUCT_DETAIL_COLUMNS['manufacturer'])
 
             # merge all the data_frames
             combined_store_product_df = store_df\
@@ -907,10 +805,7 @@ def api_manufacturer(id):
                 "manufacturer_id","manufacturer_name","manufacture_date","expiry_date",]]
             
             combined_store_product_df = combined_store_product_df[id== combined_store_product_df["manufacturer_id"]]
-            combined_store_product_result = combined_store_product_df.to_json(orient='index') 
-            combined_store_product_parsed = json.loads(combined_store_product_result)
-            
-            combined_store_product_response = [val for key, val in combined_store_product_parsed.items()] 
+            combined_store_product_response = records(combined_store_product_df)
             return jsonify({
                 'status': 'Success',
                 'message': 'Successfully Product Details Retrieved ....',
@@ -939,61 +834,24 @@ def manufacturer_sales():
     
     # we need manufacturer, product, product_lot, product_bill
 
-    manufacturer_df = pd.read_sql_query('SELECT * FROM manufacturer', engine)
-    product_df = pd.read_sql_query('SELECT * FROM product', engine)
-    product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
-    product_bill_df = pd.read_sql_query('SELECT * FROM product_bill', engine)
-    bill_df = pd.read_sql_query('SELECT * FROM bill', engine)
-
-    joined_df = manufacturer_df\
-                .merge(product_df, on='manufacturer_id')\
-                .merge(product_lot_df, on='product_id')\
-                .merge(product_bill_df, on='product_lot_id')\
-                
-                
-                
-
-    joined_df['payable_price'] = (joined_df['price'] - joined_df['discount']) * joined_df['quantity']
-
 # find number of sales and percentage  in another dataframe
-    grouped_df = joined_df.groupby(['manufacturer_id', 'manufacturer_name'])['payable_price'].sum().rename('total_sales')
-    grouped_df = grouped_df.reset_index()
+    if USE_ROLLUPS:
+        # total sales are the sum of monthly sales in manufacturer rollup table
+        rollup_df = pd.read_sql_query(sales_queries.manufacturer_month_rollup_query(schema.metadata_obj), engine)
+        grouped_df = rollup_df.groupby(['manufacturer_id', 'manufacturer_name'])['total_sales'].sum().reset_index()
+    elif INSIGHT_ENGINE == 'duckdb':
+        grouped_df = duckdb_insights.manufacturer_sales(engine)
+    else:
+        joined_df = sales_fact.get(engine)
+        grouped_df = joined_df.groupby(['manufacturer_id', 'manufacturer_name'], observed=True)['payable_price'].sum().sort_index()
+        grouped_df = plain_dtypes(grouped_df.rename('total_sales').reset_index())
     # pct_manufacturer_df = (joined_df.groupby(['manufacturer_id', 'manufacturer_name'])['manufacturer_id'].value_counts(normalize=True).rename('percent_sales'))
     # pct_manufacturer_df = pct_manufacturer_df.reset_index()
     # concated_df = pd.concat([grouped_df, pct_manufacturer_df], axis=1)
 
-# convert dataframe to json
-    result = grouped_df.to_json(orient='index')
-    parsed = json.loads(result)
-    response_list = []
-
-    for k, v in parsed.items():
-        manufacturer_dict = dict()
-        
-
-        manufacturer_dict['manufacturer_id'] = v['manufacturer_id']
-        manufacturer_dict['manufacturer_name'] = v['manufacturer_name']
-
-        manufacturer_dict['total_sales'] = v['total_sales']
-
-        if  manufacturer_dict['total_sales'] == '':
-         manufacturer_dict['total_sales'] = 'No record available'
-
-        manufacturer_found = False
-        for record in response_list:
-            if record['manufacturer'] == manufacturer_dict:
-                manufacturer_list = record['manufacturer_list']
-                record['manufacturer_list'] = manufacturer_list
-                manufacturer_found = True
-                break
-        if not manufacturer_found:
-            outer_dict = dict()
-            outer_dict['manufacturer'] = manufacturer_dict
-            
+    # one record for each manufacturer
+    response_list = nested_records(grouped_df, 'manufacturer', ['manufacturer_id', 'manufacturer_name', 'total_sales'])
 
-            response_list.append(outer_dict)
-        
- 
     return jsonify({
         'status': 200,
         'message': 'Successfully retrieved total sales record for each manufacturer',
@@ -1010,22 +868,19 @@ def total_category_sales():
     """Retrieve the total sales done by category and percentage of sales out of total"""
     
     # we need category, product, product_lot, product_bill
-    category_df = pd.read_sql_query('SELECT * FROM category', engine)
-    product_df = pd.read_sql_query('SELECT * FROM product', engine)
-    product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
-    product_bill_df = pd.read_sql_query('SELECT * FROM product_bill', engine)
-    bill_df = pd.read_sql_query('SELECT * FROM bill', engine)
-
-    joined_df = category_df\
-                .merge(product_df, on='category_id')\
-                .merge(product_lot_df, on='product_id')\
-                .merge(product_bill_df, on='product_lot_id')\
-
-    joined_df['payable_price'] = (joined_df['price'] - joined_df['discount']) * joined_df['quantity']
+    category_df = table_cache.get('category', engine, ['category_id', 'category_name'])
 
 # find number of sales and percentage  in another dataframe
-    grouped_df = joined_df.groupby(['category_id', 'category_name'])['payable_price'].sum().rename('total_sales')
-    grouped_df = grouped_df.reset_index()
+    if USE_ROLLUPS:
+        # total sales are the sum of monthly sales in category rollup table
+        rollup_df = pd.read_sql_query(sales_queries.category_month_rollup_query(schema.metadata_obj), engine)
+        grouped_df = rollup_df.groupby(['category_id', 'category_name'])['total_sales'].sum().reset_index()
+    elif INSIGHT_ENGINE == 'duckdb':
+        grouped_df = duckdb_insights.total_category_sales(engine)
+    else:
+        joined_df = sales_fact.get(engine)
+        grouped_df = joined_df.groupby(['category_id', 'category_name'], observed=True)['payable_price'].sum().sort_index()
+        grouped_df = plain_dtypes(grouped_df.rename('total_sales').reset_index())
     # pct_manufacturer_df = (joined_df.groupby(['category_id', 'category_name'])['total_sales'].value_counts(normalize=True))
     # concated_df = pd.concat([grouped_df, pct_manufacturer_df], axis=1)
     print(grouped_df)
@@ -1034,35 +889,9 @@ def total_category_sales():
     grouped_df = grouped_df.loc[:, ['category_id', 'category_name', 'total_sales']]
     print(grouped_df)
     grouped_df = grouped_df.fillna(0)
-# convert dataframe to json
-    result = grouped_df.to_json(orient='index')
-    parsed = json.loads(result)
-    response_list = []
-
-    for k, v in parsed.items():
-        category_dict = dict()
-        
-
-        category_dict['category_id'] = v['category_id']
-        category_dict['category_name'] = v['category_name']
-
-        category_dict['total_sales'] = v['total_sales']
-
-        category_found = False
-        for record in response_list:
-            if record['category'] == category_dict:
-                category_list = record['category_list']
-                record['category_list'] = category_list
-                category_found = True
-                break
-        if not category_found:
-            outer_dict = dict()
-            outer_dict['category'] = category_dict
-            
+    # one record for each category
+    response_list = nested_records(grouped_df, 'category', ['category_id', 'category_name', 'total_sales'])
 
-            response_list.append(outer_dict)
-        
- 
     return jsonify({
         'status': 200,
         'message': 'Successfully retrieved total sales record for each category',
@@ -1073,18 +902,37 @@ def total_category_sales():
     })
 
 
+###################
+# CACHE
+###################
 
-    
-if __name__ == '__main__':
-    # create engine to connect to database
-    engine = create_engine(dbaddress.DB_ADDRESS)
+# drop cached table snapshots so that the next request reads them again from the database
+@app.route('/api/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    """Invalidate the cached snapshot of given table or of all tables"""
+
+    # body is optional, {"table": "<table_name>"} invalidates only that table
+    body = request.get_json(silent=True) or {}
+    table_name = body.get('table')
+    table_cache.invalidate(table_name)
+    sales_fact.invalidate()
+    duckdb_insights.invalidate()
+    shared_tables.invalidate()
 
-    # create connection to perform queries on database to load it to dataframe
-    conn = engine.connect()
+    return jsonify({
+        'status': 200,
+        'message': f'Successfully invalidated cached {table_name} table' if table_name is not None\
+                    else 'Successfully invalidated all cached tables',
+        'data': {}
+    })
+
+
+if __name__ == '__main__':
+    # reflect tables once before serving requests
+    schema.reflect()
 
-    # create metadata object
-    metadata_obj = MetaData(bind=engine)
-    MetaData.reflect(metadata_obj)
+    # tables are loaded before serving instead of on the first request
+    load_snapshot()
 
     # run app in debug mode
     app.run(debug=True)
\ No newline at end of file
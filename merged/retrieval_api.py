@@ -2,37 +2,81 @@
 # Baburam
 ##############
 
-from flask import Flask, jsonify, request
-from sqlalchemy import create_engine, MetaData, Table
-from sqlalchemy import select
+from flask import Flask, Response, jsonify, request, stream_with_context
 
 # for importing dbaddress
 from importlib.machinery import SourceFileLoader
 dbaddress = SourceFileLoader('dbaddress', '../dbaddress.py').load_module()
 
 
-import MySQLdb
-import json
 import pandas as pd
 import numpy as np
+from database import engine
+from schema import schema
+import pagination
+from exceptions import InvalidInput
+import streaming
+import serializers
+from serializers import records
 
 app = Flask(__name__)
+# responses are serialized with orjson when it is installed
+serializers.init_app(app)
+
+
+def read_table(table_name):
+    """Read records of given table, only one page of them ordered by primary key if limit or after query parameter is given"""
+    if 'limit' not in request.args and 'after' not in request.args:
+        return pd.read_sql_query(f'SELECT * FROM {table_name}', engine), {}
+
+    # cursor of next page is returned with the records, it is None on last page
+    limit = pagination.parse_limit(request.args.get('limit'))
+    df, next_cursor = pagination.read_page(engine, schema.table(table_name), limit, request.args.get('after'))
+    return df, {'Next Cursor': next_cursor}
+
+
+def bad_request(ii):
+    """Return response reporting invalid input of a request"""
+    return jsonify({
+        'status': 400,
+        'message': f'Bad request: {ii.get_message()}',
+        'data': {}
+    })
+
+
+def stream_table(table_name):
+    """Stream all records of given table as ndjson (stream=ndjson) or as a json array (stream=json)"""
+    fmt = request.args.get('stream')
+    if fmt not in streaming.FORMATS:
+        return jsonify({
+            'status': 'Error..',
+            'message': f'stream must be one of {", ".join(streaming.FORMATS)}',
+            })
+
+    records = streaming.stream_records(engine, schema.table(table_name), fmt)
+    return Response(stream_with_context(records), mimetype=streaming.FORMATS[fmt])
+
 
 # store details retrieve
 @app.route('/api/store', methods=['GET'])
 def api_store():
+    if request.args.get('stream') is not None:
+        return stream_table('store')
+
     if request.method=="GET":
         try:
-            store_df = pd.read_sql_query('SELECT * FROM store', engine)
-            # index
-            result_store = store_df.to_json(orient='index') 
-            parsed_store = json.loads(result_store)
-            response_store = [val for key, val in parsed_store.items()] 
+            store_df, page = read_table('store')
+            # each row as a record
+            response_store = records(store_df)
             return jsonify({
                     'status': 200,
                     'message': 'Successfully Store Retrieved ....',
-                    'Recoded Data':response_store
+                    'Recoded Data':response_store,
+                    **page
                     })
+        except InvalidInput as ii:
+            # invalid limit or cursor of a page
+            return bad_request(ii)
         except:
             return jsonify({
             'status': 'Error..',
@@ -48,19 +92,24 @@ def api_store():
 # product deails retrieve
 @app.route('/api/product', methods=['GET'])
 def api_product():
+    if request.args.get('stream') is not None:
+        return stream_table('product')
+
     if request.method=="GET":
         try:
-            product_df = pd.read_sql_query('SELECT * FROM product', engine)
-            # index
-            result_product = product_df.to_json(orient='index') 
-            parsed_product = json.loads(result_product)
-            response_product = [val for key, val in parsed_product.items()] 
+            product_df, page = read_table('product')
+            # each row as a record
+            response_product = records(product_df)
 
             return jsonify({
                 'status': 200,
                 'message': 'Successfully Product Retrieved ....',
-                'Recoded Data':response_product
+                'Recoded Data':response_product,
+                **page
                 })
+        except InvalidInput as ii:
+            # invalid limit or cursor of a page
+            return bad_request(ii)
         except:
             return jsonify({
                 'status': 'Error..',
@@ -75,19 +124,24 @@ def api_product():
 # product lot  detailsretrieve
 @app.route('/api/product_lot', methods=['GET'])
 def api_product_lot():
+    if request.args.get('stream') is not None:
+        return stream_table('product_lot')
+
     if request.method=="GET":
         try:
-            product_lot_df = pd.read_sql_query('SELECT * FROM product_lot', engine)
-            # index
-            result_product_lot = product_lot_df.to_json(orient='index') 
-            parsed_product_lot = json.loads(result_product_lot)
-            response_product_lot = [val for key, val in parsed_product_lot.items()] 
+            product_lot_df, page = read_table('product_lot')
+            # each row as a record
+            response_product_lot = records(product_lot_df)
 
             return jsonify({
                 'status': 200,
                 'message': 'Successfully Produc Lot Retrieved ....',
-                'Recoded Data':response_product_lot
+                'Recoded Data':response_product_lot,
+                **page
                 })
+        except InvalidInput as ii:
+            # invalid limit or cursor of a page
+            return bad_request(ii)
         except:
             return jsonify({
                 'status': 'Error..',
@@ -103,19 +157,24 @@ def api_product_lot():
 # store product details retrieve
 @app.route('/api/store_product', methods=['GET'])
 def api_store_product():
+    if request.args.get('stream') is not None:
+        return stream_table('store_product')
+
     if request.method=="GET":
         try:
-            store_product_df = pd.read_sql_query('SELECT * FROM store_product', engine)
-            # index
-            result_store_product = store_product_df.to_json(orient='index') 
-            parsed_store_product = json.loads(result_store_product)
-            response_store_product = [val for key, val in parsed_store_product.items()] 
+            store_product_df, page = read_table('store_product')
+            # each row as a record
+            response_store_product = records(store_product_df)
 
             return jsonify({
                 'status': 200,
                 'message': 'Successfully Store Product Retrieved ....',
-                'Recoded Data':response_store_product
+                'Recoded Data':response_store_product,
+                **page
                 })
+        except InvalidInput as ii:
+            # invalid limit or cursor of a page
+            return bad_request(ii)
         except:
             return jsonify({
                 'status': 'Error..',
@@ -131,24 +190,29 @@ def api_store_product():
 # category details retrieve
 @app.route('/api/category', methods=['GET'])
 def api_category():
+    if request.args.get('stream') is not None:
+        return stream_table('category')
+
     try:
         if request.method=="GET":
-            category_df = pd.read_sql_query('SELECT * FROM category', engine)
-            # index
-            result_category = category_df.to_json(orient='index') 
-            parsed_category = json.loads(result_category)
-            response_category = [val for key, val in parsed_category.items()] 
+            category_df, page = read_table('category')
+            # each row as a record
+            response_category = records(category_df)
 
             return jsonify({
                 'status': 200,
                 'message': 'Successfully Category Retrieved ....',
-                'Recoded Data':response_category
+                'Recoded Data':response_category,
+                **page
                 })
         else:
             return jsonify({
             'status': 'Error',
             'message': 'Wrong Method',
             })
+    except InvalidInput as ii:
+        # invalid limit or cursor of a page
+        return bad_request(ii)
     except:
         return jsonify({
             'status': 'Error..',
@@ -159,19 +223,24 @@ def api_category():
 # customer  detailsretrieve
 @app.route('/api/customer', methods=['GET'])
 def api_customer():
+    if request.args.get('stream') is not None:
+        return stream_table('customer')
+
     if request.method=="GET":
         try:
-            customer_df = pd.read_sql_query('SELECT * FROM customer', engine)
-            # index
-            result_customer = customer_df.to_json(orient='index') 
-            parsed_customer = json.loads(result_customer)
-            response_customer = [val for key, val in parsed_customer.items()] 
+            customer_df, page = read_table('customer')
+            # each row as a record
+            response_customer = records(customer_df)
 
             return jsonify({
                 'status': 'Success',
                 'message': 'Successfully Customer Retrieved ....',
-                'Recoded Data':response_customer
+                'Recoded Data':response_customer,
+                **page
                 })
+        except InvalidInput as ii:
+            # invalid limit or cursor of a page
+            return bad_request(ii)
         except:
             return jsonify({
                 'status': 'Error..',
@@ -186,19 +255,24 @@ def api_customer():
 # manufacturer details retrieve
 @app.route('/api/manufacturer', methods=['GET'])
 def api_manufacturer():
+    if request.args.get('stream') is not None:
+        return stream_table('manufacturer')
+
     if request.method=="GET":
         try:
-            manufacturer_df = pd.read_sql_query('SELECT * FROM manufacturer', engine)
-            # index
-            result_manufacturer = manufacturer_df.to_json(orient='index') 
-            parsed_manufacturer = json.loads(result_manufacturer)
-            response_manufacturer = [val for key, val in parsed_manufacturer.items()] 
+            manufacturer_df, page = read_table('manufacturer')
+            # each row as a record
+            response_manufacturer = records(manufacturer_df)
 
             return jsonify({
                 'status':"Success",
                 'message': 'Successfully Manufacturer Retrieved ....',
-                'Recoded Data':response_manufacturer
+                'Recoded Data':response_manufacturer,
+                **page
                 })
+        except InvalidInput as ii:
+            # invalid limit or cursor of a page
+            return bad_request(ii)
         except:
             return jsonify({
                 'status': 'Error..',
@@ -213,24 +287,29 @@ def api_manufacturer():
 # bill details retrieve
 @app.route('/api/bill', methods=['GET'])
 def api_bill():
+    if request.args.get('stream') is not None:
+        return stream_table('bill')
+
     try:
         if request.method=="GET":
-            bill_df = pd.read_sql_query('SELECT * FROM bill', engine)
-            # index
-            result_bill = bill_df.to_json(orient='index') 
-            parsed_bill = json.loads(result_bill)
-            response_bill = [val for key, val in parsed_bill.items()] 
+            bill_df, page = read_table('bill')
+            # each row as a record
+            response_bill = records(bill_df)
 
             return jsonify({
                 'status': 200,
                 'message': 'Successfully Bills Retrieved ....',
-                'Recoded Data':response_bill
+                'Recoded Data':response_bill,
+                **page
                 })
         else:
             return jsonify({
             'status': 'Error',
             'message': 'Wrong Method',
             })
+    except InvalidInput as ii:
+        # invalid limit or cursor of a page
+        return bad_request(ii)
     except:
         return jsonify({
             'status': 'Error..',
@@ -241,19 +320,24 @@ def api_bill():
 # product deails retrieve
 @app.route('/api/product_bill', methods=['GET'])
 def api_product_bill():
+    if request.args.get('stream') is not None:
+        return stream_table('product_bill')
+
     if request.method=="GET":
         try:
-            product_bill_df = pd.read_sql_query('SELECT * FROM product_bill', engine)
-            # index
-            result_product_bill = product_bill_df.to_json(orient='index') 
-            parsed_product_bill = json.loads(result_product_bill)
-            response_product_bill = [val for key, val in parsed_product_bill.items()] 
+            product_bill_df, page = read_table('product_bill')
+            # each row as a record
+            response_product_bill = records(product_bill_df)
 
             return jsonify({
                 'status': 200,
                 'message': 'Successfully Product Bills Retrieved ....',
-                'Recoded Data':response_product_bill
+                'Recoded Data':response_product_bill,
+                **page
                 })
+        except InvalidInput as ii:
+            # invalid limit or cursor of a page
+            return bad_request(ii)
         except:
             return jsonify({
                 'status': 'Error..',
@@ -267,15 +351,8 @@ def api_product_bill():
              
 if __name__ == '__main__':
 
-    # create engine
-    engine = create_engine(dbaddress.DB_ADDRESS)
-
-    # create connection 
-    conn = engine.connect()
-
-    # create metadata_object
-    metadata_obj = MetaData(bind=engine)
-    MetaData.reflect(metadata_obj)
+    # reflect tables once before serving requests
+    schema.reflect()
 
     # run app
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,39 @@
+# maintenance of sales rollup tables created by database_creation.create_schema
+# every product_bill insert adds its sale to the store, category and manufacturer monthly totals
+from sqlalchemy import insert, update, and_
+from sqlalchemy.exc import IntegrityError
+
+
+def add_to_rollup(conn, rollup, key, total_sales, total_quantity):
+    """Add sales to the rollup record with given key, creating the record if it doesn't exist"""
+    key_condition = and_(*[rollup.columns[column] == value for (column, value) in key.items()])
+    stmt = update(rollup)\
+           .where(key_condition)\
+           .values(total_sales=rollup.columns.total_sales + total_sales,
+                   total_quantity=rollup.columns.total_quantity + total_quantity)
+
+    if conn.execute(stmt).rowcount > 0:
+        return
+
+    try:
+        conn.execute(insert(rollup).values(total_sales=total_sales, total_quantity=total_quantity, **key))
+    except IntegrityError:
+        # record was created by another request in the meantime
+        conn.execute(stmt)
+
+
+def record_sale(conn, metadata_obj, date, store_id, category_id, manufacturer_id, total_sales, total_quantity):
+    """Add one product_bill sale to all sales rollup tables"""
+    period = {'year': date.year, 'month': date.month}
+
+    # sales without store, category or manufacturer are not part of that rollup
+    rollup_dict = {
+        'sales_store_month': ('store_id', store_id),
+        'sales_category_month': ('category_id', category_id),
+        'sales_manufacturer_month': ('manufacturer_id', manufacturer_id)
+    }
+
+    for (table_name, (key_column, key_value)) in rollup_dict.items():
+        if key_value is None:
+            continue
+        add_to_rollup(conn, metadata_obj.tables[table_name], dict(period, **{key_column: key_value}), total_sales, total_quantity)
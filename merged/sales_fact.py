@@ -0,0 +1,176 @@
+# denormalized sales fact dataframe shared by all sales insight endpoints
+# every row is one product_bill record joined with its bill, store, customer, product_lot, product, category and manufacturer
+# payable price is computed once here instead of in every request, year and month come with the bill snapshot
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+# tables which the sales fact is built from
+SOURCE_TABLES = ['store', 'customer', 'category', 'manufacturer', 'product', 'product_lot', 'bill', 'product_bill']
+
+# tables which only gain new rows as sales happen, all other tables are dimensions of the sales
+SALES_TABLES = ['bill', 'product_bill']
+
+# columns of dimension tables used by the sales fact, only these are loaded
+# all columns of sales tables are used and those are loaded in full
+SOURCE_COLUMNS = {
+    'store': ['store_id', 'branch_name'],
+    'customer': ['customer_id', 'gender'],
+    'category': ['category_id', 'category_name'],
+    'manufacturer': ['manufacturer_id', 'manufacturer_name'],
+    'product': ['product_id', 'product_name', 'category_id', 'manufacturer_id'],
+    'product_lot': ['product_lot_id', 'product_id', 'price', 'discount']
+}
+
+
+def name_dtype(names):
+    """Return categorical dtype holding all distinct names of a dimension table"""
+    return pd.CategoricalDtype(sorted(names.dropna().unique()))
+
+
+def build_sales_rows(tables, product_bill_df):
+    """Join given product_bill records with all other source tables into sales fact rows"""
+    store_df = tables['store']
+    customer_df = tables['customer']
+    category_df = tables['category']
+    manufacturer_df = tables['manufacturer']
+    product_df = tables['product']
+    product_lot_df = tables['product_lot']
+    bill_df = tables['bill']
+
+    # bill may not have store or customer and product may not have category or manufacturer, so those are left joins
+    # month of the sales fact is the month name
+    bill_df = bill_df.loc[:, ['bill_id', 'date', 'year', 'month_name', 'store_id', 'customer_id']]\
+                     .rename(columns={'month_name': 'month'})\
+                     .astype({'store_id': 'Int64', 'customer_id': 'Int64'})
+    product_df = product_df.loc[:, ['product_id', 'product_name', 'category_id', 'manufacturer_id']]\
+                           .astype({'category_id': 'Int64', 'manufacturer_id': 'Int64'})
+
+    fact_df = product_bill_df.loc[:, ['bill_id', 'product_lot_id', 'quantity']]\
+              .merge(bill_df, on='bill_id')\
+              .merge(product_lot_df.loc[:, ['product_lot_id', 'product_id', 'price', 'discount']], on='product_lot_id')\
+              .merge(product_df, on='product_id', how='left')\
+              .merge(store_df.loc[:, ['store_id', 'branch_name']].astype({'store_id': 'Int64'}), on='store_id', how='left')\
+              .merge(customer_df.loc[:, ['customer_id', 'gender']].astype({'customer_id': 'Int64'}), on='customer_id', how='left')\
+              .merge(category_df.loc[:, ['category_id', 'category_name']].astype({'category_id': 'Int64'}), on='category_id', how='left')\
+              .merge(manufacturer_df.loc[:, ['manufacturer_id', 'manufacturer_name']].astype({'manufacturer_id': 'Int64'}), on='manufacturer_id', how='left')
+
+    # payable price is calculated by subtracting discount from price
+    fact_df['payable_price'] = (fact_df['price'] - fact_df['discount']) * fact_df['quantity']
+
+    # names repeat for every sale, so they are stored as categoricals with categories taken from dimension tables
+    return fact_df.astype({
+        'branch_name': name_dtype(store_df['branch_name']),
+        'gender': name_dtype(customer_df['gender']),
+        'product_name': name_dtype(product_df['product_name']),
+        'category_name': name_dtype(category_df['category_name']),
+        'manufacturer_name': name_dtype(manufacturer_df['manufacturer_name'])
+    })
+
+
+def source_tables(cache, engine):
+    """Return cached snapshots of all source tables with at least the columns used by the sales fact"""
+    return {table_name: cache.get(table_name, engine, SOURCE_COLUMNS.get(table_name)) for table_name in SOURCE_TABLES}
+
+
+def changed_bills_start(old_tables, new_tables):
+    """Return lowest bill_id whose bill or product_bill records differ between two sets of snapshots, None if none differ
+
+    snapshots kept current by sales_refresher keep their earlier rows in place, so rows are compared up to the first one
+    that differs and all bills of the rows from there on are taken as changed, also when an earlier bill got new records
+    """
+    starts = []
+    for (table_name, columns) in [('bill', ['bill_id']), ('product_bill', ['bill_id', 'product_lot_id', 'quantity'])]:
+        old_df = old_tables[table_name]
+        new_df = new_tables[table_name]
+        if old_df is new_df:
+            continue
+        rows = min(len(old_df), len(new_df))
+        differ = np.zeros(rows, dtype=bool)
+        for column in columns:
+            differ |= old_df[column].to_numpy()[:rows] != new_df[column].to_numpy()[:rows]
+        first = int(differ.argmax()) if differ.any() else rows
+        bill_ids = np.concatenate([old_df['bill_id'].to_numpy()[first:], new_df['bill_id'].to_numpy()[first:]])
+        if len(bill_ids):
+            starts.append(int(bill_ids.min()))
+    return min(starts) if starts else None
+
+
+def plain_dtypes(df):
+    """Convert categorical columns of an aggregated dataframe back to plain object columns"""
+    categorical_columns = [column for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)]
+    return df.astype({column: object for column in categorical_columns})
+
+
+class SalesFact:
+    """Sales fact dataframe built from cached table snapshots and extended as new bills arrive"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._df = None
+        # table snapshots which the current fact dataframe was built from
+        self._sources = None
+
+    def get(self, engine):
+        """Return the sales fact dataframe, rebuilding only what changed in the cached tables"""
+        tables = source_tables(self.cache, engine)
+
+        with self._lock:
+            if self._df is None or self._dimensions_changed(tables):
+                self._df = build_sales_rows(tables, tables['product_bill'])
+            elif any(tables[table_name] is not self._sources[table_name] for table_name in SALES_TABLES):
+                self._df = self._extend(tables)
+            self._sources = tables
+            return self._df
+
+    def put(self, df, tables):
+        """Use given sales fact dataframe, built by another process from given table snapshots"""
+        with self._lock:
+            self._df = df
+            self._sources = tables
+
+    def append(self, tables, replaced_product_bill_df, bill_tail_df, product_bill_tail_df, tail_start):
+        """Replace sales rows of bills from tail_start onwards by rows built from given bill and product_bill records
+
+        tables are the current table snapshots which already contain the given records
+        and replaced_product_bill_df is the product_bill snapshot they were appended to
+        """
+        with self._lock:
+            # if the fact was not built from the replaced snapshot, it is brought up to date on next use instead
+            if self._df is None or self._sources['product_bill'] is not replaced_product_bill_df:
+                return
+
+            # a changed dimension needs full rebuild which happens on next use
+            if self._dimensions_changed(tables):
+                self._reset()
+                return
+
+            # only the new records are joined, with just their bills instead of whole bill table
+            tail_df = build_sales_rows(dict(tables, bill=bill_tail_df), product_bill_tail_df)
+            self._df = pd.concat([self._df[self._df['bill_id'] < tail_start], tail_df], ignore_index=True)
+            self._sources = tables
+
+    def invalidate(self):
+        """Drop the sales fact dataframe so that it is rebuilt on next use"""
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self._df = None
+        self._sources = None
+
+    def _dimensions_changed(self, tables):
+        return any(tables[table_name] is not self._sources[table_name]
+                   for table_name in SOURCE_TABLES if table_name not in SALES_TABLES)
+
+    def _extend(self, tables):
+        # rows of bills from the first changed one onwards are rebuilt, bills still open may get records after later bills
+        tail_start = changed_bills_start(self._sources, tables)
+        if tail_start is None:
+            return self._df
+        new_product_bill_df = tables['product_bill']
+        tail_df = build_sales_rows(tables, new_product_bill_df[new_product_bill_df['bill_id'] >= tail_start])
+        return pd.concat([self._df[self._df['bill_id'] < tail_start], tail_df], ignore_index=True)
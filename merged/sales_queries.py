@@ -0,0 +1,152 @@
+# sqlalchemy core queries for sales insights
+# joins, year filter and aggregation run inside the database so only the aggregated rows are transferred
+import calendar
+import datetime as dt
+
+from sqlalchemy import select, func, extract, and_
+
+
+def _year_range(bill, product_bill, yr):
+    # range condition on bill.date instead of YEAR(date) = yr so that an index on date can be used
+    # and only the partition of the year is read when bill is partitioned by year
+    start, end = dt.date(yr, 1, 1), dt.date(yr + 1, 1, 1)
+    condition = and_(bill.columns.date >= start, bill.columns.date < end)
+    # partitioned product_bill has date of its bill, the same condition on it reads one partition of product_bill too
+    if 'bill_date' in product_bill.columns:
+        condition = and_(condition, product_bill.columns.bill_date >= start, product_bill.columns.bill_date < end)
+    return condition
+
+
+def _payable_price(product_lot, product_bill):
+    # payable price is calculated by subtracting discount from price
+    return (product_lot.columns.price - product_lot.columns.discount) * product_bill.columns.quantity
+
+
+def total_sales_by_store_query(metadata_obj, yr):
+    """Return query for total sales of each store in given year"""
+    store = metadata_obj.tables['store']
+    bill = metadata_obj.tables['bill']
+    product_bill = metadata_obj.tables['product_bill']
+    product_lot = metadata_obj.tables['product_lot']
+
+    joined = store\
+             .join(bill, bill.columns.store_id == store.columns.store_id)\
+             .join(product_bill, product_bill.columns.bill_id == bill.columns.bill_id)\
+             .join(product_lot, product_lot.columns.product_lot_id == product_bill.columns.product_lot_id)
+
+    return select([
+                store.columns.store_id,
+                store.columns.branch_name,
+                func.sum(_payable_price(product_lot, product_bill)).label('total_sales')
+            ])\
+            .select_from(joined)\
+            .where(_year_range(bill, product_bill, yr))\
+            .group_by(store.columns.store_id, store.columns.branch_name)\
+            .order_by(store.columns.store_id, store.columns.branch_name)
+
+
+def total_monthly_sales_query(metadata_obj, yr):
+    """Return query for total sales of each store in each month of given year"""
+    store = metadata_obj.tables['store']
+    bill = metadata_obj.tables['bill']
+    product_bill = metadata_obj.tables['product_bill']
+    product_lot = metadata_obj.tables['product_lot']
+
+    month = extract('month', bill.columns.date)
+    joined = store\
+             .join(bill, bill.columns.store_id == store.columns.store_id)\
+             .join(product_bill, product_bill.columns.bill_id == bill.columns.bill_id)\
+             .join(product_lot, product_lot.columns.product_lot_id == product_bill.columns.product_lot_id)
+
+    return select([
+                store.columns.store_id,
+                store.columns.branch_name,
+                month.label('month'),
+                func.sum(_payable_price(product_lot, product_bill)).label('total_sales')
+            ])\
+            .select_from(joined)\
+            .where(_year_range(bill, product_bill, yr))\
+            .group_by(store.columns.store_id, store.columns.branch_name, month)
+
+
+def category_sales_query(metadata_obj, yr):
+    """Return query for total sales of each category in each month of given year"""
+    category = metadata_obj.tables['category']
+    product = metadata_obj.tables['product']
+    product_lot = metadata_obj.tables['product_lot']
+    product_bill = metadata_obj.tables['product_bill']
+    bill = metadata_obj.tables['bill']
+
+    month = extract('month', bill.columns.date)
+    joined = category\
+             .join(product, product.columns.category_id == category.columns.category_id)\
+             .join(product_lot, product_lot.columns.product_id == product.columns.product_id)\
+             .join(product_bill, product_bill.columns.product_lot_id == product_lot.columns.product_lot_id)\
+             .join(bill, bill.columns.bill_id == product_bill.columns.bill_id)
+
+    return select([
+                category.columns.category_id,
+                category.columns.category_name,
+                month.label('month'),
+                func.sum(_payable_price(product_lot, product_bill)).label('total_sales')
+            ])\
+            .select_from(joined)\
+            .where(_year_range(bill, product_bill, yr))\
+            .group_by(category.columns.category_id, category.columns.category_name, month)
+
+
+def with_month_names(df, keys):
+    """Replace month numbers by month names and order rows the same way as grouping by month name in pandas"""
+    df['month'] = df['month'].astype(int).map(lambda m: calendar.month_name[m])
+    return df.sort_values(by=keys + ['month']).reset_index(drop=True)
+
+
+def store_month_rollup_query(metadata_obj, yr=None):
+    """Return query for monthly sales of each store from the store rollup table, optionally only for given year"""
+    store = metadata_obj.tables['store']
+    sales_store_month = metadata_obj.tables['sales_store_month']
+
+    stmt = select([
+                store.columns.store_id,
+                store.columns.branch_name,
+                sales_store_month.columns.year,
+                sales_store_month.columns.month,
+                sales_store_month.columns.total_sales
+            ])\
+            .select_from(store.join(sales_store_month, sales_store_month.columns.store_id == store.columns.store_id))
+    if yr is not None:
+        stmt = stmt.where(sales_store_month.columns.year == yr)
+    return stmt
+
+
+def category_month_rollup_query(metadata_obj, yr=None):
+    """Return query for monthly sales of each category from the category rollup table, optionally only for given year"""
+    category = metadata_obj.tables['category']
+    sales_category_month = metadata_obj.tables['sales_category_month']
+
+    stmt = select([
+                category.columns.category_id,
+                category.columns.category_name,
+                sales_category_month.columns.year,
+                sales_category_month.columns.month,
+                sales_category_month.columns.total_sales
+            ])\
+            .select_from(category.join(sales_category_month, sales_category_month.columns.category_id == category.columns.category_id))
+    if yr is not None:
+        stmt = stmt.where(sales_category_month.columns.year == yr)
+    return stmt
+
+
+def manufacturer_month_rollup_query(metadata_obj):
+    """Return query for monthly sales of each manufacturer from the manufacturer rollup table"""
+    manufacturer = metadata_obj.tables['manufacturer']
+    sales_manufacturer_month = metadata_obj.tables['sales_manufacturer_month']
+
+    return select([
+                manufacturer.columns.manufacturer_id,
+                manufacturer.columns.manufacturer_name,
+                sales_manufacturer_month.columns.year,
+                sales_manufacturer_month.columns.month,
+                sales_manufacturer_month.columns.total_sales
+            ])\
+            .select_from(manufacturer.join(sales_manufacturer_month, sales_manufacturer_month.columns.manufacturer_id == manufacturer.columns.manufacturer_id))
@@ -0,0 +1,129 @@
+# incremental refresh of cached bill and product_bill snapshots
+# bill and product_bill only gain new rows as sales happen, so instead of reading whole tables again
+# only new bills and the product_bill records of the latest bills are fetched and appended
+#
+# several stores check out at once, so a bill may still get records after later bills got theirs,
+# records of the latest OPEN_BILLS bills are therefore always read again, not only those of the last bill,
+# and both tables are read again in full every reload_interval for records added to bills older than those
+import threading
+import time
+
+import pandas as pd
+from sqlalchemy import text
+
+from sales_fact import source_tables
+from table_dtypes import date_columns, prepare_frame
+
+
+# default minimum number of seconds between two refreshes
+DEFAULT_REFRESH_SECONDS = 5
+
+# default number of latest bills which may still get product_bill records
+DEFAULT_OPEN_BILLS = 1000
+
+# default number of seconds after which bill and product_bill are read again in full, None to never read them again
+DEFAULT_RELOAD_SECONDS = 3600
+
+
+def open_bills_start(bill_df, open_bills):
+    """Return lowest bill_id of the latest open_bills bills, 0 if there are no bills"""
+    if len(bill_df) == 0:
+        return 0
+    return int(bill_df['bill_id'].nlargest(open_bills).min())
+
+
+class SalesRefresher:
+    """Keeps cached bill and product_bill snapshots and the sales fact current by fetching only new sales"""
+
+    def __init__(self, cache, sales_fact, interval=DEFAULT_REFRESH_SECONDS, open_bills=DEFAULT_OPEN_BILLS,
+                 reload_interval=DEFAULT_RELOAD_SECONDS):
+        self.cache = cache
+        self.sales_fact = sales_fact
+        self.interval = interval
+        self.open_bills = open_bills
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._last_refresh = None
+        # when the snapshots were last loaded in full
+        self._loaded_at = None
+        # snapshots this refresher last stored, if the cache holds other ones they were reloaded in full
+        self._bill_df = None
+        self._product_bill_df = None
+        # highest bill_id in bill snapshot
+        self.last_bill_id = None
+        # product_bill records are added to open bills, so records from the first of the latest open_bills bills are read again
+        self.tail_start = None
+        # number of rows of product_bill snapshot whose bill_id is tail_start or more
+        self._tail_rows = 0
+
+    def refresh(self, engine, force=False):
+        """Fetch bills and product_bill records added since last refresh and append them to cached snapshots"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._last_refresh is not None and now - self._last_refresh < self.interval:
+                return
+            self._last_refresh = now
+
+            if self.reload_interval is not None and self._loaded_at is not None and now - self._loaded_at > self.reload_interval:
+                # records added to bills older than the open ones are only seen by reading the tables in full
+                self.cache.invalidate('bill')
+                self.cache.invalidate('product_bill')
+
+            bill_df = self.cache.get('bill', engine)
+            product_bill_df = self.cache.get('product_bill', engine)
+            if bill_df is not self._bill_df or product_bill_df is not self._product_bill_df:
+                # snapshots were loaded in full, so marks are taken from them
+                self._start(bill_df, product_bill_df)
+
+            # records are ordered by bill_id so that records of the latest bills come last
+            bill_tail_df = pd.read_sql_query(text('SELECT * FROM bill WHERE bill_id >= :tail_start ORDER BY bill_id'),
+                                             engine, params={'tail_start': self.tail_start}, parse_dates=date_columns('bill'))
+            product_bill_tail_df = pd.read_sql_query(text('SELECT * FROM product_bill WHERE bill_id >= :tail_start ORDER BY bill_id'),
+                                                     engine, params={'tail_start': self.tail_start})
+            # same dtypes as the cached snapshots they are appended to
+            bill_tail_df = prepare_frame('bill', bill_tail_df)
+            product_bill_tail_df = prepare_frame('product_bill', product_bill_tail_df)
+
+            new_bill_df = bill_tail_df[bill_tail_df['bill_id'] > self.last_bill_id]
+            if len(new_bill_df) == 0 and len(product_bill_tail_df) == self._tail_rows:
+                # nothing was added since last refresh
+                return
+
+            # records of bills from tail_start onwards are always the last rows of product_bill snapshot
+            replaced_product_bill_df = self._product_bill_df
+            head_df = replaced_product_bill_df.iloc[:len(replaced_product_bill_df) - self._tail_rows]
+            bill_df = pd.concat([self._bill_df, new_bill_df], ignore_index=True)
+            product_bill_df = pd.concat([head_df, product_bill_tail_df], ignore_index=True)
+
+            # refreshed snapshots do not expire, they are kept current by this refresher
+            self.cache.put('bill', bill_df, keep=True)
+            self.cache.put('product_bill', product_bill_df, keep=True)
+
+            tables = source_tables(self.cache, engine)
+            self.sales_fact.append(tables, replaced_product_bill_df, bill_tail_df, product_bill_tail_df, self.tail_start)
+
+            # marks only move forward, so they are taken from the fetched records
+            if len(new_bill_df):
+                self.last_bill_id = int(new_bill_df['bill_id'].max())
+            self.tail_start = max(self.tail_start, open_bills_start(bill_df, self.open_bills))
+            self._tail_rows = int((product_bill_tail_df['bill_id'] >= self.tail_start).sum())
+            self._bill_df = bill_df
+            self._product_bill_df = product_bill_df
+
+    def _start(self, bill_df, product_bill_df):
+        self.last_bill_id = int(bill_df['bill_id'].max()) if len(bill_df) else 0
+        self.tail_start = open_bills_start(bill_df, self.open_bills)
+
+        # move records of the open bills to the end of product_bill snapshot
+        tail = product_bill_df['bill_id'] >= self.tail_start
+        self._tail_rows = int(tail.sum())
+        if not tail.iloc[len(tail) - self._tail_rows:].all():
+            product_bill_df = pd.concat([product_bill_df[~tail], product_bill_df[tail]], ignore_index=True)
+
+        # from now on snapshots are kept current by this refresher, so they do not expire
+        self.cache.put('bill', bill_df, keep=True)
+        self.cache.put('product_bill', product_bill_df, keep=True)
+
+        self._bill_df = bill_df
+        self._product_bill_df = product_bill_df
+        self._loaded_at = time.monotonic()
@@ -0,0 +1,53 @@
+# database schema shared by all apis
+# tables are reflected once per process instead of autoloading them in every request
+# and insert statements built on them are kept so that sqlalchemy reuses their compiled form
+import threading
+
+from sqlalchemy import MetaData, insert
+
+import backend
+from database import engine
+
+
+class Schema:
+    """Tables reflected from the database together with statements built for them"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._lock = threading.Lock()
+        self._metadata_obj = None
+        self._statements = {}
+
+    @property
+    def metadata_obj(self):
+        """Metadata holding all tables of the database, reflected on first use"""
+        if self._metadata_obj is None:
+            self.reflect()
+        return self._metadata_obj
+
+    def reflect(self):
+        """Reflect all tables from the database, replacing earlier reflected tables and statements"""
+        with self._lock:
+            metadata_obj = MetaData(bind=self.engine)
+            backend.reflect(metadata_obj, self.engine)
+            self._statements = {}
+            self._metadata_obj = metadata_obj
+
+    def table(self, table_name):
+        """Return reflected table with given name"""
+        return self.metadata_obj.tables[table_name]
+
+    def insert(self, table_name):
+        """Return insert statement for given table, values are given when executing it"""
+        return self._statement(('insert', table_name), lambda table: insert(table))
+
+    def _statement(self, key, build):
+        statement = self._statements.get(key)
+        if statement is None:
+            statement = build(self.table(key[1]))
+            self._statements[key] = statement
+        return statement
+
+
+# schema shared by the process
+schema = Schema(engine)
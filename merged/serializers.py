@@ -0,0 +1,118 @@
+# conversion of dataframes into json response records in one pass
+# instead of df.to_json followed by json.loads, columns are converted to plain python values directly
+# values are the same as the json round trip gave: missing values become None, datetimes become epoch milliseconds
+# and floats keep 10 decimal places like to_json did
+import calendar
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+from flask.json.provider import DefaultJSONProvider
+
+# orjson is optional, responses are serialized with it when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# decimal places kept for floats, same as default double_precision of DataFrame.to_json
+DOUBLE_PRECISION = 10
+
+
+def plain_value(value):
+    """Convert one value of an object column to the value it had after json round trip"""
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return None if np.isnan(value) else round(value, DOUBLE_PRECISION)
+    if isinstance(value, dt.datetime):
+        # naive datetimes are taken as utc, same as to_json
+        return calendar.timegm(value.utctimetuple()) * 1000 + value.microsecond // 1000
+    if isinstance(value, dt.date):
+        return calendar.timegm(value.timetuple()) * 1000
+    return value
+
+
+def column_values(column):
+    """Return values of a dataframe column as a list of plain python values"""
+    dtype = column.dtype
+
+    # numpy numeric and datetime columns are converted as a whole
+    if isinstance(dtype, np.dtype) and (pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype)):
+        return column.tolist()
+    if isinstance(dtype, np.dtype) and pd.api.types.is_float_dtype(dtype):
+        values = column.round(DOUBLE_PRECISION)
+        return values.astype(object).where(values.notna(), None).tolist()
+    if isinstance(dtype, np.dtype) and pd.api.types.is_datetime64_dtype(dtype):
+        millis = column.values.astype('datetime64[ms]').astype(np.int64)
+        return pd.Series(millis, index=column.index).astype(object).where(column.notna(), None).tolist()
+
+    # categories are converted once instead of every value
+    if isinstance(dtype, pd.CategoricalDtype):
+        categories = column_values(pd.Series(dtype.categories))
+        return [categories[code] if code >= 0 else None for code in column.cat.codes.tolist()]
+
+    # object columns of only strings need no conversion, other object and nullable columns are converted value by value
+    values = column.astype(object)
+    if pd.api.types.infer_dtype(values, skipna=False) == 'string':
+        return values.tolist()
+    return [plain_value(value) for value in values]
+
+
+def records(df):
+    """Return rows of dataframe as list of dicts of plain python values, in the order of the rows"""
+    columns = [str(column) for column in df.columns]
+    values = [column_values(df.iloc[:, i]) for i in range(len(df.columns))]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def nested_records(df, outer_name, outer_columns, list_name=None, list_columns=None, missing='No record available'):
+    """Return one record for each distinct value of outer_columns, holding list_columns of its rows as a list
+
+    e.g. nested_records(df, 'store', ['store_id', 'branch_name'], 'month_list', ['month', 'total_sales']) gives
+    [{'store': {'store_id': ..., 'branch_name': ...}, 'month_list': [{'month': ..., 'total_sales': ...}, ...]}, ...]
+    records are in order of first appearance of their outer values and list items in order of rows,
+    list items whose values are all '' (left by fillna for groups without rows) get missing as their values
+    """
+    # groupby numbers the groups in order of first appearance, so one pass over rows puts them in their groups
+    group_numbers = df.groupby(outer_columns, sort=False, dropna=False).ngroup().tolist()
+    outer_rows = records(df.loc[:, outer_columns])
+    list_rows = records(df.loc[:, list_columns]) if list_name is not None else None
+
+    response_list = []
+    for (i, group_number) in enumerate(group_numbers):
+        if group_number == len(response_list):
+            outer_dict = {outer_name: outer_rows[i]}
+            if list_name is not None:
+                outer_dict[list_name] = []
+            response_list.append(outer_dict)
+
+        if list_name is not None:
+            list_dict = list_rows[i]
+            if all(value == '' for value in list_dict.values()):
+                list_dict = dict.fromkeys(list_dict, missing)
+            response_list[group_number][list_name].append(list_dict)
+
+    return response_list
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask json provider serializing responses with orjson"""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def init_app(app, fast_json=True):
+    """Serialize responses of app with orjson if it is installed and fast_json is set"""
+    if fast_json and orjson is not None:
+        app.json = OrjsonProvider(app)
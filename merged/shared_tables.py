@@ -0,0 +1,244 @@
+# table snapshots shared between worker processes through memory mapped arrow files
+# when the insights app runs in several worker processes (e.g. under a pre-fork server), each worker would load
+# its own copy of every table and build its own sales fact, so one publisher process loads them instead
+# and writes them as an immutable version of arrow ipc files into a directory on /dev/shm,
+# workers memory map the files of the current version and use their columns as dataframes without copying them
+#
+# a new version is published when sales are added or a dimension table changes, and becomes current by replacing
+# the symlink `current` in one rename, workers switch to it on their next request and keep using the old version
+# until then, files of old versions are deleted by the publisher but stay readable by workers which still map them
+#
+# run the publisher from the merged folder, with tables loaded from the database or from a parquet snapshot:
+# $ python shared_tables.py /dev/shm/rsm --snapshot-dir ../snapshot
+# and the workers with RSM_SHARED_TABLES_DIR=/dev/shm/rsm set for pandas_api
+import argparse
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+import pandas as pd
+
+from sales_fact import source_tables
+from snapshots import SNAPSHOT_TABLES
+
+# pyarrow is optional, it is only needed for sharing tables between processes
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+# name under which the sales fact is published along with the tables
+SALES_FACT = 'sales'
+
+# symlink naming the current version
+CURRENT = 'current'
+
+# versions kept besides the current one, so that a worker switching to the current version never misses its files
+KEEP_VERSIONS = 1
+
+# default number of seconds between two publishes
+DEFAULT_PUBLISH_SECONDS = 5
+
+# nullable integer columns are published as their values and a separate mask column with this suffix,
+# so that workers can use their values in place, arrow would give them as float64 or copy them into new arrays
+MASK_SUFFIX = '__mask'
+
+VERSION_PATTERN = re.compile(r'^v(\d+)$')
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError('pyarrow is needed for sharing tables between processes, install it with pip install pyarrow')
+
+
+def is_masked_integer(dtype):
+    """Return True for nullable integer dtypes like Int64"""
+    return pd.api.types.is_extension_array_dtype(dtype) and pd.api.types.is_integer_dtype(dtype)
+
+
+def to_arrow(df):
+    """Return arrow table of a dataframe whose columns can be used in place by frame_of"""
+    arrays = []
+    names = []
+    masked = []
+    for column in df.columns:
+        values = df[column]
+        if is_masked_integer(values.dtype):
+            mask = values.isna().to_numpy()
+            arrays += [pa.array(values.to_numpy(dtype=values.dtype.numpy_dtype, na_value=0)), pa.array(mask.view('uint8'))]
+            names += [column, f'{column}{MASK_SUFFIX}']
+            masked.append(column)
+        elif isinstance(values.dtype, pd.CategoricalDtype) or values.dtype == object:
+            arrays.append(pa.array(values, from_pandas=True))
+            names.append(column)
+        else:
+            # numpy columns are copied as they are, nan and nat stay values instead of becoming nulls
+            arrays.append(pa.array(values.to_numpy()))
+            names.append(column)
+    return pa.Table.from_arrays(arrays, names=names, metadata={'masked': json.dumps(masked)})
+
+
+def frame_of(table):
+    """Return dataframe of an arrow table written by to_arrow, numeric columns without nulls are views of its buffers"""
+    # split blocks keep each column in its own array, so that they are not copied into one block per dtype
+    df = table.to_pandas(split_blocks=True)
+    masked = json.loads(table.schema.metadata[b'masked'])
+    columns = {}
+    for column in df.columns:
+        if column in masked:
+            # pandas hashes masked arrays only with a writable mask, so masks are copied, values are used in place
+            mask = df[f'{column}{MASK_SUFFIX}'].to_numpy().view(bool).copy()
+            columns[column] = pd.arrays.IntegerArray(df[column].to_numpy(), mask)
+        elif not column.endswith(MASK_SUFFIX):
+            columns[column] = df[column]
+    # assigning columns one by one would copy them, a dataframe built from all of them at once does not
+    return pd.DataFrame(columns, copy=False)
+
+
+def write_arrow(path, df):
+    """Write dataframe into an uncompressed arrow ipc file, which can be memory mapped and read in place"""
+    table = to_arrow(df)
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def read_arrow(path):
+    """Return dataframe of a memory mapped arrow ipc file written by write_arrow"""
+    with pa.memory_map(path) as source:
+        return frame_of(pa.ipc.open_file(source).read_all())
+
+
+def versions(directory):
+    """Return numbers of all complete versions in directory, oldest first"""
+    matches = [VERSION_PATTERN.match(name) for name in os.listdir(directory)]
+    return sorted(int(match.group(1)) for match in matches if match)
+
+
+def version_name(number):
+    return f'v{number:08d}'
+
+
+class SharedTablePublisher:
+    """Publishes versions of cached tables and the sales fact for worker processes"""
+
+    def __init__(self, directory, cache, sales_fact, sales_refresher):
+        require_pyarrow()
+        self.directory = directory
+        self.cache = cache
+        self.sales_fact = sales_fact
+        self.sales_refresher = sales_refresher
+        os.makedirs(directory, exist_ok=True)
+        existing = versions(directory)
+        self._next_version = existing[-1] + 1 if existing else 1
+        # dataframes of the last published version by name
+        self._published = {}
+
+    def publish(self, engine):
+        """Publish a new version if sales were added or tables changed since the last one, return True if published"""
+        # all columns of every table are published, so tables are loaded in full before the refresher reads them
+        self._tables(engine)
+        self.sales_refresher.refresh(engine, force=True)
+        frames = self._tables(engine)
+        frames[SALES_FACT] = self.sales_fact.get(engine)
+
+        if all(frames[name] is self._published.get(name) for name in frames):
+            return False
+        self._write(frames)
+        self._published = frames
+        return True
+
+    def run(self, engine, interval=DEFAULT_PUBLISH_SECONDS):
+        """Publish new versions every interval seconds until interrupted"""
+        while True:
+            self.publish(engine)
+            time.sleep(interval)
+
+    def _tables(self, engine):
+        # dimension tables read again without changes keep their dataframes in the cache, so they are not published again
+        return {table_name: self.cache.get(table_name, engine) for table_name in SNAPSHOT_TABLES}
+
+    def _write(self, frames):
+        name = version_name(self._next_version)
+        # files are written under a temporary name, so that a version directory is always complete
+        new_directory = os.path.join(self.directory, f'{name}.new')
+        shutil.rmtree(new_directory, ignore_errors=True)
+        os.makedirs(new_directory)
+        for (frame_name, df) in frames.items():
+            write_arrow(os.path.join(new_directory, f'{frame_name}.arrow'), df)
+        os.rename(new_directory, os.path.join(self.directory, name))
+
+        # workers see either the old or the new target of the symlink, never a missing one
+        link = os.path.join(self.directory, CURRENT)
+        if os.path.lexists(f'{link}.new'):
+            os.remove(f'{link}.new')
+        os.symlink(name, f'{link}.new')
+        os.replace(f'{link}.new', link)
+        self._next_version += 1
+
+        # files of old versions are unlinked, workers still mapping them keep reading them until they switch
+        for number in versions(self.directory)[:-(KEEP_VERSIONS + 1)]:
+            shutil.rmtree(os.path.join(self.directory, version_name(number)), ignore_errors=True)
+
+
+class SharedTables:
+    """Current version of tables published by SharedTablePublisher, attached to the table cache of a worker"""
+
+    def __init__(self, cache, sales_fact):
+        self.cache = cache
+        self.sales_fact = sales_fact
+        self._lock = threading.Lock()
+        # name of the attached version
+        self.version = None
+
+    def attach(self, directory, engine):
+        """Put tables and sales fact of the current version into the cache and sales fact, if not attached already"""
+        require_pyarrow()
+        link = os.path.join(directory, CURRENT)
+        with self._lock:
+            try:
+                version = os.readlink(link)
+            except FileNotFoundError:
+                raise RuntimeError(f'no tables are published in {directory}, start shared_tables.py first') from None
+            if version == self.version:
+                return False
+
+            version_directory = os.path.join(directory, version)
+            frames = {name: read_arrow(os.path.join(version_directory, f'{name}.arrow'))
+                      for name in SNAPSHOT_TABLES + [SALES_FACT]}
+            # published tables do not expire, they are replaced by the next version
+            for table_name in SNAPSHOT_TABLES:
+                self.cache.put(table_name, frames[table_name], keep=True)
+            self.sales_fact.put(frames[SALES_FACT], source_tables(self.cache, engine))
+            self.version = version
+            return True
+
+    def invalidate(self):
+        """Forget the attached version, so that the current one is attached again on next request"""
+        with self._lock:
+            self.version = None
+
+
+if __name__ == '__main__':
+    from database import engine
+    from schema import schema
+    from table_cache import table_cache
+    from sales_fact import SalesFact
+    from sales_refresher import SalesRefresher
+    import snapshots
+
+    parser = argparse.ArgumentParser(description='publish tables and sales fact of insights app for its worker processes')
+    parser.add_argument('directory', help='directory of published versions, e.g. /dev/shm/rsm')
+    parser.add_argument('--snapshot-dir', help='parquet snapshot which tables are first loaded from, instead of the database')
+    parser.add_argument('--interval', type=float, default=DEFAULT_PUBLISH_SECONDS, help='seconds between two publishes')
+    args = parser.parse_args()
+
+    schema.reflect()
+    if args.snapshot_dir is not None:
+        snapshots.load_snapshot(table_cache, args.snapshot_dir)
+    sales_fact = SalesFact(table_cache)
+    publisher = SharedTablePublisher(args.directory, table_cache, sales_fact, SalesRefresher(table_cache, sales_fact))
+    publisher.run(engine, args.interval)
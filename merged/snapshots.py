@@ -0,0 +1,177 @@
+# parquet snapshots of the tables read by insight endpoints
+# all tables are exported into one directory, bill and product_bill partitioned by year of the bill date,
+# and the table cache is filled from those files at startup instead of reading every table from the database,
+# bill and product_bill are then brought up to date by the sales refresher which fetches only sales made after the export
+#
+# export from the merged folder:
+# $ python snapshots.py ../snapshot
+import argparse
+import os
+import shutil
+
+import pandas as pd
+from sqlalchemy import select, Boolean, Date, DateTime, Integer, Numeric
+from sqlalchemy.types import TypeDecorator
+
+from schema import schema
+from sales_fact import SALES_TABLES
+from table_dtypes import prepare_frame
+
+# pyarrow is optional, it is only needed for exporting and loading snapshots
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+# tables kept in a snapshot, bill is exported before product_bill since years of product_bill records are taken from it
+SNAPSHOT_TABLES = ['store', 'product', 'category', 'manufacturer', 'product_lot', 'store_product', 'customer', 'bill', 'product_bill']
+
+# tables partitioned by year of the bill date, stored as <table>/year=<year>/part-0.parquet
+PARTITIONED_TABLES = SALES_TABLES
+
+# number of records fetched from the database and written at a time
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError('pyarrow is needed for parquet snapshots, install it with pip install pyarrow')
+
+
+def arrow_type(column):
+    """Return arrow type of values of a table column"""
+    column_type = column.type.impl if isinstance(column.type, TypeDecorator) else column.type
+    if isinstance(column_type, Boolean):
+        return pa.bool_()
+    if isinstance(column_type, Integer):
+        return pa.int64()
+    if isinstance(column_type, Numeric):
+        return pa.float64()
+    if isinstance(column_type, DateTime):
+        return pa.timestamp('us')
+    if isinstance(column_type, Date):
+        return pa.date32()
+    return pa.string()
+
+
+def arrow_schema(table):
+    """Return arrow schema of records of given table"""
+    return pa.schema([pa.field(column.name, arrow_type(column), nullable=column.nullable) for column in table.columns])
+
+
+def snapshot_path(directory, table_name):
+    """Return path of the file, or of the partitioned directory, holding given table in a snapshot"""
+    if table_name in PARTITIONED_TABLES:
+        return os.path.join(directory, table_name)
+    return os.path.join(directory, f'{table_name}.parquet')
+
+
+def export_table(conn, table, directory, bill_years=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Write all records of table into the snapshot directory, reading them through a server side cursor a chunk at a time
+
+    product_bill records are partitioned by bill_years, the year of each bill_id, returns that series when exporting bill
+    """
+    schema_ = arrow_schema(table)
+    path = snapshot_path(directory, table.name)
+    partitioned = table.name in PARTITIONED_TABLES
+    if partitioned:
+        os.makedirs(path)
+    # one writer for a table that is not partitioned, one for each year for a partitioned table
+    writers = {}
+    years_of_bills = []
+    try:
+        result = conn.execution_options(stream_results=True)\
+                     .execute(select([table]).order_by(*table.primary_key.columns))
+        for rows in result.partitions(chunk_size):
+            df = pd.DataFrame.from_records(rows, columns=list(result.keys()))
+            if not partitioned:
+                if None not in writers:
+                    writers[None] = pq.ParquetWriter(path, schema_)
+                writers[None].write_table(pa.Table.from_pandas(df, schema=schema_, preserve_index=False))
+                continue
+
+            if table.name == 'bill':
+                years = pd.to_datetime(df['date']).dt.year.to_numpy()
+                years_of_bills.append(pd.Series(years, index=df['bill_id'].to_numpy()))
+            else:
+                years = bill_years.reindex(df['bill_id'].to_numpy()).to_numpy()
+            for (year, year_df) in df.groupby(years):
+                if year not in writers:
+                    year_path = os.path.join(path, f'year={int(year)}')
+                    os.makedirs(year_path)
+                    writers[year] = pq.ParquetWriter(os.path.join(year_path, 'part-0.parquet'), schema_)
+                writers[year].write_table(pa.Table.from_pandas(year_df, schema=schema_, preserve_index=False))
+
+        # empty table still gets its file so that loading it gives an empty dataframe
+        if not partitioned and not writers:
+            pq.write_table(schema_.empty_table(), path)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    if table.name == 'bill':
+        return pd.concat(years_of_bills) if years_of_bills else pd.Series([], dtype='int64')
+    return None
+
+
+def export_snapshot(engine, directory, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Export all snapshot tables into directory, replacing an earlier snapshot there once the new one is complete"""
+    require_pyarrow()
+    directory = os.path.abspath(directory)
+    new_directory = f'{directory}.new'
+    shutil.rmtree(new_directory, ignore_errors=True)
+    os.makedirs(new_directory)
+
+    # year of each bill, product_bill records are partitioned by year of their bill
+    bill_years = None
+    # one transaction so that all tables are exported as they were at the same time, where the database supports it
+    with engine.connect() as conn, conn.begin():
+        for table_name in SNAPSHOT_TABLES:
+            years = export_table(conn, schema.table(table_name), new_directory, bill_years, chunk_size)
+            bill_years = years if years is not None else bill_years
+
+    # old snapshot is moved away before the new one takes its place, so a reader never sees half of a snapshot
+    old_directory = f'{directory}.old'
+    shutil.rmtree(old_directory, ignore_errors=True)
+    if os.path.exists(directory):
+        os.rename(directory, old_directory)
+    os.rename(new_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+
+
+def load_table(directory, table_name):
+    """Return dataframe of given table read from the snapshot, with the same dtypes as when loaded from the database"""
+    require_pyarrow()
+    path = snapshot_path(directory, table_name)
+    # files are memory mapped, so their pages are read once into the page cache shared by all processes
+    if table_name in PARTITIONED_TABLES:
+        # year is only in directory names, it is left out by reading the columns of the table, also when it has no years yet
+        table = pq.read_table(path, memory_map=True, partitioning='hive', schema=arrow_schema(schema.table(table_name)))
+        # years are read one after another, records are put back in primary key order which they were exported in
+        table = table.sort_by([(column.name, 'ascending') for column in schema.table(table_name).primary_key.columns])
+    else:
+        table = pq.read_table(path, memory_map=True)
+    return prepare_frame(table_name, table.to_pandas(date_as_object=False))
+
+
+def load_snapshot(cache, directory):
+    """Fill the table cache with all tables of the snapshot in directory"""
+    for table_name in SNAPSHOT_TABLES:
+        df = load_table(directory, table_name)
+        # bill and product_bill are kept current by the sales refresher, other tables are read again once their ttl expires
+        cache.put(table_name, df, keep=table_name in SALES_TABLES)
+
+
+if __name__ == '__main__':
+    from database import engine
+
+    parser = argparse.ArgumentParser(description='export tables read by insight endpoints as parquet snapshot')
+    parser.add_argument('directory', help='directory of the snapshot, replaced if it exists')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    export_snapshot(engine, args.directory, args.chunk_size)
+    engine.dispose()
@@ -0,0 +1,56 @@
+# streaming of whole tables as ndjson or as a json array
+# records are read through a server side cursor and written a chunk at a time,
+# so memory used doesn't grow with the size of the table
+# dates are encoded as epoch milliseconds like in responses built by serializers.records
+import datetime as dt
+import decimal
+import json
+
+from sqlalchemy import select
+
+from serializers import plain_value
+
+
+# number of records fetched from the cursor at a time
+DEFAULT_CHUNK_SIZE = 1000
+
+# mimetype of each streaming format
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json'
+}
+
+
+def json_default(value):
+    """Convert values which json module cannot serialize"""
+    if isinstance(value, dt.date):
+        # dates and datetimes as epoch milliseconds, same as serializers.records
+        return plain_value(value)
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(record):
+    """Return json of one table record"""
+    return json.dumps(dict(record), default=json_default)
+
+
+def stream_records(engine, table, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield all records of table ordered by primary key, as ndjson lines or as parts of a json array"""
+    # connection is kept only while streaming, the request may have ended before the response is fully sent
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True)\
+                     .execute(select([table]).order_by(*table.primary_key.columns))
+
+        if fmt == 'ndjson':
+            for records in result.mappings().partitions(chunk_size):
+                yield ''.join(dumps(record) + '\n' for record in records)
+            return
+
+        yield '['
+        separator = ''
+        for records in result.mappings().partitions(chunk_size):
+            yield separator + ','.join(dumps(record) for record in records)
+            separator = ','
+        yield ']'
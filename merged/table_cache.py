@@ -0,0 +1,144 @@
+# process-wide cache of table snapshots loaded into pandas dataframes
+# insight endpoints read their tables through this cache so that repeated requests reuse already loaded dataframes
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+from sqlalchemy import select
+
+from schema import schema
+from table_dtypes import date_columns, prepare_frame
+
+
+# default number of seconds after which a cached table is read again from the database
+DEFAULT_TTL_SECONDS = 60
+
+# default upper bound on the memory (in bytes) held by all cached dataframes
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class TableCache:
+    """Cache of table dataframes keyed by table name with ttl expiry and memory bounded lru eviction"""
+
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # table_name -> (loaded_at, size_in_bytes, dataframe, keep, columns), least recently used first
+        # columns is None when the dataframe has all columns of the table
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        # one lock per table so that concurrent misses on the same table load it only once
+        self._load_locks = dict()
+
+    def get(self, table_name, engine, columns=None):
+        """Return the dataframe for given table, loading it from the database if it is missing, expired or lacks given columns
+
+        only the given columns are read from the database, or all columns if no columns are given,
+        the returned dataframe may have more columns when other users of the table needed them
+        """
+        df = self._lookup(table_name, columns)
+        if df is not None:
+            return df
+
+        with self._load_lock(table_name):
+            # another thread may have loaded the table while we were waiting
+            df = self._lookup(table_name, columns)
+            if df is not None:
+                return df
+
+            # columns loaded earlier are read again so that the snapshot still has what other users need
+            loaded_columns = self._loaded_columns(table_name)
+            if columns is not None and loaded_columns is not None:
+                columns = loaded_columns + [column for column in columns if column not in loaded_columns]
+
+            if columns is None:
+                df = pd.read_sql_query(f'SELECT * FROM {table_name}', engine, parse_dates=date_columns(table_name))
+            else:
+                # ordered by primary key, the order SELECT * gives, since a covering index could otherwise give another order
+                table = schema.table(table_name)
+                stmt = select([table.columns[column] for column in columns]).order_by(*table.primary_key.columns)
+                df = pd.read_sql_query(stmt, engine, parse_dates=[column for column in date_columns(table_name) if column in columns])
+            df = prepare_frame(table_name, df)
+            # a table read again without changes keeps its old dataframe, so that users which check whether
+            # their tables changed by identity, like the sales fact, do not rebuild from it
+            old_df = self._cached_frame(table_name, columns)
+            if old_df is not None and df.equals(old_df):
+                df = old_df
+            self.put(table_name, df, columns=columns)
+            return df
+
+    def put(self, table_name, df, keep=False, columns=None):
+        """Store dataframe for given table, evicting least recently used tables if memory bound is exceeded
+
+        keep=True is used for tables that are kept current by someone else, such entries do not expire by ttl
+        columns are the columns of the table which the dataframe has, None if it has all of them
+        """
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            self._entries.pop(table_name, None)
+            self._entries[table_name] = (time.monotonic(), size, df, keep, list(columns) if columns is not None else None)
+            self._evict()
+
+    def invalidate(self, table_name=None):
+        """Drop given table from the cache, or every table if no name is given"""
+        with self._lock:
+            if table_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(table_name, None)
+
+    def size(self):
+        """Return the total memory in bytes held by cached dataframes"""
+        with self._lock:
+            return sum(size for (_, size, _, _, _) in self._entries.values())
+
+    def _lookup(self, table_name, columns=None):
+        with self._lock:
+            entry = self._entries.get(table_name)
+            if entry is None:
+                return None
+
+            _, _, df, _, loaded_columns = entry
+            # expired dataframe stays until it is loaded again, so that the new one can be compared with it
+            if self._expired(entry):
+                return None
+
+            # dataframe without some of the wanted columns is kept for its other users until it is loaded again
+            if loaded_columns is not None and (columns is None or not set(columns) <= set(loaded_columns)):
+                return None
+
+            # mark table as most recently used
+            self._entries.move_to_end(table_name)
+            return df
+
+    def _expired(self, entry):
+        loaded_at, _, _, keep, _ = entry
+        return not keep and self.ttl is not None and time.monotonic() - loaded_at > self.ttl
+
+    def _cached_frame(self, table_name, columns):
+        with self._lock:
+            entry = self._entries.get(table_name)
+            if entry is None or entry[4] != (list(columns) if columns is not None else None):
+                return None
+            return entry[2]
+
+    def _loaded_columns(self, table_name):
+        with self._lock:
+            entry = self._entries.get(table_name)
+            return entry[4] if entry is not None else None
+
+    def _load_lock(self, table_name):
+        with self._lock:
+            return self._load_locks.setdefault(table_name, threading.Lock())
+
+    def _evict(self):
+        # always keep the most recently added table even if it alone exceeds the bound
+        total = sum(size for (_, size, _, _, _) in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            _, (_, size, _, _, _) = self._entries.popitem(last=False)
+            total -= size
+
+
+# shared cache used by all insight endpoints of the process
+table_cache = TableCache()
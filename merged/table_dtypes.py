@@ -0,0 +1,61 @@
+# compact dtypes of table dataframes loaded for insight endpoints
+# pd.read_sql_query gives int64, float64 and python object columns, which take more memory than needed
+# and make merges and groupbys slower, so columns are converted once at load time
+#
+# ids are INT columns in the database, so they always fit in int32
+# nullable foreign keys are left as loaded, merging pandas nullable integers with int32 keys fails when values are missing
+# low cardinality strings are categoricals, high cardinality ones like product names stay python strings
+# prices and discounts stay float64 because sales totals are sums of many of them,
+# float32 keeps only about 7 significant digits and totals above a few lakhs would lose paisa
+#
+# date columns are parsed by read_sql_query itself and year and month of bill dates are computed once here,
+# so insight endpoints never parse or split dates per request
+import calendar
+
+import pandas as pd
+
+
+TABLE_DTYPES = {
+    'store': {'store_id': 'int32', 'branch_name': 'category'},
+    'category': {'category_id': 'int32', 'category_name': 'category'},
+    'manufacturer': {'manufacturer_id': 'int32'},
+    'customer': {'customer_id': 'int32', 'gender': 'category'},
+    'product': {'product_id': 'int32'},
+    'product_lot': {'product_lot_id': 'int32', 'product_id': 'int32', 'manufacture_date': 'datetime64[ns]', 'expiry_date': 'datetime64[ns]'},
+    'store_product': {'store_id': 'int32', 'product_lot_id': 'int32'},
+    'bill': {'bill_id': 'int32', 'date': 'datetime64[ns]'},
+    'product_bill': {'product_lot_id': 'int32', 'bill_id': 'int32', 'bill_date': 'datetime64[ns]'}
+}
+
+# month names are kept in alphabetical order so that grouping by month gives same order as grouping by month name strings
+MONTH_DTYPE = pd.CategoricalDtype(sorted(calendar.month_name[1:]))
+
+# date column of each table whose year and month are added as columns
+DATE_PARTS = {'bill': 'date'}
+
+
+def date_columns(table_name):
+    """Return columns of given table which are parsed as dates when loaded"""
+    return [column for (column, dtype) in TABLE_DTYPES.get(table_name, {}).items() if dtype.startswith('datetime64')]
+
+
+def apply_dtypes(table_name, df):
+    """Convert columns of a dataframe loaded from given table to their compact dtypes"""
+    dtypes = {column: dtype for (column, dtype) in TABLE_DTYPES.get(table_name, {}).items() if column in df.columns}
+    return df.astype(dtypes) if dtypes else df
+
+
+def add_date_parts(table_name, df):
+    """Add integer year and month and categorical month_name columns of the date column of given table"""
+    column = DATE_PARTS.get(table_name)
+    if column is None or column not in df.columns:
+        return df
+    dates = df[column]
+    return df.assign(year=dates.dt.year.astype('int16'),
+                     month=dates.dt.month.astype('int8'),
+                     month_name=dates.dt.month_name().astype(MONTH_DTYPE))
+
+
+def prepare_frame(table_name, df):
+    """Return dataframe loaded from given table with compact dtypes and its date parts"""
+    return add_date_parts(table_name, apply_dtypes(table_name, df))